@@ -0,0 +1,241 @@
+# Tables of baseline characteristics (replaces 101_baseline_tables.do).
+#
+# For each static extract (one per year, input_static_<date>.csv or
+# .feather), as the Stata version:
+#   - IMD 0 (unknown) is shown as 6
+#   - age is cut into 18-40, 41-60, 61-80 and >80, with the cut points and
+#     labels of the Stata version (under 18s are missing)
+#   - urban_rural is made binary, with missing counted as urban
+# and a table1_mc style table of every categorical variable is written,
+# overall (baseline_table_<year>.csv), by migration status
+# (baseline_table_migration_<year>.csv) and by IMD
+# (baseline_table_imd<year>.csv), each with a _rounded.csv version with
+# counts rounded to the nearest 5.
+#
+# The extracts are read in chunks of --chunk-size patients, with only the
+# columns needed, and each chunk is counted in a single grouped aggregation
+# over the year and every variable. All the tables of all years are margins
+# of those counts, so memory doesn't grow with the size of the extracts.
+#
+# Usage:
+#   python analysis/baseline_tables.py --output-dir output/tables \
+#       output/input_static_2019-03-01.csv output/input_static_2020-03-01.csv \
+#       output/input_static_2021-03-01.csv [--chunk-size 1000000]
+import argparse
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+COLUMNS = [
+    "age",
+    "sex",
+    "imd",
+    "urban_rural",
+    "migration_status",
+    "has_t1_diabetes",
+    "has_t2_diabetes",
+    "has_asthma",
+    "has_copd",
+]
+FLAGS = ["migration_status", "has_t1_diabetes", "has_t2_diabetes", "has_asthma", "has_copd"]
+# Tabulated variables and their row labels
+VARIABLES = {
+    "age_cat": "age_cat",
+    "sex": "sex",
+    "imd": "imd",
+    "urban_rural_bin": "Rural-Urban",
+    "has_t1_diabetes": "has_t1_diabetes",
+    "has_t2_diabetes": "has_t2_diabetes",
+    "has_asthma": "has_asthma",
+    "has_copd": "has_copd",
+}
+AGE_CUTS = [18, 40, 60, 80, 120]
+LEVEL_LABELS = {
+    "age_cat": {0: "18 - 40 years", 1: "41 - 60 years", 2: "61 - 80 years", 3: ">80 years"},
+    "urban_rural_bin": {0: "Rural", 1: "Urban"},
+}
+# Missing values of the derived variables
+MISSING = -1
+STATIC_FILE = re.compile(r"^input_static_(\d{4})-\d{2}-\d{2}\.(csv|feather)$")
+
+
+def read_chunks(filename, chunk_size):
+    """The columns needed from an extract, `chunk_size` rows at a time"""
+    filename = str(filename)
+    if filename.endswith(".feather"):
+        with pa.memory_map(filename) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                yield reader.get_batch(i).select(COLUMNS).to_pandas()
+    else:
+        yield from pd.read_csv(
+            filename, usecols=COLUMNS, dtype={"sex": str}, chunksize=chunk_size
+        )
+
+
+def numeric(values):
+    """Values as numbers, including categoricals of numbers (see columnar.py)"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categories = pd.to_numeric(values.cat.categories, errors="coerce").to_numpy(float)
+        codes = values.cat.codes.to_numpy()
+        numbers = np.where(codes >= 0, categories[codes], np.nan)
+        return pd.Series(numbers, index=values.index)
+    return pd.to_numeric(values, errors="coerce")
+
+
+def derive_variables(patients):
+    """The tabulated variables (and migration_status) of a chunk of patients"""
+    age = numeric(patients["age"])
+    # As Stata's egen cut(), at(18, 40, 60, 80, 120), icodes
+    age_cat = np.searchsorted(AGE_CUTS, age, side="right") - 1
+    age_cat[~((age >= AGE_CUTS[0]) & (age < AGE_CUTS[-1])).to_numpy()] = MISSING
+    imd = numeric(patients["imd"])
+    urban_rural = numeric(patients["urban_rural"])
+    derived = pd.DataFrame(
+        {
+            "age_cat": age_cat.astype("int8"),
+            "sex": patients["sex"].astype(str).where(patients["sex"].notna(), ""),
+            "imd": imd.replace(0, 6).fillna(MISSING).astype("int8"),
+            "urban_rural_bin": ((urban_rural <= 4) | urban_rural.isna()).astype("int8"),
+        }
+    )
+    for flag in FLAGS:
+        derived[flag] = numeric(patients[flag]).fillna(MISSING).astype("int8")
+    return derived
+
+
+def count_patients(files, chunk_size=1_000_000):
+    """Number of patients with each combination of year and variables"""
+    counts = None
+    for year, filename in files:
+        for chunk in read_chunks(filename, chunk_size):
+            derived = derive_variables(chunk)
+            derived.insert(0, "year", year)
+            chunk_counts = derived.groupby(list(derived.columns)).size()
+            if counts is None:
+                counts = chunk_counts
+            else:
+                counts = counts.add(chunk_counts, fill_value=0)
+    return counts.astype("int64")
+
+
+def is_missing(level):
+    return level in (MISSING, "")
+
+
+def present(counts, level):
+    """Counts of the rows which aren't missing `level`"""
+    return counts[[not is_missing(value) for value in counts.index.get_level_values(level)]]
+
+
+def format_percent(n, total):
+    """As table1_mc: 1dp if the total is at least 100, with a space before < 10%"""
+    percent = 100 * n / total if total else np.nan
+    formatted = f"{percent:.1f}" if total >= 100 else f"{percent:.0f}"
+    if percent < 10 and formatted not in ("10", "10.0"):
+        formatted = " " + formatted
+    return f"({formatted}%)"
+
+
+def sort_levels(levels):
+    return sorted(levels, key=lambda level: (isinstance(level, str), level))
+
+
+def table1(counts, variables, by=None):
+    """
+    A table1_mc style table of one year's counts: a factor and level row per
+    level of each variable, with n and (%) columns for each group of `by`
+    """
+    groups = sort_levels(counts.index.unique(by)) if by else [1]
+    group_counts = counts.groupby(level=by).sum() if by else pd.Series({1: counts.sum()})
+    rows = [dict(factor="", level="")]
+    for group in groups:
+        rows[0][f"_columna_{group}"] = f"N={group_counts.get(group, 0):,}"
+        rows[0][f"_columnb_{group}"] = ""
+    for variable in variables:
+        # Patients missing the variable aren't counted, as in table1_mc
+        tabulated = (
+            present(counts, variable)
+            .groupby(level=[by, variable] if by else variable)
+            .sum()
+        )
+        levels = sort_levels(tabulated.index.unique(variable))
+        for i, level in enumerate(levels):
+            row = dict(
+                factor=VARIABLES[variable] if i == 0 else "",
+                level=LEVEL_LABELS.get(variable, {}).get(level, str(level)),
+            )
+            for group in groups:
+                in_group = tabulated.loc[group] if by else tabulated
+                n = int(in_group.get(level, 0))
+                row[f"_columna_{group}"] = f"{n:,}"
+                row[f"_columnb_{group}"] = format_percent(n, in_group.sum())
+            rows.append(row)
+    return pd.DataFrame(rows), groups
+
+
+def rounded(table, groups, single=False):
+    """The counts rounded to the nearest 5, and the percentages as numbers"""
+    columns = dict(factor=table["factor"], level=table["level"])
+    for group in groups:
+        suffix = "" if single else str(group)
+        counts = table[f"_columna_{group}"].str.replace(r"^N=|,", "", regex=True)
+        n = pd.to_numeric(counts, errors="coerce")
+        # Stata's round() rounds halves up
+        columns[f"rounded_n{suffix}"] = (np.floor(n / 5 + 0.5) * 5).astype("Int64")
+        columns[f"percent{suffix}"] = pd.to_numeric(
+            table[f"_columnb_{group}"].str.strip("()% "), errors="coerce"
+        )
+    return pd.DataFrame(columns)
+
+
+def write_tables(counts, output_dir):
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for year in counts.index.unique("year"):
+        year_counts = counts.xs(year, level="year")
+        tables = {
+            f"baseline_table_{year}": (list(VARIABLES), None),
+            f"baseline_table_migration_{year}": (list(VARIABLES), "migration_status"),
+            f"baseline_table_imd{year}": (
+                [variable for variable in VARIABLES if variable != "imd"],
+                "imd",
+            ),
+        }
+        for name, (variables, by) in tables.items():
+            tabulated = present(year_counts, by) if by else year_counts
+            table, groups = table1(tabulated, variables, by)
+            table.to_csv(output_dir / f"{name}.csv", index=False)
+            # The Stata version only kept IMD 1 to 5 in the rounded table
+            groups = [group for group in groups if not (by == "imd" and group == 6)]
+            rounded(table, groups, single=by is None).to_csv(
+                output_dir / f"{name}_rounded.csv", index=False
+            )
+
+
+def static_files(filenames):
+    """(year, filename) of each static extract"""
+    files = []
+    for filename in filenames:
+        match = STATIC_FILE.match(Path(filename).name)
+        if not match:
+            raise ValueError(f"{filename} isn't an input_static_<date> file")
+        files.append((int(match.group(1)), filename))
+    return sorted(files)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--output-dir", default="output/tables")
+    parser.add_argument("--chunk-size", type=int, default=1_000_000)
+    args = parser.parse_args()
+    counts = count_patients(static_files(args.files), args.chunk_size)
+    write_tables(counts, args.output_dir)
+
+
+if __name__ == "__main__":
+    main()
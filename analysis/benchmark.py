@@ -0,0 +1,347 @@
+# Benchmarks every stage of the pipeline at fixed population sizes.
+#
+# For each --sizes population (1e4, 1e6 or 1e7 patients) over a fixed 25
+# months (March 2019 to March 2021, covering the baseline snapshot dates and
+# both sides of the pandemic), runs in a scratch directory:
+#   - extract_<study definition>: cohortextractor's dummy data extraction of
+#     each study definition, over the study definition's own months
+#   - outcome_events: the partitions of outcome events (outcome_events.py)
+#     from the combined months extract
+#   - split_months: split_months.py on the combined months extract, with
+#     the outcome events and --pack-flags, as split_study_population
+#   - split_static_snapshots: snapshots.py on the static snapshots extract
+#   - dummy_data: the monthly input files of every cohort (dummy_data.py)
+#   - measures_<cohort>: measures.py, adding to a measure store
+#   - poisson_prep, its_models and graphs from the store
+#   - baseline_tables, from static extracts made of the general cohort's
+#     input files at the snapshot dates (with a random urban_rural)
+# Extraction, and the outcome_events and split stages which read its
+# extracts, only run up to COHORTEXTRACTOR_LIMIT (1e6) patients, as
+# cohortextractor holds the whole population in memory: extraction at 1e7
+# is not covered, and at 1e7 only the stages from dummy_data on run.
+#
+# Each stage runs in its own process, and its wall time and peak memory
+# (the largest resident set of the stage's processes) are appended to
+# --results as JSON lines with the commit, host and size.
+#
+# Each stage is compared with the latest result for the same stage, size
+# and host from a different commit (or from --baseline). The benchmark fails
+# if a stage is more than --threshold slower or bigger, ignoring changes of
+# under --min-seconds or --min-memory MB, which are noise.
+#
+# Usage (from the repository root):
+#   python analysis/benchmark.py [--sizes 1e4 1e6 1e7] \
+#       [--results benchmarks/results.jsonl] [--threshold 0.25] \
+#       [--baseline COMMIT] [--stages measures graphs ...] [--work-dir DIR]
+# --stages runs only the stages starting with the names given, which need
+# the outputs of the earlier stages in --work-dir.
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from cohorts import COHORTS
+from columnar import read_frame, write_frame
+from snapshots import SNAPSHOT_DATES, STATIC_COLUMNS
+
+ANALYSIS_DIR = Path(__file__).parent
+ROOT = ANALYSIS_DIR.parent
+SIZES = {"1e4": 10**4, "1e6": 10**6, "1e7": 10**7}
+FIRST_MONTH = "2019-03-01"
+LAST_MONTH = "2021-03-01"
+STUDY_DEFINITIONS = [
+    "study_definition",
+    "study_definition_dm",
+    "study_definition_resp",
+    "study_definition_static",
+    "study_definition_combined_months",
+    "study_definition_outcome_events",
+    "study_definition_static_snapshots",
+]
+# Extracts read by later stages, written as CSV as in project.yaml
+CSV_EXTRACTS = {
+    "study_definition_combined_months": "input_combined_months.csv",
+    "study_definition_static_snapshots": "input_static_snapshots.csv",
+}
+# Largest population cohortextractor's dummy data is benchmarked at
+COHORTEXTRACTOR_LIMIT = 10**6
+
+
+def python(script, *args):
+    """Command running one of our scripts"""
+    return [sys.executable, str(ANALYSIS_DIR / script), *map(str, args)]
+
+
+def extract_file(work_dir, study_definition):
+    return work_dir / "extracts" / study_definition / CSV_EXTRACTS[study_definition]
+
+
+def stage_commands(size, work_dir):
+    """(stage, command) of each stage for a population size, in order"""
+    measures_dir = work_dir / "measures"
+    store = f"--store={measures_dir / 'measures.feather'}"
+    stages = []
+    if size <= COHORTEXTRACTOR_LIMIT:
+        cohortextractor = str(Path(sys.executable).parent / "cohortextractor")
+        for study_definition in STUDY_DEFINITIONS:
+            output_format = "csv" if study_definition in CSV_EXTRACTS else "feather"
+            command = [
+                cohortextractor,
+                "generate_cohort",
+                f"--study-definition={study_definition}",
+                f"--expectations-population={size}",
+                f"--output-dir={work_dir / 'extracts' / study_definition}",
+                f"--output-format={output_format}",
+            ]
+            stages.append((f"extract_{study_definition}", command))
+        outcome_events = work_dir / "outcome_events"
+        stages += [
+            (
+                "outcome_events",
+                python(
+                    "outcome_events.py",
+                    f"--input={extract_file(work_dir, 'study_definition_combined_months')}",
+                    f"--output-dir={outcome_events}",
+                ),
+            ),
+            (
+                "split_months",
+                python(
+                    "split_months.py",
+                    f"--input={extract_file(work_dir, 'study_definition_combined_months')}",
+                    f"--outcome-events={outcome_events}",
+                    f"--output-dir={work_dir / 'split'}",
+                    "--output-format=feather",
+                    "--pack-flags",
+                ),
+            ),
+            (
+                "split_static_snapshots",
+                python(
+                    "snapshots.py",
+                    f"--input={extract_file(work_dir, 'study_definition_static_snapshots')}",
+                    f"--output-dir={work_dir / 'snapshots'}",
+                    "--output-format=feather",
+                ),
+            ),
+        ]
+    stages.append(
+        (
+            "dummy_data",
+            python(
+                "dummy_data.py",
+                f"--output-dir={measures_dir}",
+                f"--population-size={size}",
+                f"--start={FIRST_MONTH}",
+                f"--end={LAST_MONTH}",
+            ),
+        )
+    )
+    for name, cohort in COHORTS.items():
+        cohort_dir = measures_dir / cohort["subdir"]
+        command = python(
+            "measures.py",
+            f"--cohort={name}",
+            f"--input-dir={cohort_dir}",
+            f"--output-dir={cohort_dir}",
+            store,
+        )
+        stages.append((f"measures_{name}", command))
+    poisson_dir = work_dir / "poisson"
+    stages += [
+        ("poisson_prep", python("poisson_prep.py", store, f"--output-dir={work_dir}")),
+        (
+            "its_models",
+            python(
+                "its_models.py",
+                f"--poisson-dir={poisson_dir}",
+                f"--output={poisson_dir / 'its_models.csv'}",
+            ),
+        ),
+        ("graphs", python("graphs.py", store, f"--output-dir={work_dir / 'graphs'}")),
+        (
+            "baseline_tables",
+            python(
+                "baseline_tables.py",
+                f"--output-dir={work_dir / 'tables'}",
+                *static_files(work_dir),
+            ),
+        ),
+    ]
+    return stages
+
+
+def static_files(work_dir):
+    static_dir = work_dir / "static"
+    return [static_dir / f"input_static_{date}.feather" for date in SNAPSHOT_DATES]
+
+
+def write_static_inputs(work_dir, seed=0):
+    """Static extracts for baseline_tables from the general cohort's inputs"""
+    rng = np.random.default_rng(seed)
+    for date, filename in zip(SNAPSHOT_DATES, static_files(work_dir)):
+        patients = read_frame(work_dir / "measures" / f"input_{date}.feather")
+        columns = [column for column in STATIC_COLUMNS if column in patients.columns]
+        static = patients[[*columns, "patient_id"]].copy()
+        static["urban_rural"] = rng.integers(1, 9, len(static)).astype(str)
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        write_frame(static[[*STATIC_COLUMNS, "patient_id"]], filename)
+
+
+def run_stage(command, log):
+    """Wall seconds and peak resident memory (bytes) of a command"""
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+    # wait4 gives the resource usage of this child alone
+    _, status, usage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode:
+        raise RuntimeError(f"{' '.join(command)} failed, see {log.name}")
+    return seconds, usage.ru_maxrss * 1024
+
+
+def current_commit():
+    """The commit checked out, marked as dirty if there are local changes"""
+
+    def git(*args):
+        return subprocess.run(
+            ["git", *args], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+
+    commit = git("rev-parse", "--short", "HEAD")
+    if git("status", "--porcelain", "--untracked-files=no"):
+        commit += "-dirty"
+    return commit
+
+
+def read_results(results_file):
+    if not Path(results_file).exists():
+        return []
+    with open(results_file) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def previous_result(results, record, baseline=None):
+    """The latest comparable result from another (or the baseline) commit"""
+    for previous in reversed(results):
+        if (
+            previous["size"] == record["size"]
+            and previous["stage"] == record["stage"]
+            and previous["host"] == record["host"]
+            and previous["commit"] != record["commit"]
+            and (baseline is None or previous["commit"].startswith(baseline))
+        ):
+            return previous
+    return None
+
+
+def regressions(record, previous, threshold, min_seconds, min_memory):
+    """What got worse in a stage: time and/or memory, as messages"""
+    if previous is None:
+        return []
+    found = []
+    limits = [
+        ("seconds", min_seconds, "{:.1f}s"),
+        ("peak_rss_mb", min_memory, "{:.0f}MB"),
+    ]
+    for key, minimum, style in limits:
+        now, before = record[key], previous[key]
+        if now > before * (1 + threshold) and now - before > minimum:
+            found.append(
+                f"{record['stage']} at {record['size']}: {style.format(now)} against "
+                f"{style.format(before)} at {previous['commit']}"
+            )
+    return found
+
+
+def benchmark(
+    sizes,
+    results_file,
+    work_dir=None,
+    stages=None,
+    threshold=0.25,
+    min_seconds=1.0,
+    min_memory=50.0,
+    baseline=None,
+):
+    results_file = Path(results_file)
+    results_file.parent.mkdir(parents=True, exist_ok=True)
+    results = read_results(results_file)
+    commit = current_commit()
+    host = platform.node()
+    found = []
+    for size_name in sizes:
+        size = SIZES[size_name]
+        size_dir = Path(work_dir or tempfile.mkdtemp(prefix="benchmark")) / size_name
+        size_dir.mkdir(parents=True, exist_ok=True)
+        print(f"{size_name} patients, in {size_dir}")
+        print(f"  {'stage':42}{'seconds':>10}{'before':>10}{'peak MB':>10}{'before':>10}")
+        for stage, command in stage_commands(size, size_dir):
+            if stages and not any(stage.startswith(prefix) for prefix in stages):
+                continue
+            if stage == "baseline_tables":
+                write_static_inputs(size_dir)
+            with open(size_dir / f"{stage}.log", "w") as log:
+                seconds, peak_rss = run_stage(command, log)
+            record = dict(
+                commit=commit,
+                host=host,
+                recorded=datetime.datetime.now().isoformat(timespec="seconds"),
+                size=size_name,
+                months=FIRST_MONTH + " to " + LAST_MONTH,
+                stage=stage,
+                seconds=round(seconds, 3),
+                peak_rss_mb=round(peak_rss / 2**20, 1),
+            )
+            previous = previous_result(results, record, baseline)
+            before = previous or dict(seconds=float("nan"), peak_rss_mb=float("nan"))
+            print(
+                f"  {stage:42}{seconds:>10.1f}{before['seconds']:>10.1f}"
+                f"{record['peak_rss_mb']:>10.0f}{before['peak_rss_mb']:>10.0f}"
+            )
+            found += regressions(record, previous, threshold, min_seconds, min_memory)
+            with open(results_file, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        if work_dir is None:
+            shutil.rmtree(size_dir.parent)
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=["1e4"])
+    parser.add_argument("--results", default="benchmarks/results.jsonl")
+    parser.add_argument("--work-dir", help="kept after the run, unlike the default")
+    parser.add_argument("--stages", nargs="+")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    parser.add_argument("--min-seconds", type=float, default=1.0)
+    parser.add_argument("--min-memory", type=float, default=50.0, help="in MB")
+    parser.add_argument("--baseline", help="commit to compare with")
+    args = parser.parse_args()
+    found = benchmark(
+        args.sizes,
+        args.results,
+        work_dir=args.work_dir,
+        stages=args.stages,
+        threshold=args.threshold,
+        min_seconds=args.min_seconds,
+        min_memory=args.min_memory,
+        baseline=args.baseline,
+    )
+    if found:
+        print("Regressions:", *found, sep="\n  ")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# Times importing each study definition, building its `study` (which is
+# deferred until cohortextractor asks for it, see lazy_study), and loading
+# every codelist, in a fresh interpreter with an empty and then a warm
+# codelist cache (see codelists.py). cohortextractor is imported before the
+# timer starts, so the times are those of our code.
+#
+# Usage (from the repository root):
+#   python analysis/benchmark_imports.py [--repeat 5]
+import argparse
+import shutil
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+from codelists import CACHE_DIR
+
+ANALYSIS_DIR = Path(__file__).parent
+MODULES = [
+    "study_definition",
+    "study_definition_dm",
+    "study_definition_resp",
+    "study_definition_static",
+    "study_definition_combined",
+    "study_definition_combined_months",
+]
+TIMER = """
+import sys, time
+sys.path.insert(0, {analysis_dir!r})
+import cohortextractor
+start = time.perf_counter()
+{statement}
+print(time.perf_counter() - start)
+"""
+LOAD_ALL = "import codelists; [codelists.load_codelist(name) for name in codelists.__all__]"
+
+
+def time_statement(statement):
+    script = TIMER.format(analysis_dir=str(ANALYSIS_DIR), statement=statement)
+    output = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.split()[-1])
+
+
+def benchmark(statement, repeat):
+    """Median seconds with an empty cache, then with a warm one"""
+    cold = []
+    for _ in range(repeat):
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+        cold.append(time_statement(statement))
+    warm = [time_statement(statement) for _ in range(repeat)]
+    return statistics.median(cold), statistics.median(warm)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    statements = []
+    for module in MODULES:
+        statements.append((f"import {module}", f"import {module}"))
+        statements.append(("  and build study", f"import {module}; {module}.study"))
+    statements.append(("all codelists", LOAD_ALL))
+    print(f"{'':40}{'no cache':>12}{'cached':>12}")
+    for name, statement in statements:
+        cold, warm = benchmark(statement, args.repeat)
+        print(f"{name:40}{cold * 1000:>10.1f}ms{warm * 1000:>10.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+# The codelist CSVs of the study, and the outcome codelists derived from
+# them, read as plain lists of codes.
+#
+# This module has no cohortextractor dependency, so that the python:latest
+# stages can classify recorded codes into outcomes (see codelist_index.py);
+# codelists.py loads the same codelists as cohortextractor codelists.
+import csv
+import io
+from functools import lru_cache
+
+CODELIST_FILES = dict(
+    # Diagnosis codes for GP records
+    # Diabetes - type 1 & 2
+    t1dm_codes=dict(
+        filename="codelists/opensafely-type-1-diabetes.csv",
+        system="ctv3",
+        column="CTV3ID",
+    ),
+    t2dm_codes=dict(
+        filename="codelists/opensafely-type-2-diabetes.csv",
+        system="ctv3",
+        column="CTV3ID",
+    ),
+    # Respiratory disease - asthma and COPD - update to SNOMED?
+    asthma_codes=dict(
+        filename="codelists/opensafely-current-asthma.csv",
+        system="ctv3",
+        column="CTV3ID",
+    ),
+    copd_codes=dict(
+        filename="codelists/opensafely-current-copd.csv",
+        system="ctv3",
+        column="CTV3ID",
+    ),
+    # ICD codes for hospitalisations and deaths
+    # Diabetes outcomes - DM or ketoacidosis
+    dm_keto_icd_codes=dict(
+        filename="codelists/opensafely-diabetic-ketoacidosis-secondary-care.csv",
+        system="icd10",
+        column="icd10_code",
+    ),
+    # confirming type 1 & type 2 codes
+
+    # CVD outcomes - MI, stroke, TIA, unstable angina, heart failure & vte
+    mi_icd_codes=dict(
+        filename="codelists/opensafely-cardiovascular-secondary-care.csv",
+        system="icd10",
+        column="icd",
+        category_column="mi",
+    ),
+    stroke_icd_codes=dict(
+        filename="codelists/opensafely-stroke-secondary-care.csv",
+        system="icd10",
+        column="icd",
+    ),
+    heart_failure_icd_codes=dict(
+        filename="codelists/opensafely-cardiovascular-secondary-care.csv",
+        system="icd10",
+        column="icd",
+        category_column="heartfailure",
+    ),
+    vte_icd_codes=dict(
+        filename="codelists/opensafely-venous-thromboembolic-disease-hospital.csv",
+        system="icd10",
+        column="ICD_code",
+    ),
+    # Respiratory outcomes
+    asthma_exacerbation_icd_codes=dict(
+        filename="codelists/opensafely-asthma-exacerbation-secondary-care.csv",
+        system="icd10",
+        column="code",
+    ),
+    copd_icd_codes=dict(
+        filename="codelists/opensafely-copd-secondary-care.csv",
+        system="icd10",
+        column="code",
+    ),
+    copd_exacerbation_icd_codes=dict(
+        filename="codelists/opensafely-copd-exacerbation.csv",
+        system="icd10",
+        column="code",
+    ),
+    lrti_icd_codes=dict(
+        filename="codelists/opensafely-lower-respiratory-tract-infection-secondary-care.csv",
+        system="icd10",
+        column="code",
+    ),
+    # Mental health outcomes
+    depression_icd_codes=dict(
+        filename="codelists/user-emilyherrett-depression_icd10.csv",
+        system="icd10",
+        column="code",
+    ),
+    severe_mental_illness_icd_codes=dict(
+        filename="codelists/user-emilyherrett-severe_mental_illness_icd10.csv",
+        system="icd10",
+        column="code",
+    ),
+    anxiety_icd_codes=dict(
+        filename="codelists/user-emilyherrett-anxiety_icd10.csv",
+        system="icd10",
+        column="code",
+    ),
+    ocd_icd_codes=dict(
+        filename="codelists/user-emilyherrett-ocd_icd10.csv",
+        system="icd10",
+        column="code",
+    ),
+    eating_disorder_icd_codes=dict(
+        filename="codelists/user-emilyherrett-eating_disorder_icd10.csv",
+        system="icd10",
+        column="code",
+    ),
+    self_harm_icd_codes=dict(
+        filename="codelists/user-emilyherrett-self_harm_icd10.csv",
+        system="icd10",
+        column="code",
+    ),
+    suicide_icd_codes=dict(
+        filename="codelists/user-hjforbes-suicide-icd-10.csv",
+        system="icd10",
+        column="code",
+    ),
+    migration_codes=dict(
+        filename="codelists/user-ruthcostello-migration-status-codes.csv",
+        system="snomed",
+        column="code",
+    ),
+)
+
+# Outcome codelists derived from the above: the codes of one category of a
+# codelist, a list of codes, or the codes of several codelists combined
+DERIVED_CODELISTS = dict(
+    # Category 1 codes of the cardiovascular codelist
+    mi_outcome_icd_codes=dict(codelist="mi_icd_codes", category="1"),
+    heart_failure_outcome_icd_codes=dict(codelist="heart_failure_icd_codes", category="1"),
+    # Create ICD-10 codelists for type 1 and type 2 diabetes
+    # Remove once codelists are on opencodelists
+    t1dm_icd_codes=dict(codes=["E10"], system="icd10"),
+    t2dm_icd_codes=dict(codes=["E11"], system="icd10"),
+    # All mental health outcomes
+    all_mh_codes=dict(
+        combine=[
+            "depression_icd_codes",
+            "anxiety_icd_codes",
+            "severe_mental_illness_icd_codes",
+            "self_harm_icd_codes",
+            "eating_disorder_icd_codes",
+            "ocd_icd_codes",
+            "suicide_icd_codes",
+        ]
+    ),
+)
+
+
+def parse_codes(contents, column="code", category_column=None):
+    """
+    The codes of a codelist CSV, as (code, category) if `category_column`,
+    keeping the first of any repeats
+    """
+    codes = []
+    for row in csv.DictReader(io.StringIO(contents)):
+        code = row[column].strip()
+        # Ignore blanks
+        if not code:
+            continue
+        if category_column:
+            codes.append((code, row[category_column].strip()))
+        else:
+            codes.append(code)
+    return list(dict.fromkeys(codes))
+
+
+def codelist_system(name):
+    derived = DERIVED_CODELISTS.get(name, {})
+    if "system" in derived:
+        return derived["system"]
+    if "combine" in derived:
+        return codelist_system(derived["combine"][0])
+    return CODELIST_FILES[derived.get("codelist", name)]["system"]
+
+
+@lru_cache(maxsize=None)
+def read_codes(name):
+    """The codes of a codelist, without any categories, as codelists.py loads it"""
+    derived = DERIVED_CODELISTS.get(name, {})
+    if "codes" in derived:
+        return tuple(derived["codes"])
+    if "combine" in derived:
+        return tuple(
+            dict.fromkeys(code for combined in derived["combine"] for code in read_codes(combined))
+        )
+    spec = CODELIST_FILES[derived.get("codelist", name)]
+    with open(spec["filename"]) as f:
+        codes = parse_codes(f.read(), spec.get("column", "code"), spec.get("category_column"))
+    if "category" in derived:
+        return tuple(code for code, category in codes if category == derived["category"])
+    if spec.get("category_column"):
+        return tuple(code for code, _ in codes)
+    return tuple(codes)
@@ -0,0 +1,143 @@
+# Compiled index over every ICD-10 outcome codelist.
+#
+# Each outcome codelist gets a bit, and each code maps to the bitmask of the
+# codelists containing it, so a single pass over a column of diagnosis codes
+# classifies every row into all the outcomes at once:
+#
+#   index = admissions_index()
+#   masks = index.classify(spells["primary_diagnosis"])
+#   flags = index.flags(masks)  # one 0/1 column per outcome
+#
+# Codes are matched the way cohortextractor matches them on the TPP backend:
+# hospital diagnoses by prefix (a codelist code of "I21" matches "I210"),
+# so the index looks up each prefix of a recorded code, and death
+# certificate causes exactly. Each distinct recorded code is only looked up
+# once per column. The codelists are read as plain codes (codelist_files.py),
+# so the index can be used without cohortextractor.
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from codelist_files import codelist_system, read_codes
+
+# Outcome name -> codelist name (see codelists.py), for the admissions and
+# deaths outcomes of all three cohorts
+OUTCOME_CODELISTS = {
+    "mi": "mi_outcome_icd_codes",
+    "stroke": "stroke_icd_codes",
+    "heart_failure": "heart_failure_outcome_icd_codes",
+    "vte": "vte_icd_codes",
+    "depression": "depression_icd_codes",
+    "anxiety": "anxiety_icd_codes",
+    "smi": "severe_mental_illness_icd_codes",
+    "self_harm": "self_harm_icd_codes",
+    "eating_dis": "eating_disorder_icd_codes",
+    "ocd": "ocd_icd_codes",
+    "mh": "all_mh_codes",
+    "dmt1": "t1dm_icd_codes",
+    "dmt2": "t2dm_icd_codes",
+    "dm_keto": "dm_keto_icd_codes",
+    "asthma_exac": "asthma_exacerbation_icd_codes",
+    "copd_exac": "copd_exacerbation_icd_codes",
+    "copd": "copd_icd_codes",
+    "lrti": "lrti_icd_codes",
+}
+
+# Separator between the codes in a list of all diagnoses, as in
+# cohortextractor's with_these_diagnoses pattern
+CODE_SEPARATOR = re.compile(r"[^A-Za-z0-9]+")
+
+
+def codes_of(codelist):
+    return [item[0] if codelist.has_categories else item for item in codelist]
+
+
+def outcome_codes(outcome):
+    """The codes of an outcome's codelist"""
+    return read_codes(OUTCOME_CODELISTS[outcome])
+
+
+class CodelistIndex:
+    """Map each code to the bitmask of the codelists (lists of codes) which contain it"""
+
+    def __init__(self, codelists, match_prefixes):
+        if len(codelists) > 64:
+            raise ValueError("At most 64 codelists can be indexed")
+        self.names = list(codelists)
+        self.match_prefixes = match_prefixes
+        self.table = {}
+        for bit, codes in enumerate(codelists.values()):
+            for code in codes:
+                self.table[code] = self.table.get(code, 0) | (1 << bit)
+        self.code_lengths = sorted({len(code) for code in self.table})
+
+    def bit(self, name):
+        return 1 << self.names.index(name)
+
+    def lookup(self, code):
+        """Bitmask of the codelists matching one recorded code"""
+        if not isinstance(code, str) or not code:
+            return 0
+        if not self.match_prefixes:
+            return self.table.get(code, 0)
+        mask = 0
+        for length in self.code_lengths:
+            if length > len(code):
+                break
+            mask |= self.table.get(code[:length], 0)
+        return mask
+
+    def lookup_all(self, codes):
+        """Bitmask of the codelists matching any code in a list of codes"""
+        if not isinstance(codes, str):
+            return 0
+        mask = 0
+        for code in CODE_SEPARATOR.split(codes):
+            mask |= self.lookup(code)
+        return mask
+
+    def classify(self, codes, all_diagnoses=False):
+        """Bitmasks (uint64) for a column of recorded codes"""
+        codes = pd.Series(codes, dtype="object")
+        values, uniques = pd.factorize(codes)
+        lookup = self.lookup_all if all_diagnoses else self.lookup
+        masks = np.fromiter(
+            (lookup(code) for code in uniques), dtype="uint64", count=len(uniques)
+        )
+        # Missing codes factorize to -1; give them an empty mask
+        masks = np.append(masks, np.uint64(0))
+        return masks[values]
+
+    def flags(self, masks, names=None):
+        """One 0/1 column per outcome from an array of bitmasks"""
+        names = names or self.names
+        return pd.DataFrame(
+            {
+                name: ((masks & np.uint64(self.bit(name))) != 0).astype("uint8")
+                for name in names
+            }
+        )
+
+
+def outcome_codelists():
+    codelists = {}
+    for outcome, name in OUTCOME_CODELISTS.items():
+        system = codelist_system(name)
+        if system != "icd10":
+            raise ValueError(f"Only ICD-10 codelists can be indexed, not {system}")
+        codelists[outcome] = outcome_codes(outcome)
+    return codelists
+
+
+@lru_cache(maxsize=None)
+def admissions_index():
+    """Index for hospital diagnoses, matched by prefix"""
+    return CodelistIndex(outcome_codelists(), match_prefixes=True)
+
+
+@lru_cache(maxsize=None)
+def deaths_index():
+    """Index for death certificate causes, matched exactly"""
+    return CodelistIndex(outcome_codelists(), match_prefixes=False)
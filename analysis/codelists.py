@@ -1,116 +1,90 @@
-from cohortextractor import codelist_from_csv, codelist
+# Codelists are loaded lazily, the first time they are imported by name
+# (`from codelists import asthma_codes`), so a study definition only reads
+# the CSVs it uses. Repeated codes (the CTV3 codelists list each code once
+# per CTV3Source) are dropped, and each parsed codelist is cached in
+# codelists/.cache under a hash of the CSV file and cohortextractor version,
+# so unchanged files aren't parsed again. See benchmark_imports.py for the
+# effect on import time. The codelists themselves are listed in
+# codelist_files.py.
+import hashlib
+import os
+import pickle
+import sys
+from functools import lru_cache
+from pathlib import Path
 
-# Diagnosis codes for GP records
-# Diabetes - type 1 & 2
-t1dm_codes= codelist_from_csv(
-    "codelists/opensafely-type-1-diabetes.csv",
-    system="ctv3",
-    column="CTV3ID",)
-t2dm_codes= codelist_from_csv(
-    "codelists/opensafely-type-2-diabetes.csv",
-    system="ctv3",
-    column="CTV3ID",)
-# Respiratory disease - asthma and COPD - update to SNOMED?
-asthma_codes = codelist_from_csv(
-    "codelists/opensafely-current-asthma.csv",
-    system="ctv3",
-    column="CTV3ID",)
-copd_codes = codelist_from_csv(
-    "codelists/opensafely-current-copd.csv",
-    system="ctv3",
-    column="CTV3ID",)
+import cohortextractor
+from cohortextractor import (
+    codelist,
+    combine_codelists,
+    filter_codes_by_category,
+)
 
-# ICD codes for hospitalisations and deaths
-# Diabetes outcomes - DM or ketoacidosis
-dm_keto_icd_codes = codelist_from_csv(
-    "codelists/opensafely-diabetic-ketoacidosis-secondary-care.csv",
-    system="icd10",
-    column="icd10_code",)
-    # confirming type 1 & type 2 codes
+from codelist_files import CODELIST_FILES, DERIVED_CODELISTS, parse_codes
 
-# CVD outcomes - MI, stroke, TIA, unstable angina, heart failure & vte
-mi_icd_codes = codelist_from_csv(
-    "codelists/opensafely-cardiovascular-secondary-care.csv",
-    system="icd10",
-    column="icd",
-    category_column="mi",
-)
-stroke_icd_codes = codelist_from_csv(
-    "codelists/opensafely-stroke-secondary-care.csv",
-    system="icd10",
-    column="icd",)
-heart_failure_icd_codes = codelist_from_csv(
-    "codelists/opensafely-cardiovascular-secondary-care.csv",
-    system="icd10",
-    column="icd",
-    category_column="heartfailure",)
-vte_icd_codes = codelist_from_csv(
-    "codelists/opensafely-venous-thromboembolic-disease-hospital.csv",
-    system="icd10",
-    column="ICD_code",)
-# Respiratory outcomes
-asthma_exacerbation_icd_codes = codelist_from_csv(
-    "codelists/opensafely-asthma-exacerbation-secondary-care.csv",
-    system="icd10",
-    column="code",)
+CACHE_DIR = Path("codelists/.cache")
+# Bump to invalidate cached codelists if parse_codes() changes
+CACHE_VERSION = 1
+# Cached codelists are pickled cohortextractor objects, so they're kept per
+# Python and cohortextractor version
+CACHE_NAMESPACE = (CACHE_VERSION, sys.version_info[:2], cohortextractor.__version__)
 
-copd_icd_codes = codelist_from_csv(
-    "codelists/opensafely-copd-secondary-care.csv",
-    system="icd10",
-    column="code",)
-copd_exacerbation_icd_codes = codelist_from_csv(
-    "codelists/opensafely-copd-exacerbation.csv",
-    system="icd10",
-    column="code",)
-lrti_icd_codes = codelist_from_csv(
-    "codelists/opensafely-lower-respiratory-tract-infection-secondary-care.csv",
-    system="icd10",
-    column="code",)
+# `from codelists import *` still works, but loads every codelist
+__all__ = [*CODELIST_FILES, *DERIVED_CODELISTS]
 
-# Mental health outcomes
-depression_icd_codes = codelist_from_csv(
-    "codelists/user-emilyherrett-depression_icd10.csv",
-    system="icd10",
-    column="code",)
 
-severe_mental_illness_icd_codes = codelist_from_csv(
-    "codelists/user-emilyherrett-severe_mental_illness_icd10.csv",
-    system="icd10",
-    column="code",
-)
+def parse_codelist(contents, system, column="code", category_column=None):
+    """As cohortextractor's codelist_from_csv, keeping the first of any repeats"""
+    return codelist(parse_codes(contents, column, category_column), system)
 
-anxiety_icd_codes = codelist_from_csv(
-    "codelists/user-emilyherrett-anxiety_icd10.csv",
-    system="icd10",
-    column="code",
-)
 
-ocd_icd_codes = codelist_from_csv(
-    "codelists/user-emilyherrett-ocd_icd10.csv",
-    system="icd10",
-    column="code",
-)
+def read_codelist(filename, system, column="code", category_column=None):
+    """Parse a codelist CSV, or load it from the cache if the file is unchanged"""
+    with open(filename, "rb") as f:
+        contents = f.read()
+    key = hashlib.sha256(
+        repr((CACHE_NAMESPACE, system, column, category_column)).encode() + contents
+    ).hexdigest()
+    cached = CACHE_DIR / f"{key}.pickle"
+    try:
+        with open(cached, "rb") as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        # Missing, partly written, or pickled by a cohortextractor that
+        # defined the codelist classes elsewhere: parse it again
+        pass
+    codes = parse_codelist(contents.decode(), system, column, category_column)
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        partial = cached.with_suffix(f".{os.getpid()}.partial")
+        with open(partial, "wb") as f:
+            pickle.dump(codes, f)
+        os.replace(partial, cached)
+    except OSError:
+        # e.g. a read-only checkout; the codelist just isn't cached
+        pass
+    return codes
 
-eating_disorder_icd_codes = codelist_from_csv(
-    "codelists/user-emilyherrett-eating_disorder_icd10.csv",
-    system="icd10",
-    column="code",
-)
 
-self_harm_icd_codes = codelist_from_csv(
-    "codelists/user-emilyherrett-self_harm_icd10.csv",
-    system="icd10",
-    column="code",
-)
+@lru_cache(maxsize=None)
+def load_codelist(name):
+    if name in CODELIST_FILES:
+        return read_codelist(**CODELIST_FILES[name])
+    derived = DERIVED_CODELISTS[name]
+    if "category" in derived:
+        return filter_codes_by_category(
+            load_codelist(derived["codelist"]), include=[derived["category"]]
+        )
+    if "combine" in derived:
+        return combine_codelists(*map(load_codelist, derived["combine"]))
+    return codelist(derived["codes"], system=derived["system"])
+
+
+def __getattr__(name):
+    if name in CODELIST_FILES or name in DERIVED_CODELISTS:
+        return load_codelist(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-suicide_icd_codes = codelist_from_csv(
-    "codelists/user-hjforbes-suicide-icd-10.csv",
-    system="icd10",
-    column="code",
-)
 
-migration_codes = codelist_from_csv(
-    "codelists/user-ruthcostello-migration-status-codes.csv",
-    system="snomed",
-    column="code",
-)
\ No newline at end of file
+def __dir__():
+    return sorted([*globals(), *__all__])
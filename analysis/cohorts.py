@@ -0,0 +1,136 @@
+# The general population, diabetes and respiratory cohorts are extracted
+# together by study_definition_combined. Each cohort is a projection of that
+# extract: the rows flagged as cohort members (everyone in the population for
+# the general cohort) and the columns of the cohort's own study definition.
+# Each cohort's measures are the rate of every outcome (numerator) in its
+# denominator, by IMD and by migration status.
+#
+# This module has no cohortextractor dependency so that it can be used by the
+# python:latest actions; study_definition_combined checks the column lists
+# against the study definitions.
+GROUP_BY = ["imd", "migration_status"]
+
+COHORTS = {
+    "general": dict(
+        study_definition="study_definition",
+        prefix="",
+        flag=None,
+        subdir="",
+        columns=[
+            "age",
+            "sex",
+            "has_msoa",
+            "imd",
+            "migration_status",
+            "has_t1_diabetes",
+            "has_t2_diabetes",
+            "diabetes_subgroup",
+            "has_asthma",
+            "has_copd",
+            "mi_admission",
+            "stroke_admission",
+            "heart_failure_admission",
+            "vte_admission",
+            "depression_admission",
+            "anxiety_admission",
+            "smi_admission",
+            "self_harm_admission",
+            "eating_dis_admission",
+            "ocd_admission",
+            "mh_admission",
+            "stroke_mortality",
+            "vte_mortality",
+            "mi_mortality",
+            "heart_failure_mortality",
+            "mh_mortality",
+        ],
+        outcomes={
+            "mi_admission": "population",
+            "stroke_admission": "population",
+            "heart_failure_admission": "population",
+            "vte_admission": "population",
+            "mh_admission": "population",
+            "mi_mortality": "population",
+            "stroke_mortality": "population",
+            "vte_mortality": "population",
+            "heart_failure_mortality": "population",
+            "mh_mortality": "population",
+        },
+    ),
+    "dm": dict(
+        study_definition="study_definition_dm",
+        prefix="dm_",
+        flag="dm_cohort",
+        subdir="dm",
+        columns=[
+            "age",
+            "sex",
+            "has_msoa",
+            "imd",
+            "migration_status",
+            "has_t1_diabetes",
+            "has_t2_diabetes",
+            "diabetes_subgroup",
+            "dmt1_admission",
+            "dmt2_admission",
+            "dm_keto_admission",
+            "dmt1_mortality",
+            "dmt2_mortality",
+            "dm_keto_mortality",
+        ],
+        outcomes={
+            "dmt1_admission": "has_t1_diabetes",
+            "dmt2_admission": "has_t2_diabetes",
+            "dm_keto_admission": "population",
+            "dmt1_mortality": "has_t1_diabetes",
+            "dmt2_mortality": "has_t2_diabetes",
+            "dm_keto_mortality": "population",
+        },
+    ),
+    "resp": dict(
+        study_definition="study_definition_resp",
+        prefix="resp_",
+        flag="resp_cohort",
+        subdir="resp",
+        columns=[
+            "age",
+            "sex",
+            "has_msoa",
+            "imd",
+            "migration_status",
+            "has_asthma",
+            "has_copd",
+            "resp_copd_exac",
+            "resp_copd_exac_nolrti",
+            "resp_asthma_exac",
+            "resp_asthma_mortality",
+            "resp_copd_exac_mortality",
+            "resp_copd_diag_mortality",
+            "resp_copd_mortality",
+        ],
+        outcomes={
+            "resp_asthma_exac": "has_asthma",
+            "resp_copd_exac": "has_copd",
+            "resp_copd_exac_nolrti": "has_copd",
+            "resp_asthma_mortality": "has_asthma",
+            "resp_copd_mortality": "has_copd",
+        },
+    ),
+}
+
+
+def measure_definitions(cohort):
+    """
+    Arguments for each of the cohort's measures, in the same form as
+    cohortextractor's Measure
+    """
+    return [
+        dict(
+            id=f"{numerator}_{group_by}_rate",
+            numerator=numerator,
+            denominator=denominator,
+            group_by=[group_by],
+        )
+        for group_by in GROUP_BY
+        for numerator, denominator in COHORTS[cohort]["outcomes"].items()
+    ]
@@ -0,0 +1,299 @@
+# Typed columnar (Arrow/feather) versions of the input and measure files.
+#
+# Binary flags are stored as uint8, IMD and the other categorical variables
+# as categoricals, ISO dates as native dates and the remaining integers in the
+# smallest type that holds them. With pack_flags, flags without missing
+# values are stored as Arrow booleans, a bit per patient (see flag_bits.py);
+# read_frame decodes them back to uint8. Feather files can be memory-mapped
+# so readers only touch the columns they ask for:
+#
+#   read_frame("output/measures/input_2019-03-01.feather", columns=["imd"])
+#
+# Usage (converts each CSV to a .feather file alongside it):
+#   python analysis/columnar.py output/measures/measure_*_rate.csv
+import argparse
+import collections
+import re
+import threading
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+CATEGORICAL_COLUMNS = {"imd", "sex", "stp", "urban_rural"}
+FLAG_VALUES = {"0", "1"}
+ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+# Wide single-pass extracts suffix monthly columns with the index date
+MONTH_SUFFIX = re.compile(r"_\d{4}_\d{2}_\d{2}$")
+# Distinct values kept per column when finding types a chunk at a time;
+# columns with more can't be categoricals
+MAX_CATEGORIES = 1 << 16
+
+
+class ColumnTypes:
+    """
+    The compact type of each column of extracted values (read as strings),
+    found a chunk at a time, so that a file too big to read at once can be
+    converted chunk by chunk with the same types and categories in every
+    chunk:
+
+        types = ColumnTypes()
+        for chunk in chunks:
+            types.update(chunk)
+        typed_chunks = (types.apply(chunk) for chunk in chunks)
+    """
+
+    def __init__(self, max_categories=MAX_CATEGORIES, pack_flags=False):
+        self.max_categories = max_categories
+        self.pack_flags = pack_flags
+        self.seen = {}
+
+    def update(self, df):
+        for name in df.columns:
+            values = df[name].astype(str)
+            present = values[values != ""]
+            seen = self.seen.setdefault(
+                name,
+                dict(
+                    rows=0, present=0, flags=True, dates=True, numbers=True,
+                    integers=True, low=None, high=None, values=set(),
+                ),
+            )
+            seen["rows"] += len(values)
+            seen["present"] += len(present)
+            uniques = present.unique()
+            if seen["values"] is not None:
+                seen["values"].update(values.unique())
+                if self.max_categories and len(seen["values"]) > self.max_categories:
+                    seen["values"] = None
+            if not len(present):
+                continue
+            seen["flags"] &= set(uniques) <= FLAG_VALUES
+            if seen["dates"]:
+                seen["dates"] = bool(pd.Series(uniques).str.match(ISO_DATE).all())
+            if seen["numbers"]:
+                numbers = pd.to_numeric(pd.Series(uniques), errors="coerce")
+                seen["numbers"] = bool(numbers.notna().all())
+                if seen["numbers"]:
+                    seen["integers"] &= bool((numbers % 1 == 0).all())
+                    low, high = numbers.min(), numbers.max()
+                    seen["low"] = low if seen["low"] is None else min(seen["low"], low)
+                    seen["high"] = high if seen["high"] is None else max(seen["high"], high)
+        return self
+
+    def dtype(self, name):
+        """The type of a column: a dtype, or "date" or "category" """
+        seen = self.seen[name]
+        missing = seen["present"] < seen["rows"]
+        if MONTH_SUFFIX.sub("", name) in CATEGORICAL_COLUMNS or not seen["present"]:
+            return "category"
+        if seen["flags"]:
+            if missing:
+                return "UInt8"
+            return "bool" if self.pack_flags else "uint8"
+        if seen["dates"]:
+            return "date"
+        if seen["numbers"] and seen["integers"]:
+            if missing:
+                return "Int64"
+            # The smallest integer type holding every value
+            return pd.to_numeric(
+                pd.Series([seen["low"], seen["high"]]), downcast="integer"
+            ).dtype
+        if seen["numbers"]:
+            return "float64"
+        return "category"
+
+    def categories(self, name):
+        if self.seen[name]["values"] is None:
+            raise ValueError(f"{name} has too many distinct values to be a category")
+        return sorted(self.seen[name]["values"])
+
+    def apply(self, df):
+        """Convert a chunk to the types of all the chunks seen"""
+        typed = {}
+        for name in df.columns:
+            values = df[name].astype(str)
+            dtype = self.dtype(name)
+            if dtype == "date":
+                typed[name] = pd.to_datetime(values.replace("", None))
+            elif dtype == "category":
+                typed[name] = pd.Categorical(values, categories=self.categories(name))
+            elif dtype == "float64":
+                typed[name] = pd.to_numeric(values.replace("", None))
+            else:
+                typed[name] = pd.to_numeric(values.replace("", None)).astype(dtype)
+        return pd.DataFrame(typed, index=df.index)
+
+
+def typed_frame(df, pack_flags=False):
+    """Convert a frame of extracted values (read as strings) to compact types"""
+    return ColumnTypes(max_categories=None, pack_flags=pack_flags).update(df).apply(df)
+
+
+def to_arrow(df):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # Store dates as dates rather than nanosecond timestamps
+    for i, field in enumerate(table.schema):
+        if pa.types.is_timestamp(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pa.date32()))
+    return table
+
+
+def write_frame(df, filename):
+    filename = str(filename)
+    if filename.endswith(".feather"):
+        # zstd, as cohortextractor uses for its own feather output
+        feather.write_feather(to_arrow(df), filename, compression="zstd")
+    else:
+        df.to_csv(filename, index=False)
+
+
+class FrameWriter:
+    """
+    Write a frame to a CSV or feather file in chunks, so the whole frame
+    never has to be in memory. Every chunk must have the same columns and
+    types (including categories).
+
+        with FrameWriter("input_2019-03-01.feather") as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+    """
+
+    def __init__(self, filename):
+        self.filename = str(filename)
+        self.writer = None
+        self.rows = 0
+
+    def write(self, df):
+        if self.filename.endswith(".feather"):
+            table = to_arrow(df)
+            if self.writer is None:
+                # The feather format is the Arrow IPC file format
+                self.writer = pa.ipc.new_file(
+                    self.filename,
+                    table.schema,
+                    options=pa.ipc.IpcWriteOptions(compression="zstd"),
+                )
+            self.writer.write_table(table)
+        else:
+            first = self.rows == 0
+            df.to_csv(self.filename, index=False, mode="w" if first else "a", header=first)
+        self.rows += len(df)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class WriteQueue:
+    """
+    Write chunks to FrameWriters on a background thread, so reading the next
+    chunk overlaps with writing the last. put() blocks while more than
+    `max_bytes` of chunks are waiting to be written, so a reader faster than
+    the disk is held back instead of buffering without limit.
+
+        with WriteQueue(max_bytes=2**30) as queue:
+            for chunk in chunks:
+                queue.put(writer, chunk)
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.pending = collections.deque()
+        self.pending_bytes = 0
+        self.finished = False
+        self.error = None
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._write_pending, daemon=True)
+        self.thread.start()
+
+    def put(self, writer, df):
+        size = int(df.memory_usage(deep=True).sum())
+        with self.condition:
+            # A chunk bigger than the limit is still written, on its own
+            while (
+                self.error is None
+                and self.pending
+                and self.pending_bytes + size > self.max_bytes
+            ):
+                self.condition.wait()
+            if self.error is not None:
+                raise self.error
+            self.pending.append((writer, df, size))
+            self.pending_bytes += size
+            self.condition.notify_all()
+
+    def _write_pending(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.finished:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                writer, df, size = self.pending[0]
+            try:
+                writer.write(df)
+            except Exception as error:
+                with self.condition:
+                    self.error = error
+                    self.pending.clear()
+                    self.condition.notify_all()
+                return
+            with self.condition:
+                self.pending.popleft()
+                self.pending_bytes -= size
+                self.condition.notify_all()
+
+    def close(self):
+        """Wait for every chunk to be written"""
+        with self.condition:
+            self.finished = True
+            self.condition.notify_all()
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_frame(filename, columns=None):
+    """Read a CSV or feather file, loading only `columns` if given"""
+    filename = str(filename)
+    if filename.endswith(".feather"):
+        table = feather.read_table(filename, columns=columns, memory_map=True)
+        df = table.to_pandas()
+        # Bit-packed flags are read as 0/1, as unpacked flags are
+        packed = [field.name for field in table.schema if pa.types.is_boolean(field.type)]
+        return df.astype({name: "uint8" for name in packed})
+    return pd.read_csv(filename, usecols=columns)
+
+
+def convert(filename):
+    df = pd.read_csv(filename, dtype=str, keep_default_na=False)
+    output_file = Path(filename).with_suffix(".feather")
+    write_frame(typed_frame(df), output_file)
+    return output_file
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="+")
+    args = parser.parse_args()
+    for filename in args.files:
+        convert(filename)
+
+
+if __name__ == "__main__":
+    main()
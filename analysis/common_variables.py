@@ -1,6 +1,17 @@
-# Creating script for common variables: age, gender, ethnicity & IMD
+# Creating script for common variables: age, sex, IMD, migration status and
+# the diabetes/respiratory subgroups shared by all the study definitions.
+# Study definitions pick the variables they need with select_variables() so
+# the same definition (and column) is used for every cohort
+from functools import lru_cache
+
 from cohortextractor import patients
-from codelists import *
+from codelists import (
+    asthma_codes,
+    copd_codes,
+    migration_codes,
+    t1dm_codes,
+    t2dm_codes,
+)
 
 common_variables = dict(
     # Age
@@ -60,7 +71,7 @@ common_variables = dict(
         returning="rural_urban_classification",
         return_expectations={
         "rate": "universal",
-        "category": 
+        "category":
             {"ratios": {
                 "1": 0.1,
                 "2": 0.1,
@@ -80,5 +91,113 @@ common_variables = dict(
         on_or_before="index_date",
         returning="binary_flag",
         return_expectations={"incidence":0.2,},
+    ),
+    # Subgroups
+    has_t1_diabetes=patients.with_these_clinical_events(
+        t1dm_codes,
+        on_or_before="index_date",
+        returning="binary_flag",
+        return_expectations={"incidence":0.2,}
+        ),
+    has_t2_diabetes=patients.with_these_clinical_events(
+        t2dm_codes,
+        on_or_before="index_date",
+        returning="binary_flag",
+        return_expectations={"incidence":0.8,}
+        ),
+    diabetes_subgroup=patients.satisfying(
+        """
+        has_t1_diabetes OR
+        has_t2_diabetes
+        """,
+    ),
+    has_asthma=patients.with_these_clinical_events(
+        asthma_codes,
+        between=["index_date - 3 years", "index_date"],
+        returning="binary_flag",
+        return_expectations={"incidence":0.2,}
+        ),
+    has_copd=patients.satisfying(
+    """has_copd_code AND age40>40""",
+        has_copd_code=patients.with_these_clinical_events(
+        copd_codes,
+        on_or_before="index_date",
+        returning="binary_flag",
+        return_expectations={"incidence":0.8,}
+        ),
+        age40=patients.age_as_of(
+            "index_date",
+            return_expectations={
+                "rate": "universal",
+                "int": {"distribution": "population_ages"},
+            },
+        ),
+    ),
+)
+
+
+def study_population(*conditions, **extra_columns):
+    """
+    Adults registered for 3 months, alive, with known sex, IMD and household,
+    plus any cohort specific `conditions` (which may refer to `extra_columns`)
+    """
+    return patients.satisfying(
+        " AND\n".join(
+            [
+                "has_follow_up",
+                "(age >=18 AND age <= 110)",
+                "(NOT died)",
+                "(sex = 'M' OR sex = 'F')",
+                "(imd != 0)",
+                "(household>=1 AND household<=15)",
+                *conditions,
+            ]
+        ),
+        has_follow_up=patients.registered_with_one_practice_between(
+            "index_date - 3 months", "index_date"
+        ),
+        died=patients.died_from_any_cause(
+            on_or_before="index_date"
+        ),
+        household=patients.household_as_of(
+            "2020-02-01",
+            returning="household_size",
+        ),
+        **extra_columns,
     )
-)
\ No newline at end of file
+
+
+def select_variables(*names):
+    """Pick shared variables by name, in the order given"""
+    return {name: common_variables[name] for name in names}
+
+
+def combine_variables(*variable_dicts):
+    """
+    Merge the variables of several study definitions for a combined
+    extraction. Variables shared between them must have identical definitions
+    and are only declared (and so extracted) once.
+    """
+    combined = {}
+    for variables in variable_dicts:
+        for name, definition in variables.items():
+            if name in combined and combined[name] != definition:
+                raise ValueError(f"Conflicting definitions for variable '{name}'")
+            combined[name] = definition
+    return combined
+
+
+def lazy_study(build_study):
+    """
+    A module __getattr__ providing `study`, built by `build_study` on first
+    access. Building a StudyDefinition validates it by generating its SQL, so
+    this keeps importing a study definition (e.g. for its variables) cheap.
+    """
+    build_study = lru_cache(maxsize=None)(build_study)
+
+    def __getattr__(name):
+        if name == "study":
+            return build_study()
+        raise AttributeError(f"module has no attribute {name!r}")
+
+    return __getattr__
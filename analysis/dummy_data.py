@@ -0,0 +1,227 @@
+# Vectorised dummy data at production scale.
+#
+# cohortextractor's dummy data generator works a column at a time through
+# pandas and scipy and holds the whole population in memory, which is fine
+# for project.yaml's population_size but not for stress testing the pipeline
+# with tens of millions of patients. This writes the same monthly input files
+# as split_months.py straight from the return_expectations (merged over the
+# default_expectations) of study_definition_combined, generating each column
+# with NumPy and streaming chunks of patients to the files, so memory is
+# bounded by --chunk-size rather than --population-size.
+#
+# Supported expectations are those our study definitions use: incidence and
+# `universal` rates, category ratios, int distributions (population_ages,
+# normal, poisson), normal floats and uniform or exponentially increasing
+# dates. As in cohortextractor, expressions aren't evaluated: each column
+# follows its own expectations. Every column is generated from its own
+# seeded streams, per month for variables that depend on the index date and
+# once for those that don't (so a patient's sex is the same every month),
+# with a stream per fixed block of patients, so the data doesn't depend on
+# --chunk-size.
+#
+# Usage:
+#   python analysis/dummy_data.py --output-dir output/dummy \
+#       --population-size 10000000 [--start 2018-03-01] [--end 2021-12-31] \
+#       [--chunk-size 1000000] [--output-format feather] [--seed 0]
+import argparse
+import copy
+import datetime
+import zlib
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import cohortextractor
+from cohortextractor.date_expressions import (
+    evaluate_date_expressions_in_expectations_definition,
+)
+from cohortextractor.process_covariate_definitions import (
+    process_covariate_definitions,
+)
+from cohortextractor.study_definition import merge
+
+from cohorts import COHORTS
+from columnar import FrameWriter
+from months import STUDY_MONTHS, month_starts
+from multi_month import date_dependent_names, flatten
+from split_months import MONTH_VARIABLES, cohort_filename, cohort_rows
+from study_definition_combined import default_expectations, variables
+
+# As multi_month.py, so that most patients are in the population each month
+POPULATION_INCIDENCE = 0.95
+# Patients drawn from each seeded stream of a column, so a patient's values
+# don't depend on --chunk-size
+SEED_BLOCK = 16_384
+
+
+@lru_cache(maxsize=None)
+def population_age_probabilities():
+    """
+    Probability of each age from 0 to the end of the oldest band, spreading
+    the UK population bands used by cohortextractor's population_ages evenly
+    over the ages of each band
+    """
+    bands = pd.read_csv(
+        Path(cohortextractor.__file__).parent / "uk_population_bands_2018.csv",
+        thousands=",",
+    )
+    limits = bands["band"].str.split("-", expand=True).astype(int).to_numpy()
+    starts, ends = limits[:, 0], limits[:, 1]
+    counts = bands["range"].to_numpy(dtype=float)
+    ages = np.arange(ends[-1] + 1)
+    band = np.searchsorted(ends, ages)
+    probabilities = counts[band] / (ends - starts + 1)[band]
+    return probabilities / probabilities.sum()
+
+
+def column_specs():
+    """(name, column type, expectations, depends on index date) of each column"""
+    definitions = process_covariate_definitions(copy.deepcopy(variables))
+    dependent = date_dependent_names(flatten(variables))
+    specs = []
+    for name in MONTH_VARIABLES:
+        _, query_args = definitions[name]
+        expectations = merge(
+            copy.deepcopy(default_expectations or {}),
+            query_args.get("return_expectations") or {},
+        )
+        if name == "population":
+            expectations["incidence"] = POPULATION_INCIDENCE
+        specs.append((name, query_args["column_type"], expectations, name in dependent))
+    return specs
+
+
+def present(rng, size, expectations):
+    """Which rows have a value, given the rate and incidence"""
+    if expectations.get("rate") == "universal":
+        return np.ones(size, dtype=bool)
+    # Single precision is plenty for an incidence, and twice as fast
+    return rng.random(size, dtype="float32") < expectations["incidence"]
+
+
+def generate_dates(rng, size, expectations):
+    date = expectations["date"]
+    latest = date.get("latest", "today")
+    if latest == "today":
+        latest = datetime.date.today().isoformat()
+    low = np.datetime64(date["earliest"], "D")
+    high = np.datetime64(latest, "D")
+    elapsed = (high - low).astype(int)
+    if expectations.get("rate") == "exponential_increase":
+        # More recent dates are more common, as in cohortextractor
+        days_before = np.minimum(rng.exponential(0.1, size), 1) * elapsed
+    else:
+        days_before = rng.random(size) * elapsed
+    return pd.Series(high - days_before.astype("timedelta64[D]"))
+
+
+def generate_column(rng, size, column_type, expectations):
+    has_value = present(rng, size, expectations)
+    if column_type == "bool":
+        return pd.Series(has_value.astype("uint8"))
+    if column_type == "date":
+        return generate_dates(rng, size, expectations).where(has_value)
+    if "category" in expectations:
+        ratios = expectations["category"]["ratios"]
+        probabilities = np.array(list(ratios.values()), dtype=float)
+        codes = rng.choice(len(ratios), size=size, p=probabilities / probabilities.sum())
+        codes = np.where(has_value, codes, -1)
+        categories = [str(category) for category in ratios]
+        return pd.Series(pd.Categorical.from_codes(codes, categories=categories))
+    if "int" in expectations:
+        distribution = expectations["int"]
+        if distribution["distribution"] == "population_ages":
+            probabilities = population_age_probabilities()
+            values = rng.choice(len(probabilities), size=size, p=probabilities)
+        elif distribution["distribution"] == "normal":
+            values = rng.normal(distribution["mean"], distribution["stddev"], size)
+        elif distribution["distribution"] == "poisson":
+            values = rng.poisson(distribution["mean"], size)
+        else:
+            raise ValueError(f"Unsupported int distribution {distribution}")
+        return pd.Series(np.where(has_value, values, 0).astype("int32"))
+    if "float" in expectations:
+        distribution = expectations["float"]
+        values = rng.normal(distribution["mean"], distribution["stddev"], size)
+        return pd.Series(np.where(has_value, values, 0.0))
+    raise ValueError(f"Can't generate a {column_type} column from {expectations}")
+
+
+def generate_rows(seeds, start, size, column_type, expectations):
+    """
+    Rows `start` to `start + size` of a column, drawing each SEED_BLOCK of
+    patients from its own stream of `seeds`
+    """
+    first, last = start // SEED_BLOCK, (start + size - 1) // SEED_BLOCK
+    blocks = [
+        generate_column(
+            np.random.default_rng([*seeds, block]), SEED_BLOCK, column_type, expectations
+        )
+        for block in range(first, last + 1)
+    ]
+    offset = start - first * SEED_BLOCK
+    rows = pd.concat(blocks, ignore_index=True).iloc[offset : offset + size]
+    return rows.reset_index(drop=True)
+
+
+def generate_chunk(specs, index_date, start, size, seed=0):
+    """Rows `start` to `start + size` of the month's variables"""
+    month = int(index_date.replace("-", ""))
+    columns = {}
+    for name, column_type, expectations, dependent in specs:
+        seeds = [seed, zlib.crc32(name.encode()), month if dependent else 0]
+        expectations = evaluate_date_expressions_in_expectations_definition(
+            expectations, index_date
+        )
+        columns[name] = generate_rows(seeds, start, size, column_type, expectations)
+    chunk = pd.DataFrame(columns)
+    chunk["patient_id"] = np.arange(start + 1, start + size + 1, dtype="int64")
+    return chunk
+
+
+def generate_dummy_data(
+    output_dir,
+    population_size,
+    index_dates=STUDY_MONTHS,
+    chunk_size=1_000_000,
+    output_format="feather",
+    seed=0,
+):
+    specs = column_specs()
+    for index_date in index_dates:
+        writers = {
+            name: FrameWriter(cohort_filename(output_dir, cohort, index_date, output_format))
+            for name, cohort in COHORTS.items()
+        }
+        for start in range(0, population_size, chunk_size):
+            size = min(chunk_size, population_size - start)
+            chunk = generate_chunk(specs, index_date, start, size, seed)
+            for name, cohort in COHORTS.items():
+                writers[name].write(cohort_rows(chunk, cohort))
+        for writer in writers.values():
+            writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--population-size", type=int, required=True)
+    parser.add_argument("--start", default=STUDY_MONTHS[0])
+    parser.add_argument("--end", default=STUDY_MONTHS[-1])
+    parser.add_argument("--chunk-size", type=int, default=1_000_000)
+    parser.add_argument("--output-format", choices=["csv", "feather"], default="feather")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate_dummy_data(
+        args.output_dir,
+        args.population_size,
+        index_dates=month_starts(args.start, args.end),
+        chunk_size=args.chunk_size,
+        output_format=args.output_format,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# Per-patient index of event dates, for windowed lookups.
+#
+# The outcome event table (see outcome_events.py) holds the dated admissions
+# and deaths of every outcome for the whole study period. Each month's flags
+# are windows over it, e.g. any admission for MI `between=["index_date",
+# "last_day_of_month(index_date)"]`. Rather than scan the table for every
+# outcome and month, each (outcome, source) group is indexed once for a set
+# of patients, and any window is answered for every patient by binary search.
+#
+# An EventIndex holds each patient's event dates, sorted, in CSR arrays: the
+# days of patient row `i` are `days[offsets[i]:offsets[i + 1]]`. Keying every
+# event by (patient row, day) makes the whole key array sorted, so a window
+# for every patient is two `searchsorted` calls:
+#
+#   indexes = EventIndex.for_groups(patient_ids, events, ["outcome", "source"])
+#   for index_date in STUDY_MONTHS:
+#       mi = indexes["mi", "primary_diagnosis"].any_between(
+#           index_date, month_end(index_date)
+#       )
+#
+# As in cohortextractor, windows include both ends. Results are arrays in the
+# order of `patient_ids`. This module has no cohortextractor dependency.
+import numpy as np
+import pandas as pd
+
+# Days are counted from this date, so every key fits in an int64
+EPOCH = np.datetime64("1900-01-01", "D")
+# More days than any date is from EPOCH, to separate patients' keys
+PATIENT_SPAN = np.int64(1 << 20)
+
+
+def to_days(dates):
+    """Dates (ISO strings, dates or datetime64) as days since EPOCH, -1 if missing"""
+    dates = pd.to_datetime(pd.Series(np.atleast_1d(dates)), errors="coerce")
+    days = (dates.to_numpy("datetime64[D]") - EPOCH).astype("int64")
+    return np.where(dates.isna().to_numpy(), -1, days)
+
+
+def day_of(date):
+    """One date (an ISO string or date) as days since EPOCH"""
+    return (np.datetime64(date, "D") - EPOCH).astype("int64")
+
+
+def patient_rows(patient_ids, event_patient_ids):
+    """Row of each event's patient in `patient_ids`, or -1 if not a patient"""
+    patient_ids = np.asarray(patient_ids, dtype="int64")
+    event_patient_ids = np.asarray(event_patient_ids, dtype="int64")
+    if not len(patient_ids):
+        return np.full(len(event_patient_ids), -1, dtype="int64")
+    order = np.argsort(patient_ids, kind="stable")
+    sorted_ids = patient_ids[order]
+    found = np.minimum(np.searchsorted(sorted_ids, event_patient_ids), len(sorted_ids) - 1)
+    return np.where(sorted_ids[found] == event_patient_ids, order[found], -1)
+
+
+class EventIndex:
+    """Each patient's sorted event dates, in CSR arrays"""
+
+    def __init__(self, offsets, days):
+        self.offsets = offsets
+        self.days = days
+        self.n_patients = len(offsets) - 1
+        rows = np.repeat(np.arange(self.n_patients, dtype="int64"), np.diff(offsets))
+        self.keys = rows * PATIENT_SPAN + days
+
+    @classmethod
+    def from_rows(cls, rows, days, n_patients):
+        """Index events given as patient rows and days (either -1 to drop)"""
+        kept = (rows >= 0) & (days >= 0)
+        rows, days = rows[kept], days[kept]
+        order = np.lexsort((days, rows))
+        offsets = np.zeros(n_patients + 1, dtype="int64")
+        np.cumsum(np.bincount(rows, minlength=n_patients), out=offsets[1:])
+        return cls(offsets, days[order])
+
+    @classmethod
+    def for_groups(cls, patient_ids, events, by):
+        """
+        An index of the `events` (with patient_id and date columns) of each
+        group of the `by` columns, for the patients `patient_ids`
+        """
+        rows = patient_rows(patient_ids, events["patient_id"])
+        days = to_days(events["date"])
+        groups = events.groupby(by, observed=True, sort=False).indices
+        return {
+            key: cls.from_rows(rows[positions], days[positions], len(patient_ids))
+            for key, positions in groups.items()
+        }
+
+    def count_between(self, start, end):
+        """Number of each patient's events from `start` to `end` inclusive"""
+        rows = np.arange(self.n_patients, dtype="int64") * PATIENT_SPAN
+        low = np.searchsorted(self.keys, rows + day_of(start))
+        high = np.searchsorted(self.keys, rows + day_of(end), side="right")
+        return np.maximum(high - low, 0)
+
+    def any_between(self, start, end):
+        """Whether each patient has an event from `start` to `end` (0/1)"""
+        return (self.count_between(start, end) > 0).astype("uint8")
@@ -0,0 +1,389 @@
+# Compiled satisfying() and categorised_as() expressions.
+#
+# Expressions such as the population definition, the IMD bands
+# (`index_of_multiple_deprivation >= 32844*1/5 AND ...`) and the outcome
+# combinations (`copd_exacerbation_hospital OR (lrti_hospital AND copd_any)`)
+# are parsed once, constant-folded, and compiled into NumPy kernels which
+# evaluate them over whole columns of patients, so evaluating them for every
+# index date doesn't parse them again:
+#
+#   population = compile_expression(definition)
+#   population(month)             # bool array, one per row of `month`
+#   imd = compile_categories(category_definitions)
+#   imd(month)                    # array of category keys
+#
+# The grammar and semantics follow cohortextractor's SQL translation:
+#   - AND, OR, NOT, comparisons (=, !=, <>, <, <=, >, >=), + - * / and
+#     brackets, over column names, numbers and 'quoted' strings
+#   - a column used as a condition is true when it's non-zero (or a
+#     non-empty string) and not missing
+#   - text compared with (or added to) a number is converted to a number, as
+#     columns read as text (`dtype=str`) have the number types they have in
+#     SQL; text which isn't a number is missing
+#   - comparisons with a missing value are false
+#   - dividing integers truncates, as in SQL (32844*1/5 is 6568)
+# categorised_as() takes the first category, in the order given, whose
+# expression is true, and the DEFAULT category otherwise.
+import operator
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+TOKEN = re.compile(
+    r"\s*(?:(?P<number>\d+(?:\.\d+)?)|(?P<string>'[^']*'|\"[^\"]*\")"
+    r"|(?P<name>[A-Za-z_][A-Za-z0-9_]*)|(?P<symbol><=|>=|!=|<>|[=<>+\-*/()]))"
+)
+KEYWORDS = {"AND", "OR", "NOT"}
+COMPARISONS = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<>": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+DEFAULT = "DEFAULT"
+
+
+def tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = TOKEN.match(expression, position)
+        if not match:
+            raise ValueError(f"Can't parse {expression[position:]!r} in: {expression}")
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == "name" and text.upper() in KEYWORDS:
+            kind, text = "keyword", text.upper()
+        tokens.append((kind, text))
+        position = match.end()
+    return tokens
+
+
+class Parser:
+    """
+    Recursive descent over the tokens of an expression, to a tree of tuples:
+    ("const", value), ("column", name), ("not", node), ("and", [nodes]),
+    ("or", [nodes]), ("compare", op, left, right), ("arithmetic", op, left,
+    right), ("negate", node) and ("truth", node) for a value used as a
+    condition
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = tokenize(expression)
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def take(self, *texts):
+        kind, text = self.peek()
+        if text in texts and kind in ("keyword", "symbol"):
+            self.position += 1
+            return text
+        return None
+
+    def parse(self):
+        node = self.disjunction()
+        if self.position != len(self.tokens):
+            raise ValueError(f"Unexpected {self.peek()[1]!r} in: {self.expression}")
+        return condition(node)
+
+    def disjunction(self):
+        nodes = [self.conjunction()]
+        while self.take("OR"):
+            nodes.append(self.conjunction())
+        return ("or", [condition(node) for node in nodes]) if len(nodes) > 1 else nodes[0]
+
+    def conjunction(self):
+        nodes = [self.negation()]
+        while self.take("AND"):
+            nodes.append(self.negation())
+        return ("and", [condition(node) for node in nodes]) if len(nodes) > 1 else nodes[0]
+
+    def negation(self):
+        if self.take("NOT"):
+            return ("not", condition(self.negation()))
+        return self.comparison()
+
+    def comparison(self):
+        left = self.sum()
+        op = self.take(*COMPARISONS)
+        if op:
+            return ("compare", op, left, self.sum())
+        return left
+
+    def sum(self):
+        node = self.product()
+        while True:
+            op = self.take("+", "-")
+            if not op:
+                return node
+            node = ("arithmetic", op, node, self.product())
+
+    def product(self):
+        node = self.unary()
+        while True:
+            op = self.take("*", "/")
+            if not op:
+                return node
+            node = ("arithmetic", op, node, self.unary())
+
+    def unary(self):
+        if self.take("-"):
+            return ("negate", self.unary())
+        return self.atom()
+
+    def atom(self):
+        kind, text = self.peek()
+        if self.take("("):
+            node = self.disjunction()
+            if not self.take(")"):
+                raise ValueError(f"Missing ')' in: {self.expression}")
+            return node
+        self.position += 1
+        if kind == "number":
+            return ("const", float(text) if "." in text else int(text))
+        if kind == "string":
+            return ("const", text[1:-1])
+        if kind == "name":
+            return ("column", text)
+        if text is None:
+            raise ValueError(f"Unexpected end of: {self.expression}")
+        raise ValueError(f"Unexpected {text!r} in: {self.expression}")
+
+
+def condition(node):
+    """A node used as a condition"""
+    if node[0] in ("const", "column", "arithmetic", "negate"):
+        return ("truth", node)
+    return node
+
+
+def divide(left, right):
+    """Division, truncating between integers as SQL does"""
+    if np.issubdtype(np.result_type(left, right), np.integer):
+        return np.sign(left) * np.sign(right) * (np.abs(left) // np.abs(right))
+    return np.true_divide(left, right)
+
+
+ARITHMETIC = {"+": operator.add, "-": operator.sub, "*": operator.mul, "/": divide}
+
+
+def truth(value):
+    if isinstance(value, str):
+        return value != ""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return False
+    return bool(value)
+
+
+def fold(node):
+    """Evaluate the parts of a tree which don't refer to columns"""
+    kind = node[0]
+    if kind in ("const", "column"):
+        return node
+    if kind in ("truth", "negate", "not"):
+        child = fold(node[1])
+        if child[0] != "const":
+            return (kind, child)
+        value = child[1]
+        if kind == "negate":
+            return ("const", -value)
+        return ("const", truth(value) if kind == "truth" else not value)
+    if kind in ("and", "or"):
+        # An AND is false if any part is, an OR true if any part is; constant
+        # parts which don't decide it are dropped
+        deciding = kind == "or"
+        children = []
+        for child in map(fold, node[1]):
+            if child[0] == "const":
+                if child[1] == deciding:
+                    return child
+                continue
+            children.append(child)
+        if not children:
+            return ("const", not deciding)
+        return children[0] if len(children) == 1 else (kind, children)
+    op, left, right = node[1], fold(node[2]), fold(node[3])
+    if left[0] == "const" and right[0] == "const":
+        operands = numeric_operands(left[1], right[1])
+        if kind == "compare":
+            return ("const", bool(COMPARISONS[op](*operands)))
+        value = ARITHMETIC[op](*operands)
+        return ("const", value.item() if isinstance(value, np.generic) else value)
+    return (kind, op, left, right)
+
+
+def column_names(node):
+    """Columns a tree refers to"""
+    if node[0] == "column":
+        return {node[1]}
+    if node[0] == "const":
+        return set()
+    children = node[1] if node[0] in ("and", "or") else [
+        child for child in node[1:] if isinstance(child, tuple)
+    ]
+    return set().union(*map(column_names, children))
+
+
+def values_of(column):
+    """A column as a NumPy array, with missing numbers as NaN"""
+    values = pd.Series(column)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.astype(values.cat.categories.dtype)
+    if pd.api.types.is_numeric_dtype(values.dtype) or pd.api.types.is_bool_dtype(values.dtype):
+        if values.isna().any():
+            return values.to_numpy("float64", na_value=np.nan)
+        return values.to_numpy()
+    return values.to_numpy(object)
+
+
+def is_text(values):
+    return isinstance(values, str) or (
+        isinstance(values, np.ndarray) and values.dtype == object
+    )
+
+
+def as_number(values):
+    """Text as numbers, with text which isn't a number as NaN"""
+    if isinstance(values, str):
+        return as_number(np.array([values], dtype=object))[0]
+    if is_text(values):
+        return pd.to_numeric(pd.Series(values), errors="coerce").to_numpy("float64")
+    return values
+
+
+def numeric_operands(left, right):
+    """Both operands as numbers if one of them is a number"""
+    if is_text(left) != is_text(right):
+        return as_number(left), as_number(right)
+    return left, right
+
+
+def is_missing(values):
+    if isinstance(values, np.ndarray) and values.dtype == object:
+        return pd.isna(values)
+    if isinstance(values, np.ndarray) and values.dtype.kind == "f":
+        return np.isnan(values)
+    return np.zeros(np.shape(values), dtype=bool)
+
+
+def kernel(node):
+    """A function of a dict of column arrays computing a tree"""
+    kind = node[0]
+    if kind == "const":
+        value = node[1]
+        return lambda columns: value
+    if kind == "column":
+        name = node[1]
+        return lambda columns: columns[name]
+    if kind == "truth":
+        inner = kernel(node[1])
+
+        def truth_of(columns):
+            values = inner(columns)
+            if is_text(values):
+                # Text as in a number column ("0") is false when it's zero
+                return ~pd.isna(values) & (values != "") & (as_number(values) != 0)
+            return (values != 0) & ~is_missing(values)
+
+        return truth_of
+    if kind == "not":
+        inner = kernel(node[1])
+        return lambda columns: ~inner(columns)
+    if kind == "negate":
+        inner = kernel(node[1])
+        return lambda columns: -inner(columns)
+    if kind in ("and", "or"):
+        children = [kernel(child) for child in node[1]]
+        combine = np.logical_and if kind == "and" else np.logical_or
+
+        def combined(columns):
+            result = children[0](columns)
+            for child in children[1:]:
+                result = combine(result, child(columns))
+            return result
+
+        return combined
+    op, left, right = node[1], kernel(node[2]), kernel(node[3])
+    if kind == "arithmetic":
+        apply = ARITHMETIC[op]
+        return lambda columns: apply(*numeric_operands(left(columns), right(columns)))
+    compare = COMPARISONS[op]
+
+    def compared(columns):
+        left_values, right_values = numeric_operands(left(columns), right(columns))
+        result = np.asarray(compare(left_values, right_values), dtype=bool)
+        return result & ~is_missing(left_values) & ~is_missing(right_values)
+
+    return compared
+
+
+class Expression:
+    """A compiled satisfying() expression"""
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tree = fold(Parser(expression).parse())
+        self.names = sorted(column_names(self.tree))
+        self.kernel = kernel(self.tree)
+
+    def __call__(self, columns):
+        """Whether each row of a frame (or dict of columns) satisfies it"""
+        length = len(columns) if isinstance(columns, pd.DataFrame) else len(
+            next(iter(columns.values()))
+        )
+        arrays = {name: values_of(columns[name]) for name in self.names}
+        return np.broadcast_to(self.kernel(arrays), (length,)).astype(bool)
+
+
+class Categories:
+    """A compiled categorised_as() definition"""
+
+    def __init__(self, category_definitions):
+        definitions = dict(category_definitions)
+        defaults = [key for key, value in definitions.items() if value == DEFAULT]
+        self.default = defaults[0] if defaults else None
+        self.categories = [
+            (key, compile_expression(value))
+            for key, value in definitions.items()
+            if value != DEFAULT
+        ]
+        self.names = sorted({name for _, test in self.categories for name in test.names})
+
+    def __call__(self, columns):
+        """The category of each row of a frame (or dict of columns)"""
+        keys = [key for key, _ in self.categories]
+        choices = np.array(keys + [self.default], dtype=object)
+        chosen = np.select(
+            [test(columns) for _, test in self.categories],
+            np.arange(len(keys)),
+            default=len(keys),
+        )
+        values = choices[chosen]
+        if all(isinstance(key, (int, np.integer)) for key in choices):
+            return values.astype("int64")
+        return values
+
+
+@lru_cache(maxsize=None)
+def compile_expression(expression):
+    return Expression(" ".join(str(expression).split()))
+
+
+def compile_categories(category_definitions):
+    return _compile_categories(tuple(category_definitions.items()))
+
+
+@lru_cache(maxsize=None)
+def _compile_categories(items):
+    return Categories(items)
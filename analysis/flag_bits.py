@@ -0,0 +1,124 @@
+# Bit-packed binary flags.
+#
+# With --pack-flags, split_months.py stores the binary flags of the monthly
+# input files (the admission, mortality and subgroup flags; any 0/1 column
+# without missing values) as Arrow booleans, which are bit-packed: a bit per
+# patient instead of a byte as uint8, or two as CSV text. read_frame() (see
+# columnar.py) decodes them back to 0/1 uint8 columns, so readers see the
+# same values as before. This module reads the packed bits directly as
+# uint64 words without unpacking them, so counting the patients with a flag
+# in a group is a popcount of the AND of two bitsets:
+#
+#   flags = FlagBits.read("output/measures/input_2019-03-01.feather")
+#   flags.names                          # the packed flags
+#   flags.decode("mi_admission")         # as a 0/1 uint8 array
+#   in_group = pack(imd == "1")          # a bitset of rows
+#   flags.count("mi_admission", in_group)
+#
+# Bits are in Arrow's order: row i is bit i % 64 of word i // 64.
+import numpy as np
+import pyarrow as pa
+import pyarrow.feather as feather
+
+# Set bits in each 16 bit value, for counting bits where NumPy can't
+POPCOUNT_16 = np.array([bin(value).count("1") for value in range(1 << 16)], dtype="uint8")
+
+
+def popcount(words):
+    """Number of set bits in an array of uint64 words"""
+    words = np.ascontiguousarray(words, dtype="uint64")
+    if hasattr(np, "bitwise_count"):
+        return int(np.bitwise_count(words).sum(dtype="int64"))
+    return int(POPCOUNT_16[words.view("uint16")].sum(dtype="int64"))
+
+
+def word_count(rows):
+    return -(-rows // 64)
+
+
+def pack(values):
+    """A boolean array as a bitset of uint64 words"""
+    values = np.asarray(values, dtype=bool)
+    packed = np.packbits(values, bitorder="little")
+    padded = np.zeros(word_count(len(values)) * 8, dtype="uint8")
+    padded[: len(packed)] = packed
+    return padded.view("uint64")
+
+
+def bitmap_words(buffer, offset, length):
+    """`length` bits of an Arrow bitmap from bit `offset`, as uint64 words"""
+    if offset % 8:
+        values = np.unpackbits(
+            np.frombuffer(buffer, dtype="uint8"), bitorder="little"
+        )[offset : offset + length]
+        return pack(values)
+    start = offset // 8
+    data = np.frombuffer(buffer, dtype="uint8")[start : start + -(-length // 8)]
+    padded = np.zeros(word_count(length) * 8, dtype="uint8")
+    padded[: len(data)] = data
+    if length % 8:
+        # Clear the bits past the end in the last byte
+        padded[len(data) - 1] &= (1 << (length % 8)) - 1
+    return padded.view("uint64")
+
+
+def boolean_words(array):
+    """The bits of an Arrow boolean array as uint64 words, nulls as 0"""
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    validity, values = array.buffers()
+    words = bitmap_words(values, array.offset, len(array))
+    if validity is not None and array.null_count:
+        words = words & bitmap_words(validity, array.offset, len(array))
+    return words
+
+
+def is_packed(field):
+    return pa.types.is_boolean(field.type)
+
+
+class FlagBits:
+    """The bit-packed flags of an input file"""
+
+    def __init__(self, table):
+        self.rows = table.num_rows
+        self.words = {
+            field.name: boolean_words(table.column(field.name))
+            for field in table.schema
+            if is_packed(field)
+        }
+
+    @classmethod
+    def read(cls, filename, columns=None):
+        """The packed flags of a feather file (of `columns` if given)"""
+        packed = packed_columns(filename)
+        if columns is None:
+            columns = packed
+        columns = [name for name in columns if name in packed]
+        # read_table() reads every column given none, so select them again
+        table = feather.read_table(filename, columns=columns, memory_map=True)
+        return cls(table.select(columns))
+
+    @property
+    def names(self):
+        return list(self.words)
+
+    def decode(self, name):
+        """A flag as a 0/1 uint8 array"""
+        return np.unpackbits(
+            self.words[name].view("uint8"), count=self.rows, bitorder="little"
+        )
+
+    def count(self, name, mask=None):
+        """Rows with the flag set, within the bitset `mask` if given"""
+        words = self.words[name]
+        return popcount(words if mask is None else words & mask)
+
+
+def packed_columns(filename):
+    """Names of the bit-packed flags of a feather file"""
+    if not str(filename).endswith(".feather"):
+        return []
+    with pa.memory_map(str(filename)) as source:
+        schema = pa.ipc.open_file(source).schema
+    return [field.name for field in schema if is_packed(field)]
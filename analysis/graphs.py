@@ -0,0 +1,205 @@
+# Line graphs of each outcome by IMD (replaces 102_graphs.do).
+#
+# The IMD measures of every outcome of every cohort are read from the measure
+# store (see measure_store.py), dropping IMD 0 or missing as poisson_prep.py
+# does, and reshaped to one row per outcome and month with a column per IMD
+# quintile, in a single pivot. For each outcome this writes, to
+# output/graphs:
+#   - line_<outcome>_imd.svg: the percentage of the population with the
+#     outcome, by IMD
+#   - line_<outcome>_diff_imd.svg: the change from the previous month
+#   - line_data_<outcome>_diff_imd.csv: the data plotted, in the layout of
+#     the Stata export
+# and combined_england.svg and combined_diff_england.svg put the four CVD
+# admission graphs in a grid with a shared legend.
+#
+# Figures are drawn in parallel across --workers processes. The digest of
+# each figure's data is recorded in output/graphs/digests.json, and a figure
+# is only redrawn when its data (or this script) changes, so regenerating
+# the graphs after updating one measure only redraws that outcome's.
+#
+# Usage:
+#   python analysis/graphs.py [--store output/measures/measures.feather] \
+#       [--output-dir output/graphs] [--workers 4]
+import argparse
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import matplotlib.dates as mdates
+import matplotlib.pyplot as plt
+import pandas as pd
+
+from cohorts import COHORTS
+from measure_store import MeasureStore
+from poisson_prep import prepare_outcomes
+
+QUINTILES = [1, 2, 3, 4, 5]
+LABELS = {
+    1: "IMD 1 (Most deprived)",
+    2: "IMD 2",
+    3: "IMD 3",
+    4: "IMD 4",
+    5: "IMD 5 (Least deprived)",
+}
+# Panel titles of the combined graphs, in the order they're combined
+CVD_TITLES = {
+    "mi_admission": "a",
+    "heart_failure_admission": "b",
+    "stroke_admission": "c",
+    "vte_admission": "d",
+}
+FIRST_TICK = pd.Timestamp("2018-03-01")
+LAST_TICK = pd.Timestamp("2021-11-30")
+DIGESTS = "digests.json"
+
+
+def wide_measures(store):
+    """
+    One row per outcome and month with value, percent, numerator, population
+    and first_derivative columns for each IMD quintile
+    """
+    outcomes = prepare_outcomes(store, "imd")
+    outcomes["percent"] = outcomes["value"] * 100
+    wide = outcomes.pivot_table(
+        index=["cohort", "outcome", "dateA"],
+        columns="imd",
+        values=["value", "percent", "population", "numOutcome"],
+        observed=True,
+        aggfunc="first",
+    )
+    # Change in percent from the previous month of the same outcome
+    derivative = wide["percent"] - wide["percent"].groupby(level="outcome", observed=True).shift()
+    derivative.columns = pd.MultiIndex.from_product([["first_derivative"], derivative.columns])
+    return pd.concat([wide, derivative], axis=1)
+
+
+def stata_layout(wide, outcome, denominator):
+    """An outcome's rows as 102_graphs.do exported them"""
+    names = {"numOutcome": outcome, "population": denominator}
+    columns = {"dateA": wide.index.get_level_values("dateA").strftime("%d/%B/%y")}
+    for quintile in QUINTILES:
+        for stub in ["value", "percent", "population", "numOutcome"]:
+            columns[f"{names.get(stub, stub)}{quintile}"] = wide[(stub, quintile)].to_numpy()
+    for quintile in QUINTILES:
+        columns[f"first_derivative{quintile}"] = wide[("first_derivative", quintile)].to_numpy()
+    return pd.DataFrame(columns)
+
+
+def draw_lines(ax, series, title, ylabel):
+    for quintile in QUINTILES:
+        ax.plot(series.index, series[quintile], label=LABELS[quintile])
+    ax.set_title(title)
+    ax.set_xlabel("Date")
+    ax.set_ylabel(ylabel)
+    ax.set_xticks(pd.date_range(FIRST_TICK, LAST_TICK, freq="90D"))
+    ax.xaxis.set_major_formatter(mdates.DateFormatter("%b-%Y"))
+    ax.xaxis.set_minor_locator(mdates.MonthLocator())
+    ax.tick_params(axis="x", labelrotation=45, labelsize="small")
+    ax.tick_params(axis="y", labelsize="small")
+
+
+def plot(filename, panels, stub, ylabel):
+    """
+    Draw one graph per panel (title, frame with a `stub` column per
+    quintile), in a grid of up to two columns with a shared legend
+    """
+    columns = min(len(panels), 2)
+    rows = -(-len(panels) // columns)
+    fig, axes = plt.subplots(
+        rows, columns, figsize=(6 * columns, 4.5 * rows + 1), squeeze=False, sharey=True
+    )
+    for ax, (title, wide) in zip(axes.flat, panels):
+        series = wide[stub].droplevel(["cohort", "outcome"])
+        draw_lines(ax, series, title, ylabel)
+        if stub == "percent":
+            ax.set_ylim(bottom=0)
+    handles, labels = axes[0, 0].get_legend_handles_labels()
+    fig.legend(
+        handles,
+        labels,
+        loc="lower center",
+        ncol=3,
+        fontsize="small",
+        title="IMD categories",
+        title_fontsize="small",
+    )
+    fig.tight_layout(rect=(0, 1 / (4.5 * rows + 1), 1, 1))
+    fig.savefig(filename)
+    plt.close(fig)
+
+
+def figures(wide, output_dir):
+    """(filename, panels, stub, y axis label) of every figure"""
+    percent = ("percent", "Percentage of population with the outcome")
+    difference = ("first_derivative", "Absolute difference")
+    figures = []
+    for cohort in COHORTS.values():
+        for outcome in cohort["outcomes"]:
+            panels = [
+                (
+                    CVD_TITLES.get(outcome, outcome),
+                    wide.xs(outcome, level="outcome", drop_level=False),
+                )
+            ]
+            figures.append((output_dir / f"line_{outcome}_imd.svg", panels, *percent))
+            figures.append((output_dir / f"line_{outcome}_diff_imd.svg", panels, *difference))
+    cvd = [
+        (title, wide.xs(outcome, level="outcome", drop_level=False))
+        for outcome, title in CVD_TITLES.items()
+    ]
+    figures.append((output_dir / "combined_england.svg", cvd, *percent))
+    figures.append((output_dir / "combined_diff_england.svg", cvd, *difference))
+    return figures
+
+
+def figure_digest(panels, stub, ylabel):
+    digest = hashlib.sha256(Path(__file__).read_bytes())
+    digest.update(repr((stub, ylabel)).encode())
+    for title, wide in panels:
+        digest.update(title.encode())
+        digest.update(pd.util.hash_pandas_object(wide[stub].reset_index()).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def graphs(store, output_dir, workers=None):
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    wide = wide_measures(MeasureStore.read(store))
+    for cohort in COHORTS.values():
+        for outcome, denominator in cohort["outcomes"].items():
+            rows = wide.xs(outcome, level="outcome", drop_level=False)
+            stata_layout(rows, outcome, denominator).to_csv(
+                output_dir / f"line_data_{outcome}_diff_imd.csv", index=False
+            )
+
+    digests_file = output_dir / DIGESTS
+    try:
+        digests = json.loads(digests_file.read_text())
+    except (OSError, ValueError):
+        digests = {}
+    stale = []
+    for filename, *arguments in figures(wide, output_dir):
+        digest = figure_digest(*arguments)
+        if digests.get(filename.name) != digest or not filename.exists():
+            stale.append((filename, *arguments))
+            digests[filename.name] = digest
+    print(f"Drawing {len(stale)} figures")
+    if stale:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(plot, *zip(*stale)))
+    digests_file.write_text(json.dumps(digests, indent=2, sort_keys=True))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--store", default="output/measures/measures.feather")
+    parser.add_argument("--output-dir", default="output/graphs")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    graphs(args.store, args.output_dir, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,492 @@
+# Incremental month by month extraction of study_definition_combined with a
+# content-addressed cache.
+#
+# Every variable is cached per month under a key made from its definition
+# (query type and arguments including any nested variables, with each
+# codelist replaced by a hash of its codes), the index date if the variable
+# depends on it, and the keys of the variables its expression refers to. Only
+# variables whose key isn't in the cache are extracted, so adding a month to
+# the range extracts just that month, and changing a codelist CSV or one
+# outcome definition re-extracts just that variable (and the variables
+# defined in terms of it). Variables which don't depend on the index date are
+# cached once for all months.
+#
+# categorised_as() and satisfying() variables, including the population and
+# the IMD bands, aren't extracted: each month they're computed from the
+# columns they refer to (nested variables being extracted like any other)
+# with compiled expressions, see expressions.py. With dummy data they're
+# extracted from their return_expectations instead, as dummy values of the
+# columns they refer to are independent of each other.
+#
+# Each month the variables the population is computed from are extracted
+# for all patients, and every other variable only for the month's
+# population (with patients.which_exist_in_file()), so the key of those
+# columns includes the key of the month's population. Variables which don't
+# depend on the index date (sex, household size) are all population inputs.
+# Each month's columns are joined on patient_id, and a patient without a
+# value in every column is an error rather than a gap to fill.
+#
+# The cache keeps the columns of each data source apart: dummy data of each
+# population size, and each --database-snapshot (such as the date the
+# database was last refreshed) of each database in DATABASE_URL.
+#
+# Months are extracted in parallel by a pool of --workers processes (one per
+# core by default), each optionally limited to --max-memory-per-worker GB.
+# Each month's files are written by the worker which extracted it, so the
+# output doesn't depend on the number of workers or the order they finish.
+#
+# Writes the same monthly input files as split_months.py. Pass --dummy-data
+# (project.yaml's population_size) or --expectations-population to use dummy
+# data, otherwise DATABASE_URL must be set as for cohortextractor. Measures
+# can then be recomputed incrementally with measures.py --cache-dir.
+#
+# With --outcome-events (the output directory of project.yaml's
+# outcome_events action, for the same months and data) the admission and
+# mortality outcomes, and the variables combining them, are read from each
+# month's partition of outcome events instead of being extracted, so
+# admissions and deaths are read once per run. Dummy patients are numbered
+# from 1 here, unlike the random ids of the combined months extract the
+# events come from, so with dummy data few have any outcome.
+#
+# Usage:
+#   python analysis/incremental.py --cache-dir output/cache \
+#       --output-dir output/measures [--output-format feather] \
+#       [--start 2018-03-01] [--end 2021-12-31] \
+#       [--dummy-data | --expectations-population N | --database-snapshot ID] \
+#       [--workers N] [--max-memory-per-worker GB] \
+#       [--outcome-events output/outcome_events]
+import argparse
+import copy
+import hashlib
+import json
+import os
+import resource
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, reduce
+from itertools import repeat
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import pandas as pd
+import yaml
+from cohortextractor import StudyDefinition, patients
+from cohortextractor.codelistlib import Codelist
+
+from columnar import read_frame, typed_frame, write_frame
+from expressions import compile_categories
+from months import STUDY_MONTHS, month_starts
+from multi_month import date_dependent_names, expressions_of, flatten, referenced_names
+from outcome_events import event_variables, month_outcomes, outcome_indexes, read_partition
+from split_months import MONTH_VARIABLES, write_cohort_months
+from study_definition_combined import default_expectations, variables
+
+# The monthly population is extracted as an ordinary variable, as the
+# extraction population is all patients
+POPULATION_COLUMN = "in_population"
+
+
+def digest(value):
+    return hashlib.sha256(
+        json.dumps(value, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def canonical(value):
+    """A JSON-able copy of a variable definition with codelists hashed"""
+    if isinstance(value, Codelist):
+        return {"codelist": digest([value.system, list(value)])}
+    if isinstance(value, dict):
+        return {str(key): canonical(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [canonical(item) for item in value]
+    return value
+
+
+@lru_cache(maxsize=None)
+def flat_variables():
+    """Every variable, top level or nested, by name"""
+    return flatten(variables)
+
+
+def inputs(name):
+    """Variables, top level or nested, that the expressions of `name` refer to"""
+    query_type, query_args = flat_variables()[name]
+    names = set()
+    for expression in expressions_of(query_type, query_args):
+        names |= referenced_names(expression) & set(flat_variables())
+    return sorted(names - {name})
+
+
+def references(name):
+    """Other top level variables that `name` (or its nested variables) refer to"""
+    names = set()
+    for query_type, query_args in flatten({name: flat_variables()[name]}).values():
+        for expression in expressions_of(query_type, query_args):
+            names |= referenced_names(expression) & set(variables)
+    return sorted(names - {name})
+
+
+def is_derived(name, dummy=False):
+    """Whether a variable is computed from its inputs rather than extracted"""
+    return not dummy and flat_variables()[name][0] == "categorised_as"
+
+
+def variable_keys(index_date):
+    """Cache key of every variable, top level or nested, for one index date"""
+    dependent = date_dependent_names(flat_variables())
+    keys = {}
+
+    def key(name):
+        if name not in keys:
+            query_type, query_args = flat_variables()[name]
+            keys[name] = digest(
+                {
+                    "type": query_type,
+                    "args": canonical(query_args),
+                    "default_expectations": canonical(default_expectations),
+                    "index_date": index_date if name in dependent else None,
+                    "references": {ref: key(ref) for ref in inputs(name)},
+                }
+            )
+        return keys[name]
+
+    for name in flat_variables():
+        key(name)
+    return keys
+
+
+def depth_first(names, edges):
+    """`names` and the variables `edges` leads to, each after those"""
+    order = []
+
+    def visit(name):
+        if name in order:
+            return
+        for ref in edges(name):
+            visit(ref)
+        order.append(name)
+
+    for name in names:
+        visit(name)
+    return order
+
+
+def extraction_order(names):
+    """`names` and the top level variables they refer to, each after those"""
+    return depth_first(names, references)
+
+
+def extraction_plan(names, dummy=False):
+    """
+    The variables to extract for `names`, and those to compute from them in
+    the order to compute them
+    """
+    if dummy:
+        return extraction_order(names), []
+    needed = depth_first(names, lambda name: inputs(name) if is_derived(name) else [])
+    return (
+        [name for name in needed if not is_derived(name)],
+        [name for name in needed if is_derived(name)],
+    )
+
+
+def derive(month, names):
+    """Compute derived variables, in order, from the columns of `month` as text"""
+    for name in names:
+        categories = compile_categories(flat_variables()[name][1]["category_definitions"])
+        month[name] = categories(month).astype(str)
+    return month
+
+
+def extract(names, index_date, expectations_population=None, patient_ids=None):
+    """
+    Extract `names` (and their references) as text, for `patient_ids` or else
+    for all patients
+    """
+    study_variables = {}
+    for name in extraction_order(names):
+        # StudyDefinition adds to the arguments it's given, which would change
+        # the variables' cache keys
+        query_type, query_args = copy.deepcopy(flat_variables()[name])
+        if name == "population":
+            return_expectations = dict(query_args.get("return_expectations") or {})
+            return_expectations["incidence"] = 0.95
+            query_args = dict(query_args, return_expectations=return_expectations)
+            name = POPULATION_COLUMN
+        study_variables[name] = (query_type, query_args)
+    with tempfile.TemporaryDirectory() as tmp:
+        if patient_ids is None:
+            population = patients.all()
+        else:
+            population_file = Path(tmp) / "population.csv"
+            pd.DataFrame({"patient_id": patient_ids}).to_csv(population_file, index=False)
+            population = patients.which_exist_in_file(str(population_file))
+        study = StudyDefinition(
+            default_expectations=default_expectations,
+            index_date=index_date,
+            population=population,
+            **study_variables,
+        )
+        filename = Path(tmp) / "extract.csv"
+        study.to_file(str(filename), expectations_population=expectations_population)
+        extracted = pd.read_csv(filename, dtype=str, keep_default_na=False)
+    if expectations_population:
+        # Dummy patient ids are random on each run; number the patients so
+        # dummy columns from different runs line up
+        extracted["patient_id"] = [str(i) for i in range(1, len(extracted) + 1)]
+    return extracted.rename(columns={POPULATION_COLUMN: "population"})
+
+
+def cache_namespace(expectations_population=None, database_url=None, snapshot=None):
+    """
+    The part of the cache for one data source: dummy data of one population
+    size, or one snapshot of one database
+    """
+    if expectations_population:
+        return f"dummy-{expectations_population}"
+    if not snapshot:
+        raise ValueError("A database snapshot is needed to cache extracted columns")
+    url = urlsplit(database_url or "")
+    # Not the credentials, which may change while the data doesn't
+    database = [url.scheme, url.hostname, url.port, url.path, url.query]
+    return f"database-{digest([database, snapshot])[:16]}"
+
+
+def column_keys(keys, population_key=None):
+    """
+    Cache keys of columns extracted for all patients, or else for the
+    population with the key `population_key`
+    """
+    if population_key is None:
+        return keys
+    return {name: digest([key, population_key]) for name, key in keys.items()}
+
+
+class ColumnCache:
+    """Extracted columns (patient_id and value, as text) stored by key"""
+
+    def __init__(self, cache_dir, namespace):
+        self.cache_dir = Path(cache_dir) / "columns" / namespace
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def path(self, key):
+        return self.cache_dir / f"{key}.feather"
+
+    def __contains__(self, key):
+        return self.path(key).exists()
+
+    def get(self, key):
+        column = read_frame(self.path(key))
+        return column.set_index("patient_id")["value"]
+
+    def put(self, key, extracted, name):
+        column = extracted[["patient_id", name]].rename(columns={name: "value"})
+        # Write then rename so parallel workers never read a partial file
+        partial = self.path(key).with_suffix(f".{os.getpid()}.partial.feather")
+        write_frame(column, partial)
+        os.replace(partial, self.path(key))
+
+
+def month_frame(cache, keys, names, patient_ids=None):
+    """
+    Join the cached columns of `names` for one month on patient_id, for
+    `patient_ids` or else every patient of any column. Each column must have a
+    value for every patient: a gap means columns extracted from different
+    data, or for different patients, are being joined.
+    """
+    columns = {name: cache.get(keys[name]) for name in names}
+    if patient_ids is None:
+        patient_ids = reduce(
+            pd.Index.union, (column.index for column in columns.values()), pd.Index([])
+        )
+    patient_ids = pd.Index(patient_ids, name="patient_id")
+    month = pd.DataFrame(
+        {name: column.reindex(patient_ids) for name, column in columns.items()},
+        index=patient_ids,
+    )
+    gaps = month.columns[month.isna().any()].tolist()
+    if gaps:
+        raise ValueError(f"Cached columns {gaps} don't have a value for every patient")
+    return month.reset_index()
+
+
+def extract_missing(
+    cache,
+    names,
+    index_date,
+    expectations_population=None,
+    patient_ids=None,
+    population_key=None,
+):
+    """
+    Extract and cache whichever of `names` aren't cached for the index date,
+    for all patients or else for `patient_ids`, the population with the key
+    `population_key`
+    """
+    keys = column_keys(variable_keys(index_date), population_key)
+    missing = [name for name in names if keys[name] not in cache]
+    if missing:
+        extracted = extract(missing, index_date, expectations_population, patient_ids)
+        for name in extracted.columns.drop("patient_id"):
+            # Don't cache references extracted for other patients than they're
+            # cached for, or replace columns already cached (e.g. static
+            # variables extracted again as a reference) so every month uses
+            # the same
+            if name in names and keys[name] not in cache:
+                cache.put(keys[name], extracted, name)
+    return missing
+
+
+def extract_month(
+    cache_dir,
+    namespace,
+    index_date,
+    output_dir,
+    output_format,
+    expectations_population,
+    outcome_events=None,
+):
+    cache = ColumnCache(cache_dir, namespace)
+    dummy = bool(expectations_population)
+    from_events = event_variables() if outcome_events else []
+    names = [name for name in MONTH_VARIABLES if name not in from_events]
+    extracted, derived = extraction_plan(names, dummy)
+    everyone, population_derived = extraction_plan(["population"], dummy)
+    keys = variable_keys(index_date)
+    missing = extract_missing(cache, everyone, index_date, expectations_population)
+    month = derive(month_frame(cache, keys, everyone), population_derived)
+    month = month[month["population"] == "1"].reset_index(drop=True)
+    in_population = [name for name in extracted if name not in everyone]
+    missing += extract_missing(
+        cache,
+        in_population,
+        index_date,
+        expectations_population,
+        patient_ids=month["patient_id"],
+        population_key=keys["population"],
+    )
+    restricted = month_frame(
+        cache,
+        column_keys(keys, keys["population"]),
+        in_population,
+        patient_ids=month["patient_id"],
+    )
+    month = pd.concat([month, restricted.drop(columns="patient_id")], axis=1)
+    month = derive(month, [name for name in derived if name not in population_derived])
+    month = month[["patient_id", *names]]
+    if from_events:
+        indexes = outcome_indexes(read_partition(outcome_events, index_date), month["patient_id"])
+        flags = month_outcomes(indexes, index_date, len(month))
+        # As text, like the extracted columns
+        month = month.assign(**{name: flags[name].astype(str) for name in from_events})
+        month = month[["patient_id", *MONTH_VARIABLES]]
+    if output_format == "feather":
+        month = typed_frame(month)
+    write_cohort_months(month, index_date, output_dir, output_format)
+    return len(missing)
+
+
+def limit_memory(max_memory):
+    """Cap a worker's address space (in bytes) so one month can't exhaust the node"""
+    if max_memory:
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+
+
+def extract_incrementally(
+    cache_dir,
+    namespace,
+    output_dir,
+    index_dates=STUDY_MONTHS,
+    output_format="csv",
+    expectations_population=None,
+    workers=1,
+    max_memory=None,
+    outcome_events=None,
+):
+    """
+    Extract each month in `index_dates` in a pool of `workers` processes.
+    Months are independent apart from the variables which don't depend on the
+    index date, which are extracted first so that every month shares them.
+    """
+    dependent = date_dependent_names(flat_variables())
+    everyone, _ = extraction_plan(["population"], dummy=bool(expectations_population))
+    static = [name for name in everyone if name not in dependent]
+    cache = ColumnCache(cache_dir, namespace)
+    extract_missing(cache, static, index_dates[0], expectations_population)
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=limit_memory, initargs=(max_memory,)
+    ) as pool:
+        extracted = pool.map(
+            extract_month,
+            repeat(cache_dir),
+            repeat(namespace),
+            index_dates,
+            repeat(output_dir),
+            repeat(output_format),
+            repeat(expectations_population),
+            repeat(outcome_events),
+        )
+        # Results come back in month order whichever worker finishes first
+        for index_date, count in zip(index_dates, extracted):
+            print(f"{index_date}: extracted {count} variables")
+
+
+def project_population_size():
+    """The dummy data population size from project.yaml's expectations"""
+    with open(Path(__file__).parent.parent / "project.yaml") as f:
+        return yaml.safe_load(f)["expectations"]["population_size"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cache-dir", required=True)
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--output-format", choices=["csv", "feather"], default="csv")
+    parser.add_argument("--start", default=STUDY_MONTHS[0])
+    parser.add_argument("--end", default=STUDY_MONTHS[-1])
+    dummy_data = parser.add_mutually_exclusive_group()
+    dummy_data.add_argument("--expectations-population", type=int)
+    dummy_data.add_argument(
+        "--dummy-data",
+        action="store_true",
+        help="use dummy data with project.yaml's expectations population_size",
+    )
+    dummy_data.add_argument(
+        "--database-snapshot",
+        help="identifies the database's contents, e.g. the date it was refreshed",
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--max-memory-per-worker", type=float, help="in GB, unlimited if not given"
+    )
+    parser.add_argument(
+        "--outcome-events", help="read the outcomes from outcome_events.py's output"
+    )
+    args = parser.parse_args()
+    expectations_population = args.expectations_population
+    if args.dummy_data:
+        expectations_population = project_population_size()
+    if not (expectations_population or args.database_snapshot):
+        parser.error("--database-snapshot is needed to extract from the database")
+    namespace = cache_namespace(
+        expectations_population, os.environ.get("DATABASE_URL"), args.database_snapshot
+    )
+    max_memory = None
+    if args.max_memory_per_worker:
+        max_memory = int(args.max_memory_per_worker * 1024**3)
+    extract_incrementally(
+        args.cache_dir,
+        namespace,
+        args.output_dir,
+        index_dates=month_starts(args.start, args.end),
+        output_format=args.output_format,
+        expectations_population=expectations_population,
+        workers=args.workers,
+        max_memory=max_memory,
+        outcome_events=args.outcome_events,
+    )
+
+
+if __name__ == "__main__":
+    main()
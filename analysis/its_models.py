@@ -0,0 +1,209 @@
+# Interrupted time series models of every outcome, fitted in one batch.
+#
+# 104_poisson.R fits one quasi-Poisson model per CVD outcome. This fits a
+# segmented quasi-Poisson regression to every series prepared by
+# poisson_prep.py, that is every outcome of every cohort in each IMD
+# quintile and each migration status group:
+#
+#   log(numOutcome) = log(population) + b0 + b1 postcovid + b2 time
+#                     + b3 time_postcovid
+#
+# where time_postcovid counts the months since March 2020 (0 in March 2020),
+# so b1 is the change in level and b3 the change in trend at the start of the
+# pandemic. The series are stacked into arrays of (series, month) and fitted
+# together by iteratively reweighted least squares, each iteration solving
+# all the series' normal equations at once. Months missing from a series, or
+# with no population, get no weight. Blocks of series are fitted in parallel
+# across --workers processes.
+#
+# As with R's quasipoisson family, standard errors are scaled by the Pearson
+# dispersion and p-values come from the t distribution on the residual
+# degrees of freedom; confidence intervals are estimate +/- 1.96 SE, as
+# 104_poisson.R uses for its predictions.
+#
+# Usage:
+#   python analysis/its_models.py [--poisson-dir output/poisson] \
+#       [--output output/poisson/its_models.csv] [--workers 4]
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from columnar import read_frame, write_frame
+from poisson_prep import POISSON_FILES
+
+TERMS = ["intercept", "postcovid", "time", "time_postcovid"]
+SERIES = ["cohort", "outcome", "group_by", "group"]
+RESULT_COLUMNS = [
+    "estimate",
+    "std_error",
+    "statistic",
+    "p_value",
+    "dispersion",
+    "df_residual",
+    "converged",
+    "rate_ratio",
+    "conf_low",
+    "conf_high",
+]
+MAX_ITERATIONS = 25
+# As glm.control in R
+TOLERANCE = 1e-8
+Z_95 = 1.96
+
+
+def read_series(poisson_dir):
+    """Rows of every series, with group_by and group columns"""
+    series = []
+    for group_by, filename in POISSON_FILES.items():
+        rows = read_frame(Path(poisson_dir) / filename)
+        rows = rows.rename(columns={group_by: "group"})
+        rows.insert(2, "group_by", group_by)
+        series.append(rows)
+    series = pd.concat(series, ignore_index=True)
+    series["dateA"] = pd.to_datetime(series["dateA"])
+    return series.dropna(subset=["time"])
+
+
+def stack_series(rows):
+    """
+    Counts, log populations, designs and weights as (series, month) arrays,
+    and the key of each series
+    """
+    series, keys = pd.factorize(pd.MultiIndex.from_frame(rows[SERIES].astype(str)))
+    month, _ = pd.factorize(rows["dateA"], sort=True)
+    shape = (len(keys), month.max() + 1)
+
+    def stack(values):
+        stacked = np.zeros(shape)
+        stacked[series, month] = values
+        return stacked
+
+    counts = stack(rows["numOutcome"])
+    population = stack(rows["population"])
+    time = stack(rows["time"].astype(float))
+    postcovid = stack(rows["postcovid"])
+    weights = stack(1) * (population > 0)
+    # Months since the first postcovid month of each series
+    first_postcovid = np.where(postcovid == 1, time, np.inf).min(axis=1, keepdims=True)
+    time_postcovid = np.where(postcovid == 1, time - first_postcovid, 0)
+    design = np.stack([np.ones(shape), postcovid, time, time_postcovid], axis=-1)
+    offset = np.log(np.where(weights > 0, population, 1))
+    return counts, offset, design, weights, keys.to_frame(index=False, name=SERIES)
+
+
+def solve(xtwx, xtwz):
+    """Solve each series' normal equations, even if some are singular"""
+    try:
+        return np.linalg.solve(xtwx, xtwz[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        return (np.linalg.pinv(xtwx, hermitian=True) @ xtwz[..., None])[..., 0]
+
+
+def deviance(counts, mu, weights):
+    ratio = np.where(counts > 0, counts / mu, 1)
+    return 2 * (weights * (counts * np.log(ratio) - (counts - mu))).sum(axis=1)
+
+
+def fit_batch(counts, offset, design, weights):
+    """
+    Fit a Poisson regression to each series by IRLS, all series at once.
+    Returns the coefficients, their unscaled covariance, the fitted means and
+    whether each series converged.
+    """
+    n_series = counts.shape[0]
+    # Start from the counts, as R's poisson family does
+    mu = counts + 0.1
+    eta = np.log(mu)
+    old_deviance = deviance(counts, mu, weights)
+    converged = np.zeros(n_series, dtype=bool)
+    for _ in range(MAX_ITERATIONS):
+        working = eta - offset + (counts - mu) / mu
+        w = weights * mu
+        xtwx = np.einsum("stp,st,stq->spq", design, w, design)
+        xtwz = np.einsum("stp,st,st->sp", design, w, working)
+        beta = solve(xtwx, xtwz)
+        eta = np.einsum("stp,sp->st", design, beta) + offset
+        mu = np.exp(eta)
+        new_deviance = deviance(counts, mu, weights)
+        converged = np.abs(new_deviance - old_deviance) / (np.abs(new_deviance) + 0.1) < TOLERANCE
+        if converged.all():
+            break
+        old_deviance = new_deviance
+    xtwx = np.einsum("stp,st,stq->spq", design, weights * mu, design)
+    covariance = np.linalg.pinv(xtwx, hermitian=True)
+    return beta, covariance, mu, converged
+
+
+def fit_series(counts, offset, design, weights):
+    """Coefficient estimates and quasi-Poisson inference for each series"""
+    beta, covariance, mu, converged = fit_batch(counts, offset, design, weights)
+    n_terms = design.shape[-1]
+    df_residual = weights.sum(axis=1) - n_terms
+    pearson = (weights * (counts - mu) ** 2 / mu).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dispersion = pearson / df_residual
+        std_error = np.sqrt(np.diagonal(covariance, axis1=1, axis2=2) * dispersion[:, None])
+        statistic = beta / std_error
+    p_value = 2 * stats.t.sf(np.abs(statistic), df_residual[:, None])
+    return dict(
+        estimate=beta,
+        std_error=std_error,
+        statistic=statistic,
+        p_value=p_value,
+        dispersion=np.repeat(dispersion[:, None], n_terms, axis=1),
+        df_residual=np.repeat(df_residual[:, None], n_terms, axis=1),
+        converged=np.repeat(converged[:, None], n_terms, axis=1),
+    )
+
+
+def fit_models(rows, workers=None):
+    """One row per series and term, with the rate ratio and its 95% CI"""
+    if rows.empty:
+        models = pd.DataFrame(columns=[*SERIES, "term", *RESULT_COLUMNS])
+        return models.astype({"converged": "bool"})
+    counts, offset, design, weights, keys = stack_series(rows)
+    workers = workers or os.cpu_count()
+    blocks = np.array_split(np.arange(len(keys)), min(workers, len(keys)))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        fitted = list(
+            executor.map(
+                fit_series,
+                *zip(
+                    *(
+                        (counts[block], offset[block], design[block], weights[block])
+                        for block in blocks
+                    )
+                ),
+            )
+        )
+    results = {name: np.concatenate([block[name] for block in fitted]) for name in fitted[0]}
+    models = keys.loc[keys.index.repeat(len(TERMS))].reset_index(drop=True)
+    models["term"] = np.tile(TERMS, len(keys))
+    for name, values in results.items():
+        models[name] = values.ravel()
+    models["rate_ratio"] = np.exp(models["estimate"])
+    models["conf_low"] = np.exp(models["estimate"] - Z_95 * models["std_error"])
+    models["conf_high"] = np.exp(models["estimate"] + Z_95 * models["std_error"])
+    return models
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--poisson-dir", default="output/poisson")
+    parser.add_argument("--output", default="output/poisson/its_models.csv")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    models = fit_models(read_series(args.poisson_dir), args.workers)
+    write_frame(models, args.output)
+    not_converged = models.loc[~models["converged"], SERIES].drop_duplicates()
+    for series in not_converged.itertuples(index=False):
+        print(f"Model didn't converge: {' '.join(map(str, series))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+# All measures of all cohorts in one long table.
+#
+# Rather than a measure_<id>.csv per outcome and grouping, the store holds a
+# row per cohort, outcome, grouping, group and month:
+#
+#   cohort, outcome, group_by, group, date, numerator, denominator, value
+#
+# kept as a partition of rows per outcome and month, so a lookup doesn't scan
+# the table:
+#
+#   store = MeasureStore.read("output/measures/measures.feather")
+#   store.select("mi_admission", group_by="imd")
+#   store.select("mi_admission", date="2020-03-01")
+#
+# Appending a month's rows replaces any rows already stored for the same
+# cohort, outcome, grouping and month, so measures can be recalculated a
+# month at a time; only the partitions appended to are sorted again. The
+# store is written as one table sorted by outcome and date. Group values are
+# stored as strings, as they come from different variables.
+#
+# Usage (builds the store from every cohort's measure files):
+#   python analysis/measure_store.py [--measures-dir output/measures] \
+#       [--store output/measures/measures.feather]
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from cohorts import COHORTS, measure_definitions
+from columnar import read_frame, write_frame
+
+COLUMNS = [
+    "cohort",
+    "outcome",
+    "group_by",
+    "group",
+    "date",
+    "numerator",
+    "denominator",
+    "value",
+]
+PARTITION_KEY = ["outcome", "date"]
+# Appended rows replace a partition's rows of the same cohort and grouping
+KEY = ["cohort", "group_by"]
+SORT_ORDER = ["cohort", "group_by", "group"]
+CATEGORIES = ["cohort", "outcome", "group_by", "group"]
+
+
+def long_rows(cohort, definition, measure):
+    """A measure's rows (as written by measures.py) in the store's layout"""
+    (group_by,) = definition["group_by"]
+    return pd.DataFrame(
+        {
+            "cohort": cohort,
+            "outcome": definition["numerator"],
+            "group_by": group_by,
+            "group": measure[group_by].astype(str),
+            "date": pd.to_datetime(measure["date"]),
+            "numerator": measure[definition["numerator"]].astype("float64"),
+            "denominator": measure[definition["denominator"]].astype("float64"),
+            "value": measure["value"].astype("float64"),
+        }
+    )
+
+
+class MeasureStore:
+    """Long-format measures partitioned by (outcome, date)"""
+
+    def __init__(self, rows=None):
+        self.partitions = {}
+        self._rows = None
+        if rows is not None:
+            self.append(rows)
+
+    @classmethod
+    def read(cls, filename):
+        """The store in `filename`, or an empty store if there isn't one"""
+        if not Path(filename).exists():
+            return cls()
+        return cls(read_frame(filename))
+
+    def write(self, filename):
+        write_frame(self.rows, filename)
+
+    @property
+    def rows(self):
+        """Every row, sorted by outcome and date"""
+        if self._rows is None:
+            self._rows = self._concat(self.partitions[key] for key in sorted(self.partitions))
+        return self._rows
+
+    @property
+    def outcomes(self):
+        return list(dict.fromkeys(outcome for outcome, _ in sorted(self.partitions)))
+
+    @property
+    def dates(self):
+        return sorted({date for _, date in self.partitions})
+
+    def select(self, outcome, date=None, group_by=None):
+        """An outcome's rows, for one month if `date` is given"""
+        if date is None:
+            keys = sorted(key for key in self.partitions if key[0] == outcome)
+        else:
+            keys = [(outcome, pd.Timestamp(date))]
+        rows = self._concat(self.partitions[key] for key in keys if key in self.partitions)
+        if group_by is not None:
+            rows = rows[rows["group_by"] == group_by]
+        return rows
+
+    def append(self, rows):
+        """
+        Add rows, replacing any stored for the same cohort, outcome, grouping
+        and month
+        """
+        rows = typed_rows(rows).sort_values(
+            [*PARTITION_KEY, *SORT_ORDER], kind="stable", ignore_index=True
+        )
+        outcome = rows["outcome"].to_numpy()
+        date = rows["date"].to_numpy()
+        # Where each partition's rows start
+        starts = np.ones(len(rows), dtype=bool)
+        starts[1:] = (outcome[1:] != outcome[:-1]) | (date[1:] != date[:-1])
+        starts = np.flatnonzero(starts)
+        for start, stop in zip(starts, np.r_[starts[1:], len(rows)]):
+            key = (outcome[start], pd.Timestamp(date[start]))
+            added = rows.iloc[start:stop].reset_index(drop=True)
+            stored = self.partitions.get(key)
+            if stored is not None:
+                replaced = pd.MultiIndex.from_frame(stored[KEY]).isin(
+                    pd.MultiIndex.from_frame(added[KEY])
+                )
+                added = pd.concat([stored[~replaced], added], ignore_index=True)
+                added = added.sort_values(SORT_ORDER, kind="stable", ignore_index=True)
+            self.partitions[key] = added
+        self._rows = None
+
+    @staticmethod
+    def _concat(partitions):
+        rows = pd.concat([typed_rows(pd.DataFrame(columns=COLUMNS)), *partitions])
+        rows = rows.reset_index(drop=True)
+        return rows.astype({column: "category" for column in CATEGORIES})
+
+
+def typed_rows(rows):
+    rows = rows[COLUMNS].astype(
+        {
+            "cohort": str,
+            "outcome": str,
+            "group_by": str,
+            "group": str,
+            "numerator": "float64",
+            "denominator": "float64",
+            "value": "float64",
+        }
+    )
+    rows["date"] = pd.to_datetime(rows["date"])
+    return rows
+
+
+def add_measures(store, cohort, measures):
+    """Append a cohort's measures ({measure id: frame}) to the store"""
+    store.append(
+        pd.concat(
+            [
+                long_rows(cohort, definition, measures[definition["id"]])
+                for definition in measure_definitions(cohort)
+            ],
+            ignore_index=True,
+        )
+    )
+
+
+def build_store(measures_dir):
+    """A store of every cohort's measure files"""
+    store = MeasureStore()
+    for cohort_name, cohort in COHORTS.items():
+        measures = {
+            definition["id"]: pd.read_csv(
+                Path(measures_dir) / cohort["subdir"] / f"measure_{definition['id']}.csv",
+                dtype={group_by: str for group_by in definition["group_by"]},
+                float_precision="round_trip",
+            )
+            for definition in measure_definitions(cohort_name)
+        }
+        add_measures(store, cohort_name, measures)
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--measures-dir", default="output/measures")
+    parser.add_argument("--store", default="output/measures/measures.feather")
+    args = parser.parse_args()
+    build_store(args.measures_dir).write(args.store)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+# Calculates all of a cohort's measures (see cohorts.py) from its monthly
+# input files. Replaces cohortextractor generate_measures: each monthly file is
+# read once, with only the columns the measures need, and all numerators and
+# denominators for a group_by variable are summed in one grouped aggregation.
+# Flags stored bit-packed (split_months.py --pack-flags) aren't unpacked: each
+# group's rows are packed into a bitset once and every flag's count in the
+# group is a popcount of the two bitsets ANDed together.
+# Writes measure_<id>.csv with the same layout as generate_measures.
+#
+# With --cache-dir each month's results are cached under a hash of the
+# month's input file and the measure definitions, so only months whose input
+# changed (see incremental.py) are recalculated. With --store the measures
+# are also added to the long-format store of all cohorts' measures (see
+# measure_store.py), replacing the cohort's existing rows for the same months.
+#
+# Usage:
+#   python analysis/measures.py --cohort dm --input-dir output/measures/dm \
+#       --output-dir output/measures/dm [--output-format feather] \
+#       [--cache-dir output/cache] [--store output/measures/measures.feather]
+import argparse
+import hashlib
+import json
+import re
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from cohorts import COHORTS, GROUP_BY, measure_definitions
+from columnar import read_frame, write_frame
+from flag_bits import FlagBits, pack, packed_columns
+from measure_store import MeasureStore, add_measures
+
+POPULATION_COLUMN = "population"
+
+
+def input_files(input_dir, prefix):
+    """Monthly input files for a cohort, as (date, path) in date order"""
+    pattern = re.compile(
+        rf"^input_{re.escape(prefix)}(\d{{4}}-\d{{2}}-\d{{2}})\.(csv|feather)$"
+    )
+    files = []
+    for path in Path(input_dir).iterdir():
+        match = pattern.match(path.name)
+        if match:
+            files.append((match.group(1), path))
+    return sorted(files)
+
+
+def columns_needed(definitions):
+    columns = []
+    for definition in definitions:
+        numerator, denominator = definition["numerator"], definition["denominator"]
+        for column in [*definition["group_by"], numerator, denominator]:
+            if column != POPULATION_COLUMN and column not in columns:
+                columns.append(column)
+    return columns
+
+
+def group_sums(patients, group_by, value_columns, flags=None):
+    """Sum of each value column in each group, in group order"""
+    grouped = patients.groupby([patients[column] for column in group_by], observed=True)
+    counted = [column for column in value_columns if column != POPULATION_COLUMN]
+    if flags is not None:
+        # Count bit-packed flags by popcount over each group's bitset of rows
+        sizes = grouped.size()
+        groups = grouped.ngroup().to_numpy()
+        masks = [pack(groups == i) for i in range(len(sizes))]
+        sums = sizes.index.to_frame(index=False)
+        for column in value_columns:
+            if column == POPULATION_COLUMN:
+                sums[column] = sizes.to_numpy()
+            elif column in flags.names:
+                counts = [flags.count(column, mask) for mask in masks]
+                sums[column] = np.array(counts, dtype="float64")
+            else:
+                in_group = groups >= 0
+                sums[column] = np.bincount(
+                    groups[in_group],
+                    weights=patients[column].to_numpy("float64", na_value=0)[in_group],
+                    minlength=len(sizes),
+                )
+        return sums.sort_values(group_by, kind="stable", ignore_index=True)
+    # generate_measures loads every column other than the population as a
+    # float; casting before summing also stops uint8 flags overflowing
+    values = patients[value_columns].astype({column: "float64" for column in counted})
+    return (
+        values.groupby([patients[column] for column in group_by], observed=True)
+        .sum()
+        .sort_index()
+        .reset_index()
+    )
+
+
+def calculate_month(patients, definitions, date, flags=None):
+    """
+    All measures for one month of patient data, as {measure id: frame},
+    counting the flags in `flags` (see flag_bits.py) from their packed bits
+    """
+    patients = patients.assign(**{POPULATION_COLUMN: 1})
+    by_group = defaultdict(list)
+    for definition in definitions:
+        by_group[tuple(definition["group_by"])].append(definition)
+    results = {}
+    for group_by, group_definitions in by_group.items():
+        value_columns = list(
+            dict.fromkeys(
+                column
+                for definition in group_definitions
+                for column in (definition["numerator"], definition["denominator"])
+            )
+        )
+        sums = group_sums(patients, list(group_by), value_columns, flags)
+        for definition in group_definitions:
+            numerator, denominator = definition["numerator"], definition["denominator"]
+            result = sums[[*group_by, numerator, denominator]].copy()
+            result["value"] = result[numerator] / result[denominator]
+            result["date"] = date
+            results[definition["id"]] = result
+    return results
+
+
+def month_key(path, definitions, date):
+    """Hash of a month's input file, the measure definitions and the date"""
+    key = hashlib.sha256(json.dumps([definitions, date], sort_keys=True).encode())
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            key.update(block)
+    return key.hexdigest()
+
+
+def calculate_measures(
+    cohort, input_dir, output_dir, output_format="csv", cache_dir=None, store=None
+):
+    definitions = measure_definitions(cohort)
+    columns = columns_needed(definitions)
+    if cache_dir:
+        cache_dir = Path(cache_dir) / "measures"
+        cache_dir.mkdir(parents=True, exist_ok=True)
+    results = defaultdict(list)
+    for date, path in input_files(input_dir, COHORTS[cohort]["prefix"]):
+        cached = cache_dir and cache_dir / f"{month_key(path, definitions, date)}.pickle"
+        if cached and cached.exists():
+            monthly = pd.read_pickle(cached)
+        else:
+            # Bit-packed flags are counted packed, unless they're grouped by
+            packed = set(packed_columns(path)) - set(GROUP_BY)
+            flags = None
+            if packed:
+                flags = FlagBits.read(path, [column for column in columns if column in packed])
+            patients = read_frame(
+                path, columns=[column for column in columns if column not in packed]
+            )
+            monthly = calculate_month(patients, definitions, date, flags)
+            if cached:
+                pd.to_pickle(monthly, cached)
+        for measure_id, result in monthly.items():
+            results[measure_id].append(result)
+    if not results:
+        raise FileNotFoundError(f"No {cohort} input files found in {input_dir}")
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    measures = {
+        measure_id: pd.concat(monthly, ignore_index=True)
+        for measure_id, monthly in results.items()
+    }
+    if store:
+        measure_store = MeasureStore.read(store)
+        add_measures(measure_store, cohort, measures)
+        measure_store.write(store)
+    for definition in definitions:
+        measure = measures[definition["id"]]
+        if output_format == "feather":
+            group_by = definition["group_by"]
+            measure = measure.astype({column: "category" for column in group_by})
+            measure["date"] = pd.to_datetime(measure["date"])
+        filename = f"measure_{definition['id']}.{output_format}"
+        write_frame(measure, output_dir / filename)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cohort", choices=list(COHORTS), required=True)
+    parser.add_argument("--input-dir", required=True)
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--output-format", choices=["csv", "feather"], default="csv")
+    parser.add_argument("--cache-dir")
+    parser.add_argument("--store")
+    args = parser.parse_args()
+    calculate_measures(
+        args.cohort,
+        args.input_dir,
+        args.output_dir,
+        args.output_format,
+        cache_dir=args.cache_dir,
+        store=args.store,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+# The study months, shared by the study definitions and the python:latest
+# stages which split and summarise their extracts. This module has no
+# cohortextractor dependency.
+import datetime
+
+
+def month_starts(start, end):
+    """First day of every month from `start` to `end` inclusive (ISO strings)"""
+    date = datetime.date.fromisoformat(start).replace(day=1)
+    end = datetime.date.fromisoformat(end)
+    dates = []
+    while date <= end:
+        dates.append(date.isoformat())
+        date = date.replace(
+            year=date.year + date.month // 12, month=date.month % 12 + 1
+        )
+    return dates
+
+
+def month_end(index_date):
+    """Last day of the month of `index_date`, as last_day_of_month(index_date)"""
+    date = datetime.date.fromisoformat(index_date)
+    next_month = date.replace(day=28) + datetime.timedelta(days=4)
+    return (next_month - datetime.timedelta(days=next_month.day)).isoformat()
+
+
+# Equivalent of --index-date-range "2018-03-01 to 2021-12-31 by month"
+STUDY_MONTHS = month_starts("2018-03-01", "2021-12-31")
+
+
+def month_suffix(index_date):
+    return "_" + index_date.replace("-", "_")
@@ -0,0 +1,191 @@
+# Single-pass extraction of every month in an index date range.
+#
+# `generate_cohort --index-date-range` re-runs the whole study definition
+# once per month. Instead we take the variables of a monthly study definition
+# and expand them into one wide study definition: variables which don't depend
+# on the index date (sex, household size) are extracted once, everything that
+# does is repeated once per month with the index date evaluated and the month
+# appended to the column name (e.g. `mi_admission_2018_03_01`). Each month's
+# population is kept as a `population_<month>` column so that
+# `split_months.py` can write the usual `input_*_YYYY-MM-DD.csv` files.
+import re
+
+from cohortextractor import StudyDefinition, patients
+from cohortextractor.date_expressions import (
+    DateExpressionEvaluator,
+    evaluate_date_expressions_in_expectations_definition,
+)
+
+from months import month_suffix
+
+DATE_ARGS = (
+    "date",
+    "reference_date",
+    "start_date",
+    "end_date",
+    "on_or_before",
+    "on_or_after",
+    "between",
+)
+KEYWORDS = {"AND", "OR", "NOT"}
+NAME = re.compile(r"'[^']*'|\"[^\"]*\"|\b[A-Za-z_][A-Za-z0-9_]*\b")
+
+
+def last_day_of_month(index_date):
+    """`last_day_of_month(index_date)`, evaluated as cohortextractor would"""
+    return DateExpressionEvaluator(index_date)("last_day_of_month(index_date)")
+
+
+def referenced_names(expression):
+    return {
+        token
+        for token in NAME.findall(str(expression))
+        if token[0] not in "'\"" and token not in KEYWORDS
+    }
+
+
+def rename_references(expression, names, suffix):
+    def rename(match):
+        token = match.group(0)
+        return token + suffix if token in names else token
+
+    return NAME.sub(rename, expression)
+
+
+def flatten(variables):
+    """
+    Pull nested `extra_columns` out into a flat dict of name -> (query_type,
+    query_args), checking for name clashes as cohortextractor does
+    """
+    flat = {}
+    for name, (query_type, query_args) in variables.items():
+        flat.update(flatten(query_args.get("extra_columns") or {}))
+        if name in flat:
+            raise ValueError(f"Duplicate columns named '{name}'")
+        flat[name] = (query_type, query_args)
+    return flat
+
+
+def expressions_of(query_type, query_args):
+    if query_type == "categorised_as":
+        return list(query_args["category_definitions"].values())
+    return []
+
+
+def uses_index_date(query_args):
+    def mentions(value):
+        if isinstance(value, str):
+            return "index_date" in value
+        if isinstance(value, (list, tuple)):
+            return any(mentions(item) for item in value)
+        return False
+
+    return any(mentions(query_args.get(key)) for key in DATE_ARGS)
+
+
+def date_dependent_names(flat):
+    """
+    Names of variables which use the index date directly, or are expressions
+    over variables which do
+    """
+    dependent = {
+        name for name, (_, query_args) in flat.items() if uses_index_date(query_args)
+    }
+    changed = True
+    while changed:
+        changed = False
+        for name, (query_type, query_args) in flat.items():
+            if name in dependent:
+                continue
+            for expression in expressions_of(query_type, query_args):
+                if referenced_names(expression) & dependent:
+                    dependent.add(name)
+                    changed = True
+                    break
+    return dependent
+
+
+def evaluate_for_month(query_type, query_args, index_date, dependent, declared):
+    """
+    Copy a date dependent variable for one index date. Nested variables which
+    depend on the index date get the month suffix too; nested variables which
+    don't are only declared the first time we see them.
+    """
+    evaluate = DateExpressionEvaluator(index_date)
+    suffix = month_suffix(index_date)
+    query_args = dict(query_args)
+    for key in DATE_ARGS:
+        value = query_args.get(key)
+        if isinstance(value, str):
+            query_args[key] = evaluate(value)
+        elif isinstance(value, (list, tuple)):
+            query_args[key] = [evaluate(item) for item in value]
+    if query_type == "categorised_as":
+        query_args["category_definitions"] = {
+            category: rename_references(expression, dependent, suffix)
+            for category, expression in query_args["category_definitions"].items()
+        }
+    if query_args.get("return_expectations"):
+        query_args["return_expectations"] = (
+            evaluate_date_expressions_in_expectations_definition(
+                query_args["return_expectations"], index_date
+            )
+        )
+    extra_columns = {}
+    nested = query_args.get("extra_columns") or {}
+    for name, (nested_type, nested_args) in nested.items():
+        if name in dependent:
+            extra_columns[name + suffix] = evaluate_for_month(
+                nested_type, nested_args, index_date, dependent, declared
+            )
+        elif name not in declared:
+            declared.add(name)
+            extra_columns[name] = (nested_type, nested_args)
+    if extra_columns:
+        query_args["extra_columns"] = extra_columns
+    else:
+        query_args.pop("extra_columns", None)
+    return query_type, query_args
+
+
+def expand_by_month(variables, index_dates):
+    """
+    Expand a dict of study definition variables (including `population`) into
+    wide variables covering every index date, in the original variable order
+    """
+    dependent = date_dependent_names(flatten(variables))
+    declared = set()
+    expanded = {}
+    # Like cohortextractor, define the population last as it refers to the
+    # other variables
+    names = [name for name in variables if name != "population"] + ["population"]
+    for name in names:
+        query_type, query_args = variables[name]
+        if name == "population":
+            # Each month's population is output so we can split by it later
+            return_expectations = dict(query_args.get("return_expectations") or {})
+            return_expectations["incidence"] = 0.95
+            query_args = dict(query_args, return_expectations=return_expectations)
+        if name not in dependent:
+            expanded[name] = (query_type, query_args)
+            continue
+        for index_date in index_dates:
+            expanded[name + month_suffix(index_date)] = evaluate_for_month(
+                query_type, query_args, index_date, dependent, declared
+            )
+    return expanded
+
+
+def multi_month_study(index_dates, default_expectations=None, **variables):
+    """
+    Build a single StudyDefinition which extracts every month in
+    `index_dates` for the given monthly study definition variables. The study
+    population is everyone who is in the population in any month.
+    """
+    monthly_populations = [f"population{month_suffix(date)}" for date in index_dates]
+    return StudyDefinition(
+        default_expectations=default_expectations,
+        index_date=index_dates[0],
+        population=patients.satisfying(" OR ".join(monthly_populations)),
+        **expand_by_month(variables, index_dates),
+    )
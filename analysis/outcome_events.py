@@ -0,0 +1,227 @@
+# Month-partitioned table of outcome events, extracted once per run.
+#
+# The general, diabetes and respiratory cohorts' admission and mortality
+# outcomes (see outcome_scans.py) all come from the same two tables over the
+# same months. The variables of study_definition_outcome_events, extracted
+# with study_definition_combined_months, read the admissions and deaths with
+# an outcome diagnosis or cause in the whole study period once, and this
+# stage collects them and classifies death causes into every outcome. It
+# writes a partition per month, <output-dir>/outcome_events_YYYY-MM-DD.feather,
+# of each distinct (patient_id, outcome, source, date) with an event in the
+# month. The source is the code column matched: primary_diagnosis,
+# all_diagnoses or underlying_cause.
+# split_months.py and incremental.py --outcome-events then read every
+# cohort's outcome flags, and the satisfying() variables combining them
+# (such as mh_admission or resp_copd_exac), from the events instead of
+# extracting them with cohortextractor month by month. The events of a set
+# of patients are indexed once (see event_index.py), and each month's
+# outcomes are windows over the index:
+#
+#   events = read_events("output/outcome_events", STUDY_MONTHS)
+#   indexes = outcome_indexes(events, patient_ids)
+#   flags = month_outcomes(indexes, "2020-03-01", len(patient_ids))
+#   flags["mi_admission"]  # 0/1 array in the order of patient_ids
+#
+# This module has no cohortextractor dependency so these stages can run in
+# python:latest; study_definition_outcome_events checks the definitions
+# below against study_definition_combined.
+#
+# Usage:
+#   python analysis/outcome_events.py \
+#       --input output/months/input_combined_months.csv \
+#       --output-dir output/outcome_events \
+#       [--start 2018-03-01] [--end 2021-12-31]
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from columnar import read_frame, write_frame
+from event_index import EventIndex
+from expressions import compile_expression
+from months import STUDY_MONTHS, month_end, month_starts
+from outcome_scans import (
+    DEATH_CAUSE,
+    DEATH_CAUSE_COLUMN,
+    DEATH_DATE,
+    admission_column,
+    admission_events,
+    admission_scans,
+    death_events,
+)
+
+EVENT_COLUMNS = ["patient_id", "outcome", "source", "date"]
+# Patients of the extract read at a time
+CHUNK_ROWS = 100_000
+# Outcome variables of study_definition_combined, including those nested in
+# extra_columns, as {name: (outcome, source)} (see outcome_scans.py)
+OUTCOME_VARIABLES = {
+    "mi_admission": ("mi", "primary_diagnosis"),
+    "stroke_admission": ("stroke", "primary_diagnosis"),
+    "heart_failure_admission": ("heart_failure", "primary_diagnosis"),
+    "vte_admission": ("vte", "primary_diagnosis"),
+    "depression_admission": ("depression", "primary_diagnosis"),
+    "anxiety_admission": ("anxiety", "primary_diagnosis"),
+    "smi_admission": ("smi", "primary_diagnosis"),
+    "self_harm_admission": ("self_harm", "primary_diagnosis"),
+    "eating_dis_admission": ("eating_dis", "primary_diagnosis"),
+    "ocd_admission": ("ocd", "primary_diagnosis"),
+    "dmt1_admission": ("dmt1", "primary_diagnosis"),
+    "dmt2_admission": ("dmt2", "primary_diagnosis"),
+    "dm_keto_admission": ("dm_keto", "primary_diagnosis"),
+    "copd_exacerbation_hospital": ("copd_exac", "primary_diagnosis"),
+    "copd_hospital": ("copd", "primary_diagnosis"),
+    "lrti_hospital": ("lrti", "primary_diagnosis"),
+    "copd_any": ("copd", "all_diagnoses"),
+    "copd_exacerbation_hospital2": ("copd_exac", "primary_diagnosis"),
+    "copd_hospital2": ("copd", "primary_diagnosis"),
+    "resp_asthma_exac": ("asthma_exac", "primary_diagnosis"),
+    "stroke_mortality": ("stroke", "underlying_cause"),
+    "vte_mortality": ("vte", "underlying_cause"),
+    "mi_mortality": ("mi", "underlying_cause"),
+    "heart_failure_mortality": ("heart_failure", "underlying_cause"),
+    "mh_mortality": ("mh", "underlying_cause"),
+    "dmt1_mortality": ("dmt1", "underlying_cause"),
+    "dmt2_mortality": ("dmt2", "underlying_cause"),
+    "dm_keto_mortality": ("dm_keto", "underlying_cause"),
+    "resp_asthma_mortality": ("asthma_exac", "underlying_cause"),
+    "resp_copd_exac_mortality": ("copd_exac", "underlying_cause"),
+    "resp_copd_diag_mortality": ("copd", "underlying_cause"),
+}
+# The satisfying() variables which only combine outcomes, in the order
+# they're evaluated
+COMBINED_OUTCOMES = {
+    "mh_admission": (
+        "depression_admission OR anxiety_admission OR smi_admission OR "
+        "self_harm_admission OR eating_dis_admission OR ocd_admission"
+    ),
+    "resp_copd_exac": (
+        "copd_exacerbation_hospital OR copd_hospital OR (lrti_hospital AND copd_any)"
+    ),
+    "resp_copd_exac_nolrti": "copd_exacerbation_hospital2 OR copd_hospital2",
+    "resp_copd_mortality": "resp_copd_exac_mortality OR resp_copd_diag_mortality",
+}
+
+
+def study_admission_outcomes():
+    """Every admission outcome variable of the three cohorts, see outcome_scans.py"""
+    return {
+        name: outcome for name, outcome in OUTCOME_VARIABLES.items() if outcome[1] != DEATH_CAUSE
+    }
+
+
+def study_death_outcomes():
+    """Every mortality outcome variable of the three cohorts"""
+    return {
+        name: outcome for name, outcome in OUTCOME_VARIABLES.items() if outcome[1] == DEATH_CAUSE
+    }
+
+
+def event_variables():
+    """Variables read from the outcome events, each after any it refers to"""
+    return [*OUTCOME_VARIABLES, *COMBINED_OUTCOMES]
+
+
+def partition_path(output_dir, index_date):
+    return Path(output_dir) / f"outcome_events_{index_date}.feather"
+
+
+def write_partitions(events, output_dir, index_dates):
+    """A partition per month, empty for months without events"""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    events = events.astype({"outcome": "category", "source": "category"})
+    by_month = dict(tuple(events.groupby("month")))
+    for index_date in index_dates:
+        month = by_month.get(index_date, events.iloc[:0])
+        month = month[EVENT_COLUMNS].sort_values(EVENT_COLUMNS, ignore_index=True)
+        write_frame(month, partition_path(output_dir, index_date))
+
+
+def read_partition(output_dir, index_date):
+    return read_frame(partition_path(output_dir, index_date))
+
+
+def read_events(output_dir, index_dates):
+    """The outcome events of every month of `index_dates`"""
+    return pd.concat(
+        [read_partition(output_dir, index_date) for index_date in index_dates],
+        ignore_index=True,
+    )
+
+
+def outcome_indexes(events, patient_ids):
+    """An EventIndex of the patients' events of each (outcome, source)"""
+    return EventIndex.for_groups(patient_ids, events, ["outcome", "source"])
+
+
+def month_outcomes(indexes, index_date, patients):
+    """
+    Every outcome variable, and the variables combining them, for the month
+    of `index_date` from the `indexes` of outcome_indexes() for `patients`
+    patients, as 0/1 arrays in the order of their patient_ids
+    """
+    window = (index_date, month_end(index_date))
+    no_events = np.zeros(patients, dtype="uint8")
+    flags = {
+        name: indexes[key].any_between(*window) if key in indexes else no_events
+        for name, key in OUTCOME_VARIABLES.items()
+    }
+    for name, expression in COMBINED_OUTCOMES.items():
+        flags[name] = compile_expression(expression)(flags).astype("uint8")
+    return flags
+
+
+def event_columns(index_dates):
+    """The columns of the extract the events of `index_dates` are read from"""
+    admissions = [
+        admission_column(outcome, source, index_date)
+        for index_date in index_dates
+        for outcome, source in admission_scans(study_admission_outcomes())
+    ]
+    return ["patient_id", *admissions, DEATH_DATE, DEATH_CAUSE_COLUMN]
+
+
+def extract_outcome_events(input_file, output_dir, index_dates=STUDY_MONTHS):
+    """
+    Write the partitions of outcome events from an extract with the variables
+    of study_definition_outcome_events, such as the combined months extract
+    """
+    chunks = pd.read_csv(
+        input_file,
+        dtype=str,
+        keep_default_na=False,
+        usecols=event_columns(index_dates),
+        chunksize=CHUNK_ROWS,
+    )
+    events = pd.concat(
+        [
+            events
+            for chunk in chunks
+            for events in [
+                admission_events(chunk, study_admission_outcomes(), index_dates),
+                death_events(chunk, study_death_outcomes(), index_dates),
+            ]
+        ],
+        ignore_index=True,
+    )
+    write_partitions(events, output_dir, index_dates)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", required=True)
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--start", default=STUDY_MONTHS[0])
+    parser.add_argument("--end", default=STUDY_MONTHS[-1])
+    args = parser.parse_args()
+    extract_outcome_events(
+        args.input,
+        args.output_dir,
+        index_dates=month_starts(args.start, args.end),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+# Shared scans of the outcome tables.
+#
+# Every admission outcome is a binary flag over the month of the index date:
+#
+#   mi_admission=patients.admitted_to_hospital(
+#       with_these_primary_diagnoses=mi_outcome_icd_codes,
+#       between=["index_date", "last_day_of_month(index_date)"],
+#       returning="binary_flag",
+#   )
+#
+# which cohortextractor runs as its own subquery over the admissions table,
+# for every variable and month: 20 subqueries a month over the three cohorts,
+# several of them with the same codelist (copd_hospital and copd_hospital2,
+# say). Instead study_definition_outcome_events reads the date of the first
+# admission of each month for every distinct outcome codelist and code column
+# (see ADMISSION_DIAGNOSES), as one admitted_to_hospital() variable a month
+# each, so variables sharing an outcome share its scan:
+#
+#   outcomes = admission_outcomes(flatten(variables))
+#   ...extract study_definition_outcome_events...
+#   events = admission_events(extract, outcomes, STUDY_MONTHS)
+#   # distinct (patient_id, month, outcome, source, date) rows
+#
+# Every outcome codelist keeps its own variable, so a patient's admissions for
+# different outcomes on the same day, or any number of them in a month, are
+# all found: a month's flag is whether the month has a first date.
+#
+# Mortality outcomes are the same over the death certificates, e.g.
+# `with_these_codes_on_death_certificate(stroke_icd_codes, between=[...],
+# match_only_underlying_cause=True)`, 11 a month. A patient dies once, so
+# the study definition reads the date and underlying cause of each death in
+# the whole period with a cause in any outcome, and death_events()
+# classifies the causes into every outcome at once:
+#
+#   outcomes = death_outcomes(flatten(variables))
+#   events = death_events(extract, outcomes, STUDY_MONTHS)
+#
+# Duplicate death records are resolved as cohortextractor resolves them, to
+# the earliest date and the lexically smallest cause. Causes are classified
+# with the compiled codelist index (see codelist_index.py).
+#
+# Only variables with no other conditions (procedures, admission method, any
+# cause of death) are outcomes of the scans; anything else is left to
+# cohortextractor. The classification has no cohortextractor dependency, so
+# it runs in python:latest (see outcome_events.py).
+import numpy as np
+import pandas as pd
+
+from codelist_index import OUTCOME_CODELISTS, codes_of, deaths_index, outcome_codes
+from months import month_suffix
+
+MONTH_WINDOW = ["index_date", "last_day_of_month(index_date)"]
+# The spell column each way of giving an admission's codelist is matched to
+ADMISSION_DIAGNOSES = {
+    "with_these_primary_diagnoses": "primary_diagnosis",
+    "with_these_diagnoses": "all_diagnoses",
+}
+# admitted_to_hospital arguments which make a variable more than an outcome
+OTHER_ADMISSION_CONDITIONS = (
+    "on_or_before",
+    "on_or_after",
+    "with_these_procedures",
+    "with_admission_method",
+    "with_source_of_admission",
+    "with_discharge_destination",
+    "with_patient_classification",
+    "with_admission_treatment_function_code",
+    "with_administrative_category",
+    "with_at_least_one_day_in_critical_care",
+)
+# Death certificate causes are only matched to the underlying cause
+DEATH_CAUSE = "underlying_cause"
+OTHER_DEATH_CONDITIONS = ("on_or_before", "on_or_after")
+DEATH_DATE = "outcome_death_date"
+DEATH_CAUSE_COLUMN = "outcome_death_cause"
+EVENT_COLUMNS = ["patient_id", "month", "outcome", "source", "date"]
+
+
+def is_monthly_flag(query_args, other_conditions):
+    """Whether a variable is a binary flag over the index date's month"""
+    return (
+        query_args.get("returning") == "binary_flag"
+        and list(query_args.get("between") or []) == MONTH_WINDOW
+        and not any(query_args.get(arg) for arg in other_conditions)
+    )
+
+
+def outcome_of(codelist):
+    """The name of the outcome codelist with the same codes, or None"""
+    if codelist is None or codelist.system != "icd10":
+        return None
+    codes = set(codes_of(codelist))
+    for name in OUTCOME_CODELISTS:
+        if set(outcome_codes(name)) == codes:
+            return name
+    return None
+
+
+def admission_outcomes(flat):
+    """
+    The variables of a flat study definition (see multi_month.flatten) which
+    are admission outcomes, as {name: (outcome, spell column)}
+    """
+    outcomes = {}
+    for name, (query_type, query_args) in flat.items():
+        if query_type != "admitted_to_hospital":
+            continue
+        if not is_monthly_flag(query_args, OTHER_ADMISSION_CONDITIONS):
+            continue
+        given = [arg for arg in ADMISSION_DIAGNOSES if query_args.get(arg) is not None]
+        if len(given) != 1:
+            continue
+        outcome = outcome_of(query_args[given[0]])
+        if outcome is not None:
+            outcomes[name] = (outcome, ADMISSION_DIAGNOSES[given[0]])
+    return outcomes
+
+
+def death_outcomes(flat):
+    """
+    The variables of a flat study definition which are mortality outcomes, as
+    {name: (outcome, DEATH_CAUSE)}
+    """
+    outcomes = {}
+    for name, (query_type, query_args) in flat.items():
+        if query_type != "with_these_codes_on_death_certificate":
+            continue
+        if not query_args.get("match_only_underlying_cause"):
+            continue
+        if not is_monthly_flag(query_args, OTHER_DEATH_CONDITIONS):
+            continue
+        outcome = outcome_of(query_args.get("codelist"))
+        if outcome is not None:
+            outcomes[name] = (outcome, DEATH_CAUSE)
+    return outcomes
+
+
+def matched_outcomes(outcomes, source):
+    """The distinct outcomes of `outcomes` matched to one code column"""
+    return list(
+        dict.fromkeys(outcome for outcome, column in outcomes.values() if column == source)
+    )
+
+
+def admission_column(outcome, source, index_date):
+    """The column of the first admission of `outcome` matched to `source` in a month"""
+    return f"outcome_admission_{outcome}_{source}{month_suffix(index_date)}"
+
+
+def admission_scans(outcomes):
+    """The distinct (outcome, source) of admission `outcomes`, each scanned once a month"""
+    return [
+        (outcome, source)
+        for source in ADMISSION_DIAGNOSES.values()
+        for outcome in matched_outcomes(outcomes, source)
+    ]
+
+
+def classify_events(patient_ids, months, dates, codes, index, outcomes, source):
+    """
+    The distinct (patient_id, month, outcome, source, date) of events with
+    the recorded `codes`, classified at once into every one of `outcomes`
+    matched to the `source` code column
+    """
+    masks = index.classify(codes)
+    patient_ids = np.asarray(patient_ids, dtype="int64")
+    months = np.asarray(months)
+    dates = np.asarray(dates)
+    found = [pd.DataFrame(columns=EVENT_COLUMNS)]
+    for outcome in matched_outcomes(outcomes, source):
+        has = (masks & np.uint64(index.bit(outcome))) != 0
+        found.append(
+            pd.DataFrame(
+                dict(
+                    patient_id=patient_ids[has],
+                    month=months[has],
+                    outcome=outcome,
+                    source=source,
+                    date=dates[has],
+                )
+            )
+        )
+    return typed_events(pd.concat(found, ignore_index=True))
+
+
+def typed_events(events):
+    events = events.drop_duplicates(ignore_index=True)
+    return events.astype({"patient_id": "int64", "date": "datetime64[ns]"})
+
+
+def admission_events(extract, outcomes, index_dates):
+    """
+    The distinct (patient_id, month, outcome, source, date) of the first
+    admission of each of `outcomes` in every month, in the extract of
+    study_definition_outcome_events (as text)
+    """
+    patient_ids = extract["patient_id"].astype("int64").to_numpy()
+    found = [pd.DataFrame(columns=EVENT_COLUMNS)]
+    for index_date in index_dates:
+        for outcome, source in admission_scans(outcomes):
+            dates = extract[admission_column(outcome, source, index_date)]
+            has = (dates != "").to_numpy()
+            found.append(
+                pd.DataFrame(
+                    dict(
+                        patient_id=patient_ids[has],
+                        month=index_date,
+                        outcome=outcome,
+                        source=source,
+                        date=dates[has].to_numpy(),
+                    )
+                )
+            )
+    return typed_events(pd.concat(found, ignore_index=True))
+
+
+def death_events(extract, outcomes, index_dates):
+    """
+    The distinct (patient_id, month, outcome, source, date) of the deaths of
+    `outcomes` in the extract of study_definition_outcome_events (as text)
+    """
+    if DEATH_DATE not in extract:
+        return typed_events(pd.DataFrame(columns=EVENT_COLUMNS))
+    dates = pd.to_datetime(extract[DEATH_DATE])
+    months = dates.dt.strftime("%Y-%m-01")
+    in_period = months.isin(index_dates).to_numpy()
+    return classify_events(
+        extract["patient_id"][in_period],
+        months[in_period],
+        dates[in_period],
+        extract[DEATH_CAUSE_COLUMN][in_period],
+        deaths_index(),
+        outcomes,
+        DEATH_CAUSE,
+    )
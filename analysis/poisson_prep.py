@@ -0,0 +1,128 @@
+# Prepares the measures for the interrupted time series Poisson models
+# (replaces 103_poisson_prep.do). For every outcome of every cohort (see
+# cohorts.py), not just the four CVD admissions, the IMD and migration status
+# measures are read from the measure store (see measure_store.py) and:
+#   - rows with IMD 0 or missing (only expected in dummy data) are dropped
+#   - postcovid flags months from March 2020
+#   - time numbers the months from 1
+#   - the numerator is renamed numOutcome and the denominator population, as
+#     104_poisson.R expects
+#
+# All outcomes are written to one typed table per grouping,
+# output/poisson/an_outcomes.feather (by IMD) and
+# output/poisson/an_outcomes_migration_status.feather, with cohort and outcome
+# columns. The CVD admissions by IMD are also written to
+# output/cvd/an_<outcome>.csv in the layout of the Stata export, which is
+# what 104_poisson.R reads.
+#
+# Usage:
+#   python analysis/poisson_prep.py [--store output/measures/measures.feather] \
+#       [--output-dir output]
+import argparse
+from pathlib import Path
+
+import pandas as pd
+
+from cohorts import COHORTS
+from columnar import write_frame
+from measure_store import MeasureStore
+
+POSTCOVID_START = pd.Timestamp("2020-03-01")
+CVD_OUTCOMES = [
+    "mi_admission",
+    "stroke_admission",
+    "heart_failure_admission",
+    "vte_admission",
+]
+COLUMNS = ["numOutcome", "population", "value", "dateA", "postcovid", "time"]
+# Values of each grouping which aren't a group (IMD 0 is an unknown postcode)
+MISSING_GROUPS = {"imd": [0], "migration_status": []}
+POISSON_FILES = {
+    "imd": "an_outcomes.feather",
+    "migration_status": "an_outcomes_migration_status.feather",
+}
+
+
+def prepare_outcome(measure, outcome, group_by="imd"):
+    """Analysis-ready rows of one outcome's measure by `group_by`"""
+    measure = pd.DataFrame(
+        {
+            group_by: pd.to_numeric(measure["group"].astype(str), errors="coerce"),
+            "numOutcome": measure["numerator"],
+            "population": measure["denominator"],
+            "value": measure["value"],
+            "dateA": measure["date"],
+        }
+    )
+    dropped = measure[group_by].isna() | measure[group_by].isin(MISSING_GROUPS[group_by])
+    if MISSING_GROUPS[group_by]:
+        print(f"{outcome}: dropping {dropped.sum()} rows with {group_by} 0 or missing")
+    measure = measure.loc[~dropped].copy()
+    measure[group_by] = measure[group_by].astype("int8")
+    measure["postcovid"] = (measure["dateA"] >= POSTCOVID_START).astype("int8")
+    # Months are numbered in order of the dates with a row for the first
+    # group (IMD 1), as in the Stata version
+    first_group = measure[group_by].min()
+    months = measure.loc[measure[group_by] == first_group, "dateA"].sort_values().unique()
+    time = pd.Series(range(1, len(months) + 1), index=months, dtype="Int16")
+    measure["time"] = measure["dateA"].map(time)
+    measure = measure.sort_values(["dateA", group_by], kind="stable")
+    return measure[[group_by, *COLUMNS]].reset_index(drop=True)
+
+
+def prepare_outcomes(store, group_by="imd"):
+    """
+    Every cohort's outcomes from the measure store (see measure_store.py) as
+    one frame, with cohort and outcome columns
+    """
+    prepared = []
+    for cohort_name, cohort in COHORTS.items():
+        for outcome in cohort["outcomes"]:
+            measure = store.select(outcome, group_by=group_by)
+            rows = prepare_outcome(measure, outcome, group_by)
+            rows.insert(0, "outcome", outcome)
+            rows.insert(0, "cohort", cohort_name)
+            prepared.append(rows)
+    outcomes = pd.concat(prepared, ignore_index=True)
+    return outcomes.astype(
+        {
+            "cohort": "category",
+            "outcome": "category",
+            "numOutcome": "int64",
+            "population": "int64",
+        }
+    )
+
+
+def write_stata_layout(rows, filename):
+    """Write rows as 103_poisson_prep.do exported them"""
+    rows = rows[["imd", *COLUMNS]].copy()
+    rows["dateA"] = rows["dateA"].dt.strftime("%d/%B/%Y")
+    rows.to_csv(filename, index=False)
+
+
+def poisson_prep(store, output_dir):
+    store = MeasureStore.read(store)
+    poisson_dir = Path(output_dir) / "poisson"
+    poisson_dir.mkdir(parents=True, exist_ok=True)
+    for group_by, filename in POISSON_FILES.items():
+        outcomes = prepare_outcomes(store, group_by)
+        write_frame(outcomes, poisson_dir / filename)
+        if group_by == "imd":
+            cvd_dir = Path(output_dir) / "cvd"
+            cvd_dir.mkdir(parents=True, exist_ok=True)
+            for outcome in CVD_OUTCOMES:
+                rows = outcomes[outcomes["outcome"] == outcome]
+                write_stata_layout(rows, cvd_dir / f"an_{outcome}.csv")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--store", default="output/measures/measures.feather")
+    parser.add_argument("--output-dir", default="output")
+    args = parser.parse_args()
+    poisson_prep(args.store, args.output_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+# Profiles the extraction of a study definition, by default
+# study_definition_combined_months as generate_study_population extracts it.
+#
+# cohortextractor logs the execution time of every statement it runs against
+# the database, described by the statement's leading comment: "Query for
+# <column>" for each column's query, "Uploading codelist for <column>",
+# "Join all columns for final output" and so on. This runs the extraction
+# once, in process, records those timings and writes one JSON line per timed
+# step to the trace file:
+#
+#   {"step": "Query for mi_admission_2020_03_01", "kind": "query",
+#    "column": "mi_admission_2020_03_01", "variable": "mi_admission",
+#    "index_date": "2020-03-01", "query_type": "admitted_to_hospital",
+#    "seconds": 12.3, "state": "ok", "rows_scanned": 52000000,
+#    "peak_memory_mb": 310.5, "patients": 1000000, "rows_returned": 1234}
+#
+# Each column's query runs with SQL Server's STATISTICS XML on, and the
+# actual execution plans it returns give the rows read by every scan and
+# seek of the query (rows_scanned) and the most memory the query used
+# (peak_memory_mb, from its memory grant), so both are per variable and
+# index date.
+#
+# The variable and index date come from multi_month.py's column names; the
+# index date is null for variables extracted once (sex, household size), and
+# steps which aren't for one column (kind "other") have neither. Statements
+# without a comment, such as a codelist's batched inserts, are counted with
+# the step before them. patients is the number of patients extracted and
+# rows_returned the number with a value in the column (not empty or 0), from
+# the output file. The summary has a row per variable, slowest first, with
+# the total time of its queries and codelist uploads, the mean and maximum
+# query time over index dates, the mean and maximum rows scanned, the
+# maximum peak memory and the mean rows returned, then a row per other step.
+# It's written as a CSV and the slowest rows printed, with the peak memory of
+# the extraction process itself.
+#
+# DATABASE_URL must be set as for cohortextractor: with dummy data
+# cohortextractor runs no queries, so there's nothing to time.
+#
+# Usage:
+#   python analysis/profile_extraction.py \
+#       [--study-definition study_definition_combined_months] \
+#       [--output output/profile/input_profile.csv] \
+#       [--trace output/profile/extraction_trace.jsonl] \
+#       [--summary output/profile/extraction_summary.csv] [--summarise-only]
+import argparse
+import importlib
+import json
+import logging
+import re
+import resource
+import xml.etree.ElementTree as ElementTree
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+SUMMARY_ROWS_PRINTED = 15
+# The event of every timing record cohortextractor logs
+STATS_EVENT = "cohortextractor-stats"
+STEP_KINDS = {"Query for ": "query", "Uploading codelist for ": "codelist"}
+MONTH_SUFFIX = re.compile(r"_(\d{4})_(\d{2})_(\d{2})$")
+# Rows of the output file read at a time to count values
+CHUNK_ROWS = 100_000
+SHOWPLAN = "{http://schemas.microsoft.com/sqlserver/2004/07/showplan}"
+# Plan operators which read rows from a table or index
+SCAN_OPERATORS = ("Scan", "Seek")
+
+
+def peak_rss():
+    """Peak resident memory of this process, in bytes"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def parse_step(description):
+    """The kind, column, variable and index date of a timed step"""
+    for prefix, kind in STEP_KINDS.items():
+        if description and description.startswith(prefix):
+            column = description[len(prefix) :].strip()
+            month = MONTH_SUFFIX.search(column)
+            if month:
+                return kind, column, column[: month.start()], "-".join(month.groups())
+            return kind, column, column, None
+    return "other", None, None, None
+
+
+def stats_of(record):
+    """
+    The event dict of one of cohortextractor's log records, or None.
+    cohortextractor's structlog configuration passes the dict on as the
+    record's message, rendered configurations pass it as JSON.
+    """
+    message = record.msg
+    if isinstance(message, str):
+        try:
+            message = json.loads(message)
+        except ValueError:
+            return None
+    if not isinstance(message, dict) or message.get("event") != STATS_EVENT:
+        return None
+    return message
+
+
+class QueryTimings(logging.Handler):
+    """Collects the execution time cohortextractor logs for each statement"""
+
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.steps = []
+        self.description = None
+
+    def emit(self, record):
+        stats = stats_of(record)
+        if stats is None or stats.get("timing") != "stop":
+            return
+        self.description = stats.get("description") or self.description
+        self.steps.append(
+            dict(
+                step=self.description,
+                seconds=stats.get("execution_time_secs", 0.0),
+                state=stats.get("state"),
+            )
+        )
+
+
+def plan_statistics(plan):
+    """
+    The rows read by the scans and seeks of an actual execution plan
+    (showplan XML), and the most memory its statements used in MB
+    """
+    root = ElementTree.fromstring(plan)
+    rows = 0
+    for operator in root.iter(f"{SHOWPLAN}RelOp"):
+        if not operator.get("PhysicalOp", "").endswith(SCAN_OPERATORS):
+            continue
+        for thread in operator.iter(f"{SHOWPLAN}RunTimeCountersPerThread"):
+            # ActualRowsRead is only given when a predicate filtered the rows read
+            rows += int(thread.get("ActualRowsRead") or thread.get("ActualRows") or 0)
+    memory = [
+        int(grant.get("MaxUsedMemory") or 0)
+        for grant in root.iter(f"{SHOWPLAN}MemoryGrantInfo")
+    ]
+    return rows, max(memory, default=0) / 1024
+
+
+class PlanCursor:
+    """
+    A cursor which runs each column's query with STATISTICS XML on and adds
+    the rows scanned and peak memory of its plans to the step just timed
+    """
+
+    def __init__(self, cursor, timings):
+        self.cursor = cursor
+        self.timings = timings
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def execute(self, query, *args, log_desc=None, **kwargs):
+        if not (log_desc or "").startswith("Query for "):
+            return self.cursor.execute(query, *args, log_desc=log_desc, **kwargs)
+        query = f"SET STATISTICS XML ON\n{query}\nSET STATISTICS XML OFF"
+        self.cursor.execute(query, *args, log_desc=log_desc, **kwargs)
+        rows, memory = 0, 0.0
+        while True:
+            if self.cursor.description and "Showplan" in self.cursor.description[0][0]:
+                for (plan,) in self.cursor.fetchall():
+                    plan_rows, plan_memory = plan_statistics(plan)
+                    rows += plan_rows
+                    memory = max(memory, plan_memory)
+            if not self.cursor.nextset():
+                break
+        if self.timings.steps:
+            self.timings.steps[-1].update(rows_scanned=rows, peak_memory_mb=memory)
+
+
+class PlanConnection:
+    """A database connection whose cursors are PlanCursors"""
+
+    def __init__(self, connection, timings):
+        self.connection = connection
+        self.timings = timings
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def cursor(self):
+        return PlanCursor(self.connection.cursor(), self.timings)
+
+
+@contextmanager
+def timing_queries(backend=None):
+    """
+    A QueryTimings collecting cohortextractor's timings while in context,
+    with the execution plan statistics of `backend`'s queries if given
+    """
+    logger = logging.getLogger("cohortextractor")
+    timings = QueryTimings()
+    level = logger.level
+    logger.addHandler(timings)
+    logger.setLevel(logging.INFO)
+    if backend is not None:
+        connect = backend.get_db_connection
+        backend.get_db_connection = lambda *args, **kwargs: PlanConnection(
+            connect(*args, **kwargs), timings
+        )
+    try:
+        yield timings
+    finally:
+        logger.removeHandler(timings)
+        logger.setLevel(level)
+        if backend is not None:
+            del backend.get_db_connection
+
+
+def count_values(output_file):
+    """The number of patients, and of values (not empty or 0) in each column"""
+    patients = 0
+    returned = pd.Series(dtype="int64")
+    for chunk in pd.read_csv(
+        output_file, dtype=str, keep_default_na=False, chunksize=CHUNK_ROWS
+    ):
+        patients += len(chunk)
+        returned = returned.add((~chunk.isin(["", "0"])).sum(), fill_value=0)
+    return patients, returned.astype("int64").to_dict()
+
+
+def trace_records(steps, covariate_definitions, patients=None, returned=None):
+    returned = returned or {}
+    records = []
+    for step in steps:
+        kind, column, variable, index_date = parse_step(step["step"])
+        records.append(
+            dict(
+                step=step["step"],
+                kind=kind,
+                column=column,
+                variable=variable,
+                index_date=index_date,
+                query_type=covariate_definitions.get(column, (None,))[0],
+                seconds=round(step["seconds"], 6),
+                state=step["state"],
+                rows_scanned=step.get("rows_scanned"),
+                peak_memory_mb=step.get("peak_memory_mb"),
+                patients=patients,
+                rows_returned=returned.get(column) if kind == "query" else None,
+            )
+        )
+    return records
+
+
+def profile(study_definition, output_file, trace_file):
+    study = importlib.import_module(study_definition).study
+    output_file = Path(output_file)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    # Not to count a previous run's values if this one fails
+    output_file.unlink(missing_ok=True)
+    trace_file = Path(trace_file)
+    trace_file.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        with timing_queries(study.backend) as timings:
+            study.to_file(str(output_file))
+    finally:
+        counts = count_values(output_file) if output_file.exists() else ()
+        with open(trace_file, "w") as trace:
+            for record in trace_records(
+                timings.steps, study.covariate_definitions, *counts
+            ):
+                trace.write(json.dumps(record) + "\n")
+        print(f"Peak memory of the extraction process: {peak_rss() / 2**20:.0f} MB")
+
+
+def read_trace(trace_file):
+    with open(trace_file) as f:
+        return pd.DataFrame([json.loads(line) for line in f if line.strip()])
+
+
+def summarise(trace):
+    """A row per variable, slowest first, then a row per other step"""
+    queries = trace[trace["kind"] == "query"]
+    summary = queries.groupby("variable").agg(
+        query_type=("query_type", "first"),
+        index_dates=("index_date", "nunique"),
+        query_seconds=("seconds", "sum"),
+        mean_seconds=("seconds", "mean"),
+        max_seconds=("seconds", "max"),
+        mean_rows_scanned=("rows_scanned", "mean"),
+        max_rows_scanned=("rows_scanned", "max"),
+        max_peak_memory_mb=("peak_memory_mb", "max"),
+        mean_rows_returned=("rows_returned", "mean"),
+    )
+    codelists = trace[trace["kind"] == "codelist"].groupby("variable")["seconds"].sum()
+    summary["codelist_seconds"] = codelists.reindex(summary.index, fill_value=0.0)
+    summary.insert(2, "total_seconds", summary["query_seconds"] + summary["codelist_seconds"])
+    summary = summary.sort_values("total_seconds", ascending=False).reset_index()
+    others = (
+        trace[trace["kind"] == "other"]
+        .groupby("step", sort=False)["seconds"]
+        .agg(total_seconds="sum", mean_seconds="mean", max_seconds="max")
+        .reset_index()
+        .rename(columns={"step": "variable"})
+    )
+    return pd.concat([summary, others], ignore_index=True)
+
+
+def write_summary(trace_file, summary_file):
+    summary = summarise(read_trace(trace_file))
+    summary_file = Path(summary_file)
+    summary_file.parent.mkdir(parents=True, exist_ok=True)
+    summary.to_csv(summary_file, index=False, float_format="%.4g")
+    print(summary.head(SUMMARY_ROWS_PRINTED).to_string(index=False, float_format="%.3g"))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--study-definition", default="study_definition_combined_months")
+    parser.add_argument("--output", default="output/profile/input_profile.csv")
+    parser.add_argument("--trace", default="output/profile/extraction_trace.jsonl")
+    parser.add_argument("--summary", default="output/profile/extraction_summary.csv")
+    parser.add_argument(
+        "--summarise-only", action="store_true", help="summarise an existing trace"
+    )
+    args = parser.parse_args()
+    if not args.summarise_only:
+        profile(args.study_definition, args.output, args.trace)
+    write_summary(args.trace, args.summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# Static snapshots of study_definition_static at several index dates, from
+# one extract (see study_definition_static_snapshots.py).
+#
+# The history flags (migration status, diabetes and COPD codes) are all
+# "any event on or before the index date", so for nested index dates they
+# only differ in where a patient's first event falls. The extract therefore
+# has one <flag>_first_date column per flag instead of a flag per date, and
+# each snapshot's flag is whether that first event is on or before its index
+# date. Variables which combine the flags (DERIVED) are evaluated here for
+# each snapshot. Everything else that depends on the index date is extracted
+# once per date, as in multi_month.py.
+#
+# This module has no cohortextractor dependency so the split can run in
+# python:latest; study_definition_static_snapshots checks the definitions
+# below against common_variables.
+#
+# Usage:
+#   python analysis/snapshots.py \
+#       --input output/snapshots/input_static_snapshots.csv \
+#       --output-dir output [--output-format csv]
+import argparse
+from pathlib import Path
+
+import pandas as pd
+
+from columnar import typed_frame, write_frame
+from expressions import compile_expression
+from split_months import index_dates, wide_column
+
+SNAPSHOT_DATES = ["2019-03-01", "2020-03-01", "2021-03-01"]
+FIRST_DATE_SUFFIX = "_first_date"
+# with_these_clinical_events(on_or_before="index_date", returning="binary_flag")
+HISTORY_FLAGS = ["migration_status", "has_t1_diabetes", "has_t2_diabetes", "has_copd_code"]
+# Variables which refer to the history flags, in the order they're evaluated
+DERIVED = {
+    "diabetes_subgroup": "has_t1_diabetes OR has_t2_diabetes",
+    "has_copd": "has_copd_code AND age40>40",
+}
+# Columns of each input_static_<date> file, as study_definition_static
+STATIC_COLUMNS = [
+    "age",
+    "sex",
+    "has_msoa",
+    "imd",
+    "urban_rural",
+    "migration_status",
+    "has_t1_diabetes",
+    "has_t2_diabetes",
+    "diabetes_subgroup",
+    "has_asthma",
+    "has_copd",
+]
+
+
+def first_date_column(flag):
+    return flag + FIRST_DATE_SUFFIX
+
+
+def extracted_columns():
+    """Columns extracted for each date, rather than computed from the first dates"""
+    computed = HISTORY_FLAGS + list(DERIVED)
+    referenced = [
+        name
+        for expression in DERIVED.values()
+        for name in compile_expression(expression).names
+        if name not in computed
+    ]
+    static = [name for name in STATIC_COLUMNS if name not in computed]
+    return list(dict.fromkeys(["patient_id", "population", *static, *referenced]))
+
+
+def snapshot(wide, date):
+    """One index date's columns of the wide extract (all read as text)"""
+    suffix = date.replace("-", "_")
+    columns = set(wide.columns)
+    frame = pd.DataFrame(
+        {name: wide[wide_column(name, suffix, columns)] for name in extracted_columns()}
+    )
+    for flag in HISTORY_FLAGS:
+        first_date = wide[first_date_column(flag)]
+        # ISO dates compare as text; missing dates are empty
+        frame[flag] = ((first_date != "") & (first_date <= date)).astype(int).astype(str)
+    numbers = frame.drop(columns=["sex"]).apply(pd.to_numeric, errors="coerce")
+    for name, expression in DERIVED.items():
+        numbers[name] = compile_expression(expression)(numbers).astype("int64")
+        frame[name] = numbers[name].astype(str)
+    return frame
+
+
+def split_snapshots(input_file, output_dir, output_format="csv"):
+    # Read as text so values are written back exactly as extracted
+    wide = pd.read_csv(input_file, dtype=str, keep_default_na=False)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for date in index_dates(wide.columns):
+        date = date.replace("_", "-")
+        frame = snapshot(wide, date)
+        frame = frame.loc[frame["population"] == "1", ["patient_id", *STATIC_COLUMNS]]
+        if output_format == "feather":
+            frame = typed_frame(frame)
+        write_frame(frame, output_dir / f"input_static_{date}.{output_format}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", required=True)
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--output-format", choices=["csv", "feather"], default="csv")
+    args = parser.parse_args()
+    split_snapshots(args.input, args.output_dir, args.output_format)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+# Splits the wide single-pass extract of study_definition_combined (see
+# multi_month.py) into the monthly input_<prefix>YYYY-MM-DD.csv files that
+# generate_cohort --index-date-range would have written for each cohort, so
+# measures.py and later steps are unchanged. As in cohortextractor's output
+# from the database, patient_id is the first column, and variables nested in
+# another's extra_columns (copd_any, has_follow_up and so on) are hidden, so
+# they're not written (cohortextractor's dummy data puts patient_id last).
+#
+# The extract has a row per patient of the whole population, so it's read in
+# chunks of --chunk-size patients (by default as many as fit in a quarter of
+# --max-memory GB, estimated from the first rows). Each chunk's rows of every
+# cohort and month are appended to the files by a background writer holding
+# at most another quarter of --max-memory of pending rows, which blocks the
+# reader when writing falls behind. Peak memory depends on --max-memory, not
+# on the size of the population. For feather output the column types are
+# found in a first pass over the extract, so every chunk of a file has the
+# same types, and with --pack-flags binary flags are stored bit-packed (see
+# flag_bits.py).
+#
+# The admission and mortality outcomes, and the variables combining them,
+# aren't in the extract: they're read from the outcome events of the
+# extract's months in --outcome-events (see outcome_events.py), indexed once
+# per chunk and added to it as if extracted. With dummy data the two extracts' patient ids are
+# independent, so few patients have any outcome.
+#
+# Usage:
+#   python analysis/split_months.py \
+#       --input output/months/input_combined_months.csv \
+#       --outcome-events output/outcome_events \
+#       --output-dir output/measures [--output-format feather] \
+#       [--max-memory 4] [--chunk-size N] [--pack-flags]
+import argparse
+import re
+from pathlib import Path
+
+import pandas as pd
+
+from cohorts import COHORTS
+from columnar import ColumnTypes, FrameWriter, WriteQueue, write_frame
+from outcome_events import event_variables, month_outcomes, outcome_indexes, read_events
+
+# Rows read to estimate the memory used by each row of the extract
+SAMPLE_ROWS = 1000
+MONTH_SUFFIX = re.compile(r"^population_(?P<date>\d{4}_\d{2}_\d{2})$")
+# Variables needed to write every cohort's monthly files
+MONTH_VARIABLES = ["population"] + list(
+    dict.fromkeys(
+        name
+        for cohort in COHORTS.values()
+        for name in cohort["columns"] + ([cohort["flag"]] if cohort["flag"] else [])
+    )
+)
+
+
+def index_dates(columns):
+    return [match.group("date") for match in map(MONTH_SUFFIX.match, columns) if match]
+
+
+def wide_column(name, date, columns):
+    """The wide column holding `name` for one month, or the static column"""
+    return f"{name}_{date}" if f"{name}_{date}" in columns else name
+
+
+def is_set(flag):
+    """Rows where a flag (as text, or typed) is 1"""
+    if pd.api.types.is_numeric_dtype(flag):
+        return (flag == 1).fillna(False).astype(bool)
+    return flag.astype(str) == "1"
+
+
+def cohort_rows(month, cohort):
+    """A cohort's rows and columns of a frame of one month's variables"""
+    in_cohort = is_set(month["population"])
+    if cohort["flag"]:
+        in_cohort &= is_set(month[cohort["flag"]])
+    return month.loc[in_cohort, ["patient_id"] + cohort["columns"]]
+
+
+def cohort_filename(output_dir, cohort, date, output_format):
+    """The input file of a cohort for one month (an ISO date)"""
+    cohort_dir = Path(output_dir) / cohort["subdir"]
+    cohort_dir.mkdir(parents=True, exist_ok=True)
+    return cohort_dir / f"input_{cohort['prefix']}{date}.{output_format}"
+
+
+def write_cohort_months(month, date, output_dir, output_format="csv"):
+    """
+    Write each cohort's input file for one month from a frame of every
+    variable in study_definition_combined (plus population) for that month
+    """
+    for cohort in COHORTS.values():
+        write_frame(
+            cohort_rows(month, cohort),
+            cohort_filename(output_dir, cohort, date, output_format),
+        )
+
+
+def with_outcome_events(chunk, events):
+    """
+    A chunk of the extract with the outcome flags of every month (as text,
+    like the extracted columns) from the outcome events of its months
+    """
+    indexes = outcome_indexes(events, chunk["patient_id"].astype("int64"))
+    columns = {}
+    for date in index_dates(chunk.columns):
+        flags = month_outcomes(indexes, date.replace("_", "-"), len(chunk))
+        for name in event_variables():
+            if name in MONTH_VARIABLES:
+                columns[f"{name}_{date}"] = flags[name].astype(str)
+    return pd.concat([chunk, pd.DataFrame(columns, index=chunk.index)], axis=1)
+
+
+def read_chunks(input_file, chunk_size, nrows=None, events=None):
+    # Read everything as text so CSV values are written back exactly as
+    # extracted
+    chunks = pd.read_csv(
+        input_file, dtype=str, keep_default_na=False, chunksize=chunk_size, nrows=nrows
+    )
+    for chunk in chunks:
+        yield with_outcome_events(chunk, events) if events is not None else chunk
+
+
+def read_month_events(input_file, outcome_events):
+    """The outcome events of every month of the extract"""
+    columns = pd.read_csv(input_file, nrows=0).columns
+    dates = [date.replace("_", "-") for date in index_dates(columns)]
+    return read_events(outcome_events, dates)
+
+
+def rows_within(input_file, max_bytes, events=None):
+    """Roughly how many rows of the extract fit in `max_bytes` of memory"""
+    sample = next(read_chunks(input_file, SAMPLE_ROWS, SAMPLE_ROWS, events))
+    row_bytes = sample.memory_usage(deep=True).sum() / max(len(sample), 1)
+    return max(SAMPLE_ROWS, int(max_bytes / row_bytes))
+
+
+def split_months(
+    input_file,
+    output_dir,
+    output_format="csv",
+    max_memory=4,
+    chunk_size=None,
+    pack_flags=False,
+    outcome_events=None,
+):
+    events = None
+    if outcome_events:
+        events = read_month_events(input_file, outcome_events)
+    max_bytes = int(max_memory * 2**30)
+    chunk_size = chunk_size or rows_within(input_file, max_bytes // 4, events)
+    types = None
+    if output_format == "feather":
+        types = ColumnTypes(pack_flags=pack_flags)
+        for chunk in read_chunks(input_file, chunk_size, events=events):
+            types.update(chunk)
+    names = ["patient_id"] + MONTH_VARIABLES
+    writers = {}
+    try:
+        with WriteQueue(max_bytes // 4) as queue:
+            for chunk in read_chunks(input_file, chunk_size, events=events):
+                if types is not None:
+                    chunk = types.apply(chunk)
+                columns = set(chunk.columns)
+                for date in index_dates(chunk.columns):
+                    month = chunk[[wide_column(name, date, columns) for name in names]]
+                    month.columns = names
+                    date = date.replace("_", "-")
+                    for cohort_name, cohort in COHORTS.items():
+                        if (cohort_name, date) not in writers:
+                            writers[cohort_name, date] = FrameWriter(
+                                cohort_filename(output_dir, cohort, date, output_format)
+                            )
+                        queue.put(writers[cohort_name, date], cohort_rows(month, cohort))
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", required=True)
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--output-format", choices=["csv", "feather"], default="csv")
+    parser.add_argument(
+        "--max-memory", type=float, default=4, help="in GB"
+    )
+    parser.add_argument("--chunk-size", type=int, default=None)
+    parser.add_argument(
+        "--pack-flags", action="store_true", help="bit-pack flags in feather output"
+    )
+    parser.add_argument(
+        "--outcome-events", help="the directory of outcome_events.py's partitions"
+    )
+    args = parser.parse_args()
+    split_months(
+        args.input,
+        args.output_dir,
+        args.output_format,
+        args.max_memory,
+        args.chunk_size,
+        args.pack_flags,
+        args.outcome_events,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# Extracts the general population, diabetes and respiratory cohorts together.
+# The base population and the variables shared between the cohorts are
+# extracted once, and dm_cohort/resp_cohort flag membership of the diabetes
+# and respiratory cohorts. Each cohort is then a projection of this extract,
+# see cohorts.py and split_months.py
+from cohortextractor import StudyDefinition, patients
+
+import study_definition as general
+import study_definition_dm as dm
+import study_definition_resp as resp
+from cohorts import COHORTS
+from common_variables import combine_variables, lazy_study, study_population
+
+
+def cohort_variables(module):
+    variables = {
+        name: definition
+        for name, definition in module.variables.items()
+        if name != "population"
+    }
+    cohort = next(
+        cohort
+        for cohort in COHORTS.values()
+        if cohort["study_definition"] == module.__name__
+    )
+    if list(variables) != cohort["columns"]:
+        raise ValueError(f"Columns in cohorts.py are out of date for {module.__name__}")
+    return variables
+
+
+default_expectations = general.default_expectations
+
+variables = dict(
+    population=study_population(),
+    **combine_variables(
+        cohort_variables(general),
+        cohort_variables(dm),
+        cohort_variables(resp),
+    ),
+    # Cohort membership, defined after the variables they refer to
+    dm_cohort=patients.satisfying(
+        " AND ".join(dm.cohort_conditions),
+        return_expectations={"incidence": 0.2},
+        **dm.cohort_columns,
+    ),
+    resp_cohort=patients.satisfying(
+        " AND ".join(resp.cohort_conditions),
+        return_expectations={"incidence": 0.2},
+        **resp.cohort_columns,
+    ),
+)
+
+__getattr__ = lazy_study(
+    lambda: StudyDefinition(
+        default_expectations=default_expectations,
+        index_date="2018-03-01",
+        **variables,
+    )
+)
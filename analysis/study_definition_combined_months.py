@@ -0,0 +1,26 @@
+# Extracts every month of study_definition_combined in a single pass, see
+# multi_month.py, apart from the admission and mortality outcomes. Those are
+# read once for every month by the variables of
+# study_definition_outcome_events, extracted alongside (they have fixed
+# dates, so they aren't repeated by month). outcome_events.py turns them into
+# a partition of outcome events per month, and split_months.py splits the
+# extract into monthly input files with each month's outcomes.
+from common_variables import lazy_study
+from months import STUDY_MONTHS
+from multi_month import multi_month_study
+from outcome_events import event_variables
+from study_definition_combined import default_expectations, variables
+from study_definition_outcome_events import outcome_event_variables
+
+__getattr__ = lazy_study(
+    lambda: multi_month_study(
+        STUDY_MONTHS,
+        default_expectations=default_expectations,
+        **{
+            name: definition
+            for name, definition in variables.items()
+            if name not in event_variables()
+        },
+        **outcome_event_variables(STUDY_MONTHS),
+    )
+)
@@ -0,0 +1,182 @@
+# Extracts the first admission of every study month for each outcome, and the
+# deaths with an outcome cause, in one pass for every admission and mortality
+# outcome of the three cohorts at once (see outcome_scans.py). The
+# population is the patients with any outcome admission or death in the
+# period. Written as a partition of outcome events per month by
+# outcome_events.py, which reads the outcomes from its own definitions:
+# these are checked against study_definition_combined here.
+#
+# project.yaml extracts these variables as part of
+# study_definition_combined_months rather than with this study definition,
+# so the events and the monthly populations come from one extract and share
+# their patients, dummy patient ids included.
+from cohortextractor import StudyDefinition, codelist, patients
+
+from codelist_index import OUTCOME_CODELISTS, outcome_codes
+from codelists import load_codelist
+from common_variables import lazy_study
+from expressions import compile_categories
+from months import STUDY_MONTHS
+from multi_month import flatten, last_day_of_month
+from outcome_events import (
+    COMBINED_OUTCOMES,
+    OUTCOME_VARIABLES,
+    study_admission_outcomes,
+    study_death_outcomes,
+)
+from outcome_scans import (
+    ADMISSION_DIAGNOSES,
+    DEATH_CAUSE,
+    DEATH_CAUSE_COLUMN,
+    DEATH_DATE,
+    admission_column,
+    admission_outcomes,
+    admission_scans,
+    death_outcomes,
+    matched_outcomes,
+)
+from study_definition_combined import default_expectations, variables as combined_variables
+
+# Dummy data: the share of patients with an admission for each outcome in a
+# month, and with an outcome death in the period
+DUMMY_ADMISSION_INCIDENCE = 0.02
+DUMMY_DEATH_INCIDENCE = 0.2
+
+
+def combined_outcomes(variables, outcomes):
+    """
+    The top level categorised_as() variables which only combine `outcomes`,
+    as {name: category definitions}, each after any it refers to
+    """
+    known = set(outcomes)
+    combined = {}
+    changed = True
+    while changed:
+        changed = False
+        for name, (query_type, query_args) in variables.items():
+            if query_type != "categorised_as" or name in combined:
+                continue
+            definitions = query_args["category_definitions"]
+            if set(compile_categories(definitions).names) <= known:
+                combined[name] = definitions
+                known.add(name)
+                changed = True
+    return combined
+
+
+def check_outcome_definitions(variables):
+    """Check the definitions in outcome_events.py against the combined study definition"""
+    flat = flatten(variables)
+    outcomes = {**admission_outcomes(flat), **death_outcomes(flat)}
+    if outcomes != OUTCOME_VARIABLES:
+        raise ValueError("OUTCOME_VARIABLES in outcome_events.py are out of date")
+    combined = combined_outcomes(variables, outcomes)
+    if list(combined) != list(COMBINED_OUTCOMES):
+        raise ValueError("COMBINED_OUTCOMES in outcome_events.py are out of date")
+    for name, definitions in combined.items():
+        defined = {value: " ".join(str(case).split()) for value, case in definitions.items()}
+        if defined != {1: COMBINED_OUTCOMES[name], 0: "DEFAULT"}:
+            raise ValueError(f"The expression of {name} in outcome_events.py is out of date")
+
+
+def union_codes(outcomes):
+    """Every code of the outcomes' codelists"""
+    return sorted({code for outcome in outcomes for code in outcome_codes(outcome)})
+
+
+def code_ratios(codes):
+    """Equal dummy data ratios of `codes`, adding up to exactly 1"""
+    ratios = {code: 1 / len(codes) for code in codes[:-1]}
+    ratios[codes[-1]] = 1 - sum(ratios.values())
+    return ratios
+
+
+def admission_variables(outcomes, index_dates):
+    """
+    cohortextractor variables for the first admission of each of `outcomes`
+    (see admission_outcomes()) in every month of `index_dates`
+    """
+    arguments = {source: argument for argument, source in ADMISSION_DIAGNOSES.items()}
+    variables = {}
+    for index_date in index_dates:
+        month_end = last_day_of_month(index_date)
+        for outcome, source in admission_scans(outcomes):
+            codes = load_codelist(OUTCOME_CODELISTS[outcome])
+            variables[admission_column(outcome, source, index_date)] = (
+                patients.admitted_to_hospital(
+                    between=[index_date, month_end],
+                    returning="date_admitted",
+                    date_format="YYYY-MM-DD",
+                    find_first_match_in_period=True,
+                    return_expectations={
+                        "date": {"earliest": index_date, "latest": month_end},
+                        "incidence": DUMMY_ADMISSION_INCIDENCE,
+                    },
+                    **{arguments[source]: codes},
+                )
+            )
+    return variables
+
+
+def death_variables(outcomes, start, end):
+    """
+    cohortextractor variables for the date and underlying cause of each
+    death from `start` to `end` inclusive with a cause in any of `outcomes`
+    (see death_outcomes())
+    """
+    codes = union_codes(matched_outcomes(outcomes, DEATH_CAUSE))
+    if not codes:
+        return {}
+    causes = codelist(codes, system="icd10")
+    return {
+        DEATH_DATE: patients.with_these_codes_on_death_certificate(
+            causes,
+            between=[start, end],
+            match_only_underlying_cause=True,
+            returning="date_of_death",
+            date_format="YYYY-MM-DD",
+            return_expectations={
+                "date": {"earliest": start, "latest": end},
+                "incidence": DUMMY_DEATH_INCIDENCE,
+            },
+        ),
+        DEATH_CAUSE_COLUMN: patients.with_these_codes_on_death_certificate(
+            causes,
+            between=[start, end],
+            match_only_underlying_cause=True,
+            returning="underlying_cause_of_death",
+            return_expectations={
+                "category": {"ratios": code_ratios(codes)},
+                "incidence": DUMMY_DEATH_INCIDENCE,
+            },
+        ),
+    }
+
+
+def outcome_event_variables(index_dates):
+    """The admission and death variables of every outcome in `index_dates`"""
+    check_outcome_definitions(combined_variables)
+    return dict(
+        **admission_variables(study_admission_outcomes(), index_dates),
+        **death_variables(
+            study_death_outcomes(), index_dates[0], last_day_of_month(index_dates[-1])
+        ),
+    )
+
+
+def with_events(variables):
+    """Patients with any outcome admission or death in the extract's months"""
+    return " OR ".join(name for name in variables if name != DEATH_CAUSE_COLUMN)
+
+
+def outcome_events_study(index_dates):
+    variables = outcome_event_variables(index_dates)
+    return StudyDefinition(
+        default_expectations=default_expectations,
+        index_date=index_dates[0],
+        population=patients.satisfying(with_events(variables)),
+        **variables,
+    )
+
+
+__getattr__ = lazy_study(lambda: outcome_events_study(STUDY_MONTHS))
@@ -0,0 +1,79 @@
+# Extracts study_definition_static at every snapshot date in one pass (see
+# snapshots.py). The history flags are replaced by the date of each patient's
+# first event on or before the last snapshot, the variables the flags'
+# combinations refer to are brought up to the top level, and the rest are
+# extracted once per date as in multi_month.py. Split into input_static_*
+# files with snapshots.py
+from cohortextractor import patients
+
+from common_variables import lazy_study
+from multi_month import flatten, multi_month_study
+from snapshots import (
+    DERIVED,
+    HISTORY_FLAGS,
+    SNAPSHOT_DATES,
+    STATIC_COLUMNS,
+    first_date_column,
+)
+from study_definition_static import default_expectations, variables as static_variables
+
+
+def check_snapshot_definitions(flat):
+    """Check the definitions in snapshots.py against the static study definition"""
+    if [name for name in static_variables if name != "population"] != STATIC_COLUMNS:
+        raise ValueError("STATIC_COLUMNS in snapshots.py are out of date")
+    for flag in HISTORY_FLAGS:
+        query_type, query_args = flat[flag]
+        _, history_args = patients.with_these_clinical_events(
+            query_args["codelist"], on_or_before="index_date", returning="binary_flag"
+        )
+        compared = dict(query_args, return_expectations=None)
+        if query_type != "with_these_clinical_events" or compared != history_args:
+            raise ValueError(f"{flag} isn't a flag of any event before the index date")
+    for name, expression in DERIVED.items():
+        query_type, query_args = flat[name]
+        defined = " ".join(query_args["category_definitions"][1].split())
+        if query_type != "categorised_as" or defined != expression:
+            raise ValueError(f"The expression of {name} in snapshots.py is out of date")
+
+
+def first_event_date(query_args):
+    """The date of the first event of a history flag, up to the last snapshot"""
+    incidence = (query_args.get("return_expectations") or {}).get("incidence")
+    return patients.with_these_clinical_events(
+        query_args["codelist"],
+        on_or_before=SNAPSHOT_DATES[-1],
+        find_first_match_in_period=True,
+        returning="date",
+        date_format="YYYY-MM-DD",
+        return_expectations={
+            "date": {"earliest": "1980-01-01", "latest": SNAPSHOT_DATES[-1]},
+            "incidence": incidence or default_expectations["incidence"],
+        },
+    )
+
+
+def snapshot_variables():
+    flat = flatten(static_variables)
+    check_snapshot_definitions(flat)
+    variables = {}
+    for name, definition in static_variables.items():
+        if name not in HISTORY_FLAGS and name not in DERIVED:
+            variables[name] = definition
+    for name in DERIVED:
+        _, query_args = flat[name]
+        for nested, definition in (query_args.get("extra_columns") or {}).items():
+            if nested not in HISTORY_FLAGS:
+                variables[nested] = definition
+    for flag in HISTORY_FLAGS:
+        variables[first_date_column(flag)] = first_event_date(flat[flag][1])
+    return variables
+
+
+__getattr__ = lazy_study(
+    lambda: multi_month_study(
+        SNAPSHOT_DATES,
+        default_expectations=default_expectations,
+        **snapshot_variables(),
+    )
+)
@@ -0,0 +1,16 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+# The analysis scripts import each other as top level modules, as when run
+# as `python analysis/<script>.py`
+sys.path.insert(0, str(ROOT / "analysis"))
+
+
+@pytest.fixture(autouse=True)
+def repo_root(monkeypatch):
+    """Run from the repository root, as project.yaml's actions do"""
+    monkeypatch.chdir(ROOT)
+    return ROOT
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from codelist_files import read_codes
+from codelist_index import CodelistIndex, admissions_index, deaths_index, outcome_codes
+
+CODELISTS = {"mi": ["I21", "I22"], "stemi": ["I210"], "stroke": ["I63"]}
+
+
+@pytest.fixture
+def index():
+    return CodelistIndex(CODELISTS, match_prefixes=True)
+
+
+def masks_of(index, masks):
+    """The codelists matched by each bitmask"""
+    flags = index.flags(masks)
+    return [sorted(name for name in index.names if row[name]) for _, row in flags.iterrows()]
+
+
+def test_diagnoses_match_every_codelist_with_a_prefix_of_the_code(index):
+    masks = index.classify(["I21", "I210", "I2109", "I2", "I63X", "J45", None, ""])
+    assert masks_of(index, masks) == [
+        ["mi"],
+        ["mi", "stemi"],
+        ["mi", "stemi"],
+        [],
+        ["stroke"],
+        [],
+        [],
+        [],
+    ]
+
+
+def test_causes_of_death_match_exactly():
+    index = CodelistIndex(CODELISTS, match_prefixes=False)
+    masks = index.classify(["I21", "I210", "I2109", "I63X"])
+    assert masks_of(index, masks) == [["mi"], ["stemi"], [], []]
+
+
+def test_all_diagnoses_match_any_code_in_the_list(index):
+    masks = index.classify(["J45 ,I630||I211", "J45,J46", np.nan], all_diagnoses=True)
+    assert masks_of(index, masks) == [["mi", "stroke"], [], []]
+
+
+def test_flags_give_a_column_per_codelist(index):
+    flags = index.flags(index.classify(["I210", "I63"]), names=["stemi", "stroke"])
+    assert flags.to_dict("list") == {"stemi": [1, 0], "stroke": [0, 1]}
+
+
+def test_outcome_indexes_match_the_outcome_codelists():
+    mi = outcome_codes("mi")
+    # The mental health outcome combines the other mental health codelists
+    assert set(outcome_codes("depression")) <= set(outcome_codes("mh"))
+    assert set(read_codes("suicide_icd_codes")) <= set(outcome_codes("mh"))
+    code = [mi[0] + "X"]
+    assert "mi" in masks_of(admissions_index(), admissions_index().classify(code))[0]
+    assert "mi" not in masks_of(deaths_index(), deaths_index().classify(code))[0]
@@ -0,0 +1,38 @@
+import pickle
+
+import pytest
+
+import codelists
+
+
+def read_asthma(cache_dir, monkeypatch):
+    monkeypatch.setattr(codelists, "CACHE_DIR", cache_dir)
+    return codelists.read_codelist(
+        "codelists/opensafely-asthma-exacerbation-secondary-care.csv", "icd10"
+    )
+
+
+def test_read_codelist_caches_parsed_codes(tmp_path, monkeypatch):
+    parsed = read_asthma(tmp_path, monkeypatch)
+    (cached,) = tmp_path.glob("*.pickle")
+    with open(cached, "rb") as f:
+        assert list(pickle.load(f)) == list(parsed)
+    assert list(read_asthma(tmp_path, monkeypatch)) == list(parsed)
+
+
+@pytest.mark.parametrize(
+    "contents",
+    [
+        b"",
+        b"not a pickle",
+        # Pickled by a version defining the class in another module, or not
+        # at all (ImportError and AttributeError on loading)
+        b"cno_such_module\nCodelist\n.",
+        b"ccodelists\nNoSuchCodelist\n.",
+    ],
+)
+def test_read_codelist_reparses_unloadable_cache(tmp_path, monkeypatch, contents):
+    parsed = read_asthma(tmp_path, monkeypatch)
+    (cached,) = tmp_path.glob("*.pickle")
+    cached.write_bytes(contents)
+    assert list(read_asthma(tmp_path, monkeypatch)) == list(parsed)
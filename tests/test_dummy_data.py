@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+from columnar import read_frame
+from dummy_data import (
+    SEED_BLOCK,
+    generate_column,
+    generate_dummy_data,
+    population_age_probabilities,
+)
+
+MONTHS = ["2020-02-01", "2020-03-01"]
+
+
+def test_columns_follow_their_expectations():
+    rng = np.random.default_rng(0)
+    size = 20_000
+    flag = generate_column(rng, size, "bool", {"incidence": 0.2})
+    assert abs(flag.mean() - 0.2) < 0.02
+    categories = generate_column(
+        rng, size, "str", {"rate": "universal", "category": {"ratios": {"1": 0.75, "2": 0.25}}}
+    )
+    assert categories.notna().all()
+    assert abs((categories == "1").mean() - 0.75) < 0.02
+    counts = generate_column(
+        rng, size, "int", {"incidence": 1, "int": {"distribution": "poisson", "mean": 3}}
+    )
+    assert abs(counts.mean() - 3) < 0.1
+    dates = generate_column(
+        rng,
+        size,
+        "date",
+        {"incidence": 0.5, "date": {"earliest": "2020-01-01", "latest": "2020-12-31"}},
+    )
+    assert abs(dates.notna().mean() - 0.5) < 0.02
+    assert dates.min() >= pd.Timestamp("2020-01-01")
+    assert dates.max() <= pd.Timestamp("2020-12-31")
+
+
+def test_dummy_data_is_repeatable_and_keeps_static_variables(tmp_path):
+    for name in ["a", "b"]:
+        generate_dummy_data(tmp_path / name, 2000, MONTHS, chunk_size=700)
+    first, second = tmp_path / "a", tmp_path / "b"
+    files = sorted(path.relative_to(first) for path in first.rglob("input_*"))
+    # A file per cohort and month
+    assert len(files) == 3 * len(MONTHS)
+    for name in files:
+        pd.testing.assert_frame_equal(read_frame(second / name), read_frame(first / name))
+    february, march = (
+        read_frame(first / f"input_{date}.feather").set_index("patient_id")
+        for date in MONTHS
+    )
+    # Most patients are in the population each month, with the same sex
+    assert 0.9 < len(february) / 2000 < 1
+    both = february.index.intersection(march.index)
+    assert (february.loc[both, "sex"] == march.loc[both, "sex"]).all()
+    # while the monthly outcomes are drawn again each month
+    assert not (february.loc[both, "mi_admission"] == march.loc[both, "mi_admission"]).all()
+    dm = read_frame(first / "dm" / f"input_dm_{MONTHS[0]}.feather")
+    assert set(dm["patient_id"]) < set(february.index)
+
+
+def test_dummy_data_does_not_depend_on_the_chunk_size(tmp_path):
+    size = SEED_BLOCK + 300
+    for chunk_size in [size, 1000]:
+        generate_dummy_data(tmp_path / str(chunk_size), size, MONTHS[:1], chunk_size=chunk_size)
+    name = f"input_{MONTHS[0]}.feather"
+    pd.testing.assert_frame_equal(
+        read_frame(tmp_path / "1000" / name), read_frame(tmp_path / str(size) / name)
+    )
+
+
+def test_ages_spread_each_band_over_its_own_ages():
+    probabilities = population_age_probabilities()
+    # Bands of five years up to 95-99, then one of 100 to 130
+    assert len(probabilities) == 131
+    assert probabilities[0] == probabilities[4] != probabilities[5]
+    assert probabilities[100] == probabilities[130]
+    assert abs(probabilities[95:100].sum() / probabilities[100:].sum() - 123 / 13) < 1e-9
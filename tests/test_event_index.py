@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from event_index import EventIndex, to_days
+from months import month_end
+
+EVENTS = pd.DataFrame(
+    dict(
+        patient_id=[3, 1, 1, 1, 9, 3],
+        outcome=["mi", "mi", "mi", "stroke", "mi", "mi"],
+        date=["2020-03-31", "2020-04-01", "2020-03-01", "2020-03-15", "2020-03-10", None],
+    )
+)
+
+
+def test_month_end_follows_the_calendar():
+    assert month_end("2020-02-01") == "2020-02-29"
+    assert month_end("2021-02-01") == "2021-02-28"
+    assert month_end("2021-12-01") == "2021-12-31"
+
+
+def test_windows_include_both_ends():
+    indexes = EventIndex.for_groups([1, 2, 3], EVENTS, ["outcome"])
+    mi = indexes["mi"]
+    # Patient 1's events sorted by date, patient 2 without any, and events of
+    # other patients or without a date dropped
+    assert mi.offsets.tolist() == [0, 2, 2, 3]
+    assert mi.days.tolist() == to_days(["2020-03-01", "2020-04-01", "2020-03-31"]).tolist()
+    assert mi.count_between("2020-03-01", "2020-04-01").tolist() == [2, 0, 1]
+    assert mi.any_between("2020-03-02", month_end("2020-03-01")).tolist() == [0, 0, 1]
+    assert mi.any_between("2020-04-01", month_end("2020-04-01")).tolist() == [1, 0, 0]
+    assert indexes["stroke"].count_between("2020-03-01", "2020-03-31").tolist() == [1, 0, 0]
+
+
+def test_windows_match_a_scan_of_the_events():
+    rng = np.random.default_rng(0)
+    events = pd.DataFrame(
+        dict(
+            patient_id=rng.integers(0, 100, 2000),
+            date=pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 365, 2000), "D"),
+        )
+    )
+    patient_ids = rng.permutation(120)
+    (index,) = EventIndex.for_groups(patient_ids, events.assign(group=1), ["group"]).values()
+    for start, end in [("2020-01-01", "2020-01-31"), ("2020-06-15", "2020-07-01")]:
+        within = events[events["date"].between(start, end)]
+        expected = within["patient_id"].value_counts().reindex(patient_ids, fill_value=0)
+        assert index.count_between(start, end).tolist() == expected.tolist()
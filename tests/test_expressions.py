@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from expressions import compile_categories, compile_expression
+
+IMD_CATEGORIES = {
+    "0": "DEFAULT",
+    "1": "index_of_multiple_deprivation >=0 AND index_of_multiple_deprivation < 32844*1/5 AND has_msoa",
+    "2": "index_of_multiple_deprivation >= 32844*1/5 AND index_of_multiple_deprivation < 32844*2/5",
+    "3": "index_of_multiple_deprivation >= 32844*2/5 AND index_of_multiple_deprivation < 32844*3/5",
+    "4": "index_of_multiple_deprivation >= 32844*3/5 AND index_of_multiple_deprivation < 32844*4/5",
+    "5": "index_of_multiple_deprivation >= 32844*4/5 AND index_of_multiple_deprivation <= 32844",
+}
+
+
+def evaluate(expression, **columns):
+    return compile_expression(expression)(pd.DataFrame(columns)).tolist()
+
+
+def test_precedence():
+    assert evaluate("a OR b AND NOT c", a=[0, 0, 1], b=[1, 1, 0], c=[0, 1, 0]) == [
+        True,
+        False,
+        True,
+    ]
+    assert evaluate("a + b * 2 = 7", a=[1, 3], b=[3, 2]) == [True, True]
+
+
+def test_integer_division_truncates():
+    assert evaluate("a < 32844*1/5", a=[6567, 6568]) == [True, False]
+
+
+def test_comparisons_with_missing_values_are_false():
+    assert evaluate("a >= 1", a=[1.0, np.nan]) == [True, False]
+    assert evaluate("NOT a >= 1", a=[1.0, np.nan]) == [False, True]
+
+
+def test_constant_parts_are_folded():
+    expression = compile_expression("1 = 1 AND a")
+    assert expression.tree == ("truth", ("column", "a"))
+    assert compile_expression("1 = 2 AND a").tree == ("const", False)
+
+
+@pytest.mark.parametrize("dtype", ["int64", "float64", str])
+def test_numbers_compare_as_numbers_whatever_the_column_type(dtype):
+    columns = pd.DataFrame({"imd": [0, 3, 5], "age": [17, 18, 110]}).astype(dtype)
+    assert compile_expression("imd != 0")(columns).tolist() == [False, True, True]
+    assert compile_expression("age >= 18 AND age <= 110")(columns).tolist() == [
+        False,
+        True,
+        True,
+    ]
+    assert compile_expression("imd")(columns).tolist() == [False, True, True]
+    assert compile_expression("age + 2 > 19")(columns).tolist() == [False, True, True]
+
+
+def test_text_which_isnt_a_number_is_missing():
+    columns = pd.DataFrame({"household": ["", "3", "x"]})
+    assert compile_expression("household >= 1")(columns).tolist() == [False, True, False]
+    assert compile_expression("NOT household >= 1")(columns).tolist() == [
+        True,
+        False,
+        True,
+    ]
+
+
+def test_text_compares_with_text():
+    columns = pd.DataFrame({"sex": ["M", "F", "U", ""], "stp": ["E1", "", "E2", "missing"]})
+    assert compile_expression("sex = 'M' OR sex = 'F'")(columns).tolist() == [
+        True,
+        True,
+        False,
+        False,
+    ]
+    assert compile_expression("stp")(columns).tolist() == [True, False, True, True]
+
+
+@pytest.mark.parametrize("dtype", ["int64", str])
+def test_categories(dtype):
+    columns = pd.DataFrame(
+        {
+            "index_of_multiple_deprivation": [0, 100, 6568, 32844, 32845],
+            "has_msoa": [1, 0, 1, 1, 1],
+        }
+    ).astype(dtype)
+    assert compile_categories(IMD_CATEGORIES)(columns).tolist() == [
+        "1",
+        "0",
+        "2",
+        "5",
+        "0",
+    ]
+
+
+def test_integer_categories():
+    categories = compile_categories({1: "a AND b", 0: "DEFAULT"})
+    columns = pd.DataFrame({"a": ["1", "1", "0"], "b": ["1", "0", "1"]})
+    result = categories(columns)
+    assert result.dtype == "int64"
+    assert result.tolist() == [1, 0, 0]
+
+
+def test_unparseable_expressions():
+    with pytest.raises(ValueError):
+        compile_expression("a AND (b OR c")
+    with pytest.raises(ValueError):
+        compile_expression("a ! b")
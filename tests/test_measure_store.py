@@ -0,0 +1,67 @@
+import pandas as pd
+
+from measure_store import COLUMNS, MeasureStore
+
+
+def measure_rows(cohort, outcome, group_by, date, value, groups=("1", "2")):
+    return pd.DataFrame(
+        dict(
+            cohort=cohort,
+            outcome=outcome,
+            group_by=group_by,
+            group=list(groups),
+            date=pd.Timestamp(date),
+            numerator=1.0,
+            denominator=10.0,
+            value=value,
+        )
+    )[COLUMNS]
+
+
+def test_append_replaces_only_the_same_cohort_grouping_and_month():
+    store = MeasureStore()
+    store.append(
+        pd.concat(
+            [
+                measure_rows("general", "mi_admission", "imd", "2020-04-01", 0.1),
+                measure_rows("general", "mi_admission", "imd", "2020-03-01", 0.1),
+                measure_rows("general", "mi_admission", "migration_status", "2020-03-01", 0.1),
+                measure_rows("general", "stroke_admission", "imd", "2020-03-01", 0.1),
+            ]
+        )
+    )
+    store.append(measure_rows("general", "mi_admission", "imd", "2020-03-01", 0.2, ["2", "1"]))
+    march = store.select("mi_admission", date="2020-03-01")
+    assert march[["group_by", "group", "value"]].to_numpy().tolist() == [
+        ["imd", "1", 0.2],
+        ["imd", "2", 0.2],
+        ["migration_status", "1", 0.1],
+        ["migration_status", "2", 0.1],
+    ]
+    by_imd = store.select("mi_admission", group_by="imd")
+    assert by_imd["date"].dt.strftime("%Y-%m").tolist() == ["2020-03"] * 2 + ["2020-04"] * 2
+    assert store.select("stroke_admission")["value"].tolist() == [0.1, 0.1]
+    assert store.outcomes == ["mi_admission", "stroke_admission"]
+    assert store.dates == [pd.Timestamp("2020-03-01"), pd.Timestamp("2020-04-01")]
+    assert len(store.select("vte_admission")) == 0
+
+
+def test_store_is_written_sorted_and_read_back(tmp_path):
+    store = MeasureStore(
+        pd.concat(
+            [
+                measure_rows("general", "stroke_admission", "imd", "2020-03-01", 0.1),
+                measure_rows("dm", "dmt1_admission", "imd", "2020-04-01", 0.3),
+                measure_rows("dm", "dmt1_admission", "imd", "2020-03-01", 0.2),
+            ]
+        )
+    )
+    store.write(tmp_path / "measures.feather")
+    rows = MeasureStore.read(tmp_path / "measures.feather").rows
+    pd.testing.assert_frame_equal(rows, store.rows)
+    assert rows[["outcome", "value"]].drop_duplicates().to_numpy().tolist() == [
+        ["dmt1_admission", 0.2],
+        ["dmt1_admission", 0.3],
+        ["stroke_admission", 0.1],
+    ]
+    assert len(MeasureStore.read(tmp_path / "missing.feather").rows) == 0
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cohorts import COHORTS, measure_definitions
+from columnar import typed_frame, write_frame
+from flag_bits import FlagBits, pack, packed_columns, popcount
+from measures import calculate_measures
+
+MONTHS = ["2020-02-01", "2020-03-01"]
+
+
+def cohort_month(cohort, rows, seed):
+    """A month of a cohort's input file, as split_months.py reads it (text)"""
+    rng = np.random.default_rng(seed)
+    month = {"patient_id": np.arange(1, rows + 1).astype(str)}
+    for column in COHORTS[cohort]["columns"]:
+        if column == "imd":
+            month[column] = rng.integers(0, 6, rows).astype(str)
+        elif column == "sex":
+            month[column] = rng.choice(["F", "M"], rows)
+        elif column == "age":
+            month[column] = rng.integers(18, 100, rows).astype(str)
+        else:
+            month[column] = (rng.random(rows) < 0.3).astype(int).astype(str)
+    return pd.DataFrame(month)
+
+
+def test_popcount_counts_set_bits():
+    rng = np.random.default_rng(0)
+    values = rng.random(1000) < 0.4
+    assert popcount(pack(values)) == values.sum()
+    words = rng.integers(0, 2**63, 50, dtype="uint64")
+    assert popcount(words) == sum(bin(int(word)).count("1") for word in words)
+
+
+def test_flag_bits_count_within_a_group(tmp_path):
+    rng = np.random.default_rng(1)
+    frame = pd.DataFrame({"flag": rng.random(130) < 0.5})
+    write_frame(frame, tmp_path / "flags.feather")
+    flags = FlagBits.read(tmp_path / "flags.feather")
+    group = rng.random(130) < 0.5
+    assert flags.count("flag", pack(group)) == (frame["flag"] & group).sum()
+    assert flags.decode("flag").tolist() == frame["flag"].astype("uint8").tolist()
+    assert FlagBits.read(tmp_path / "flags.feather", columns=[]).names == []
+
+
+@pytest.mark.parametrize("cohort", list(COHORTS))
+def test_measures_agree_across_input_formats(tmp_path, cohort):
+    inputs = {name: tmp_path / name for name in ["csv", "feather", "packed"]}
+    for directory in inputs.values():
+        directory.mkdir()
+    prefix = COHORTS[cohort]["prefix"]
+    for seed, date in enumerate(MONTHS):
+        month = cohort_month(cohort, rows=300, seed=seed)
+        month.to_csv(inputs["csv"] / f"input_{prefix}{date}.csv", index=False)
+        write_frame(typed_frame(month), inputs["feather"] / f"input_{prefix}{date}.feather")
+        write_frame(
+            typed_frame(month, pack_flags=True),
+            inputs["packed"] / f"input_{prefix}{date}.feather",
+        )
+    packed = packed_columns(inputs["packed"] / f"input_{prefix}{MONTHS[0]}.feather")
+    assert set(COHORTS[cohort]["outcomes"]) <= set(packed)
+    measures = {}
+    for name, input_dir in inputs.items():
+        output_dir = tmp_path / f"measures_{name}"
+        calculate_measures(cohort, input_dir, output_dir)
+        measures[name] = {
+            definition["id"]: pd.read_csv(output_dir / f"measure_{definition['id']}.csv")
+            for definition in measure_definitions(cohort)
+        }
+    for name in ["feather", "packed"]:
+        for measure_id, measure in measures["csv"].items():
+            pd.testing.assert_frame_equal(measures[name][measure_id], measure)
+    # A row per month of each IMD quintile (and 0) and migration status
+    for definition in measure_definitions(cohort):
+        groups = 6 if definition["group_by"] == ["imd"] else 2
+        assert len(measures["csv"][definition["id"]]) == groups * len(MONTHS)
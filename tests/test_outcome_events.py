@@ -0,0 +1,47 @@
+import pandas as pd
+
+from outcome_events import (
+    event_variables,
+    month_outcomes,
+    outcome_indexes,
+    read_events,
+    read_partition,
+    write_partitions,
+)
+
+MONTHS = ["2020-03-01", "2020-04-01", "2020-05-01"]
+
+
+def test_month_outcomes_from_partitions(tmp_path):
+    events = pd.DataFrame(
+        dict(
+            patient_id=[1, 2, 2, 3],
+            month=["2020-03-01", "2020-03-01", "2020-03-01", "2020-04-01"],
+            outcome=["depression", "stroke", "stroke", "mi"],
+            source=[
+                "primary_diagnosis",
+                "underlying_cause",
+                "primary_diagnosis",
+                "primary_diagnosis",
+            ],
+            date=pd.to_datetime(["2020-03-02", "2020-03-05", "2020-03-05", "2020-04-30"]),
+        )
+    )
+    write_partitions(events, tmp_path, MONTHS)
+    assert len(read_partition(tmp_path, "2020-03-01")) == 3
+    indexes = outcome_indexes(read_events(tmp_path, MONTHS), [3, 2, 1, 4])
+    flags = month_outcomes(indexes, "2020-03-01", 4)
+    assert set(event_variables()) <= set(flags)
+    assert flags["depression_admission"].tolist() == [0, 0, 1, 0]
+    # Combinations of outcomes are derived from them
+    assert flags["mh_admission"].tolist() == [0, 0, 1, 0]
+    # Each outcome only from the source its variable is matched to
+    assert flags["stroke_admission"].tolist() == [0, 1, 0, 0]
+    assert flags["stroke_mortality"].tolist() == [0, 1, 0, 0]
+    assert flags["mi_admission"].tolist() == [0, 0, 0, 0]
+    april = month_outcomes(indexes, "2020-04-01", 4)
+    assert april["mi_admission"].tolist() == [1, 0, 0, 0]
+    # Months without events have an empty partition
+    assert len(read_partition(tmp_path, "2020-05-01")) == 0
+    may = month_outcomes(indexes, "2020-05-01", 4)
+    assert not any(flags.any() for flags in may.values())
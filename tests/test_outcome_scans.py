@@ -0,0 +1,115 @@
+import pandas as pd
+
+from codelist_index import codes_of, outcome_codes
+from outcome_events import study_admission_outcomes
+from outcome_scans import (
+    DEATH_CAUSE_COLUMN,
+    DEATH_DATE,
+    admission_column,
+    admission_events,
+    death_events,
+)
+from study_definition_combined import variables
+from study_definition_outcome_events import (
+    admission_variables,
+    check_outcome_definitions,
+    code_ratios,
+)
+
+OUTCOMES = {
+    "mi_admission": ("mi", "primary_diagnosis"),
+    "stroke_admission": ("stroke", "primary_diagnosis"),
+    "copd_any": ("copd", "all_diagnoses"),
+}
+MONTHS = ["2020-03-01", "2020-04-01"]
+
+
+def admissions_extract(dates):
+    """
+    An extract of admission_variables() for patients 1 to 3 (as text), from
+    {(outcome, source, month): dates}
+    """
+    extract = {"patient_id": ["1", "2", "3"]}
+    for month in MONTHS:
+        for outcome, source in dict.fromkeys(OUTCOMES.values()):
+            column = admission_column(outcome, source, month)
+            extract[column] = dates.get((outcome, source, month), [""] * 3)
+    return pd.DataFrame(extract)
+
+
+def test_admission_variables_read_each_outcome_a_month():
+    study_variables = admission_variables(
+        {**OUTCOMES, "mi_admission2": ("mi", "primary_diagnosis")}, MONTHS
+    )
+    # A variable per distinct outcome and month
+    assert len(study_variables) == 3 * len(MONTHS)
+    _, mi = study_variables[admission_column("mi", "primary_diagnosis", "2020-04-01")]
+    assert mi["between"] == ["2020-04-01", "2020-04-30"]
+    assert mi["returning"] == "date_admitted"
+    assert mi["find_first_match_in_period"]
+    assert set(codes_of(mi["with_these_primary_diagnoses"])) == set(outcome_codes("mi"))
+    _, copd = study_variables[admission_column("copd", "all_diagnoses", "2020-03-01")]
+    assert set(codes_of(copd["with_these_diagnoses"])) == set(outcome_codes("copd"))
+
+
+def test_outcome_definitions_match_the_combined_study_definition():
+    check_outcome_definitions(variables)
+
+
+def test_dummy_code_ratios_add_up_to_one():
+    codes = [f"X{i}" for i in range(7)]
+    assert sum(code_ratios(codes).values()) == 1
+
+
+def test_admission_events_keep_every_outcome():
+    extract = admissions_extract(
+        {
+            # Patient 1 has a MI and a stroke on the same day
+            ("mi", "primary_diagnosis", "2020-03-01"): ["2020-03-05", "", ""],
+            ("stroke", "primary_diagnosis", "2020-03-01"): ["2020-03-05", "2020-03-31", ""],
+            ("copd", "all_diagnoses", "2020-04-01"): ["2020-04-02", "", ""],
+            ("mi", "primary_diagnosis", "2020-04-01"): ["", "", "2020-04-30"],
+        }
+    )
+    events = admission_events(extract, OUTCOMES, MONTHS)
+    events["date"] = events["date"].dt.strftime("%Y-%m-%d")
+    assert sorted(map(tuple, events.to_numpy().tolist())) == [
+        (1, "2020-03-01", "mi", "primary_diagnosis", "2020-03-05"),
+        (1, "2020-03-01", "stroke", "primary_diagnosis", "2020-03-05"),
+        (1, "2020-04-01", "copd", "all_diagnoses", "2020-04-02"),
+        (2, "2020-03-01", "stroke", "primary_diagnosis", "2020-03-31"),
+        (3, "2020-04-01", "mi", "primary_diagnosis", "2020-04-30"),
+    ]
+
+
+def test_admission_events_keep_every_outcome_of_a_busy_month():
+    # Every outcome of the study in one month, for one patient
+    outcomes = study_admission_outcomes()
+    extract = pd.DataFrame(
+        {
+            "patient_id": ["1"],
+            **{
+                admission_column(outcome, source, "2020-03-01"): ["2020-03-01"]
+                for outcome, source in outcomes.values()
+            },
+        }
+    )
+    events = admission_events(extract, outcomes, ["2020-03-01"])
+    assert set(zip(events["outcome"], events["source"])) == set(outcomes.values())
+
+
+def test_death_events_classify_causes_exactly_in_the_study_months():
+    outcomes = {"mi_mortality": ("mi", "underlying_cause")}
+    mi = outcome_codes("mi")[0]
+    extract = pd.DataFrame(
+        {
+            "patient_id": ["1", "2", "3", "4"],
+            DEATH_DATE: ["2020-03-31", "2020-04-01", "2019-01-01", ""],
+            # Death certificate causes aren't matched by prefix
+            DEATH_CAUSE_COLUMN: [mi, mi + "X", mi, ""],
+        }
+    )
+    events = death_events(extract, outcomes, MONTHS)
+    assert events.to_numpy().tolist() == [
+        [1, "2020-03-01", "mi", "underlying_cause", pd.Timestamp("2020-03-31")]
+    ]
@@ -0,0 +1,186 @@
+import json
+import logging
+
+import pandas as pd
+import structlog
+from cohortextractor.log_utils import log_execution_time
+
+from profile_extraction import (
+    PlanCursor,
+    parse_step,
+    plan_statistics,
+    stats_of,
+    summarise,
+    timing_queries,
+    trace_records,
+)
+
+logger = structlog.get_logger("cohortextractor.tpp_backend")
+# An actual execution plan as SQL Server returns it with STATISTICS XML on,
+# cut down to the elements read
+PLAN = """<ShowPlanXML xmlns="http://schemas.microsoft.com/sqlserver/2004/07/showplan">
+<BatchSequence><Batch><Statements><StmtSimple><QueryPlan>
+<MemoryGrantInfo SerialRequiredMemory="512" GrantedMemory="4096" MaxUsedMemory="2048"/>
+<RelOp PhysicalOp="Hash Match"><RunTimeInformation>
+<RunTimeCountersPerThread Thread="0" ActualRows="10"/></RunTimeInformation>
+<RelOp PhysicalOp="Clustered Index Scan"><RunTimeInformation>
+<RunTimeCountersPerThread Thread="1" ActualRows="40" ActualRowsRead="600"/>
+<RunTimeCountersPerThread Thread="2" ActualRows="60" ActualRowsRead="400"/>
+</RunTimeInformation></RelOp>
+<RelOp PhysicalOp="Index Seek"><RunTimeInformation>
+<RunTimeCountersPerThread Thread="0" ActualRows="25"/></RunTimeInformation></RelOp>
+</RelOp></QueryPlan></StmtSimple></Statements></Batch></BatchSequence></ShowPlanXML>"""
+
+
+class FakeCursor:
+    """A cursor returning the result sets of one statement"""
+
+    def __init__(self, result_sets):
+        self.result_sets = result_sets
+        self.queries = []
+
+    def execute(self, query, log_desc=None):
+        self.queries.append(query)
+        with log_execution_time(logger, description=log_desc):
+            self.remaining = list(self.result_sets)
+
+    @property
+    def description(self):
+        name = self.remaining[0][0]
+        return [(name,)] if name else None
+
+    def fetchall(self):
+        return self.remaining[0][1]
+
+    def nextset(self):
+        self.remaining.pop(0)
+        return bool(self.remaining)
+
+
+def run(sql):
+    """Log a statement's execution time as cohortextractor does"""
+    description = sql.splitlines()[0][3:] if sql.startswith("-- ") else None
+    with log_execution_time(logger, sql=sql, description=description):
+        pass
+
+
+def test_parse_step():
+    assert parse_step("Query for mi_admission_2020_03_01") == (
+        "query",
+        "mi_admission_2020_03_01",
+        "mi_admission",
+        "2020-03-01",
+    )
+    assert parse_step("Uploading codelist for sex") == ("codelist", "sex", "sex", None)
+    assert parse_step("Join all columns for final output") == ("other", None, None, None)
+
+
+def test_timing_queries_collects_each_statement():
+    with timing_queries() as timings:
+        run("-- Uploading codelist for mi_admission_2020_03_01\nCREATE TABLE #c")
+        run("INSERT INTO #c VALUES ('I21')")
+        run("-- Query for mi_admission_2020_03_01\nSELECT 1")
+    # Not collected outside the context
+    run("-- Query for sex\nSELECT 1")
+    assert [step["step"] for step in timings.steps] == [
+        "Uploading codelist for mi_admission_2020_03_01",
+        "Uploading codelist for mi_admission_2020_03_01",
+        "Query for mi_admission_2020_03_01",
+    ]
+    assert all(step["state"] == "ok" and step["seconds"] >= 0 for step in timings.steps)
+
+
+def test_stats_are_read_from_captured_log_records():
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    logging.getLogger("cohortextractor").addHandler(handler)
+    try:
+        run("-- Query for sex\nSELECT 1")
+    finally:
+        logging.getLogger("cohortextractor").removeHandler(handler)
+    stops = [stats_of(record) for record in records]
+    stops = [stats for stats in stops if stats and stats.get("timing") == "stop"]
+    assert [stats["description"] for stats in stops] == ["Query for sex"]
+    # Rendered as JSON, or not a stats record at all
+    rendered = logging.makeLogRecord(dict(msg=json.dumps(stops[0])))
+    assert stats_of(rendered)["description"] == "Query for sex"
+    assert stats_of(logging.makeLogRecord(dict(msg="Running: Query for sex"))) is None
+    assert stats_of(logging.makeLogRecord(dict(msg={"event": "other"}))) is None
+
+
+def test_plan_statistics_count_rows_read_by_scans_and_seeks():
+    rows, memory = plan_statistics(PLAN)
+    # Rows read by the scan's threads and returned by the seek, not the join
+    assert rows == 600 + 400 + 25
+    assert memory == 2.0
+
+
+def test_plan_cursor_adds_plan_statistics_to_the_query_step():
+    cursor = FakeCursor([(None, []), ("Microsoft SQL Server 2005 XML Showplan", [(PLAN,)])])
+    with timing_queries() as timings:
+        plans = PlanCursor(cursor, timings)
+        plans.execute("-- Uploading codelist for sex\nCREATE TABLE #c", log_desc=None)
+        plans.execute("SELECT 1", log_desc="Query for sex")
+    assert cursor.queries[0] == "-- Uploading codelist for sex\nCREATE TABLE #c"
+    assert cursor.queries[1].startswith("SET STATISTICS XML ON\n")
+    assert "rows_scanned" not in timings.steps[0]
+    assert timings.steps[1]["rows_scanned"] == 1025
+    assert timings.steps[1]["peak_memory_mb"] == 2.0
+
+
+def test_timing_queries_wraps_the_backend_connection_while_in_context():
+    class Backend:
+        def get_db_connection(self, force_reconnect=False):
+            return type("Connection", (), {"cursor": lambda self: FakeCursor([])})()
+
+    backend = Backend()
+    with timing_queries(backend):
+        assert isinstance(backend.get_db_connection().cursor(), PlanCursor)
+    assert isinstance(backend.get_db_connection().cursor(), FakeCursor)
+
+
+def test_summarise():
+    steps = [
+        dict(step="Uploading codelist for mi_admission_2020_03_01", seconds=1.0),
+        dict(step="Query for mi_admission_2020_03_01", seconds=2.0, rows_scanned=100),
+        dict(step="Uploading codelist for mi_admission_2020_04_01", seconds=1.0),
+        dict(
+            step="Query for mi_admission_2020_04_01",
+            seconds=4.0,
+            rows_scanned=300,
+            peak_memory_mb=1.5,
+        ),
+        dict(step="Query for sex", seconds=0.5),
+        dict(step="Join all columns for final output", seconds=3.0),
+    ]
+    definitions = {
+        "mi_admission_2020_03_01": ("admitted_to_hospital", {}),
+        "mi_admission_2020_04_01": ("admitted_to_hospital", {}),
+        "sex": ("sex", {}),
+    }
+    returned = {"mi_admission_2020_03_01": 10, "mi_admission_2020_04_01": 20, "sex": 99}
+    trace = pd.DataFrame(
+        trace_records(
+            [dict(step, state="ok") for step in steps], definitions, 100, returned
+        )
+    )
+    assert trace["patients"].eq(100).all()
+    summary = summarise(trace).set_index("variable")
+    assert summary.index.tolist() == [
+        "mi_admission",
+        "sex",
+        "Join all columns for final output",
+    ]
+    mi = summary.loc["mi_admission"]
+    assert mi["query_type"] == "admitted_to_hospital"
+    assert mi["index_dates"] == 2
+    assert mi["total_seconds"] == 8.0
+    assert mi["codelist_seconds"] == 2.0
+    assert mi["max_seconds"] == 4.0
+    assert mi["mean_rows_returned"] == 15
+    assert mi["mean_rows_scanned"] == 200
+    assert mi["max_rows_scanned"] == 300
+    assert mi["max_peak_memory_mb"] == 1.5
+    assert summary.loc["sex", "index_dates"] == 0
+    assert summary.loc["Join all columns for final output", "total_seconds"] == 3.0
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from columnar import read_frame
+from outcome_events import event_variables, write_partitions
+from split_months import MONTH_VARIABLES, split_months
+
+MONTHS = ["2020-02-01", "2020-03-01", "2020-04-01"]
+PATIENTS = 50
+
+
+def wide_extract(path, seed=0):
+    """A single-pass extract without the outcome event variables, as text"""
+    rng = np.random.default_rng(seed)
+    extract = {"patient_id": np.arange(1, PATIENTS + 1).astype(str)}
+    for date in MONTHS:
+        suffix = "_" + date.replace("-", "_")
+        for name in MONTH_VARIABLES:
+            if name in event_variables():
+                continue
+            if name == "age":
+                values = rng.integers(0, 100, PATIENTS).astype(str)
+            elif name == "sex":
+                values = rng.choice(["F", "M"], PATIENTS)
+            elif name == "imd":
+                values = rng.integers(0, 6, PATIENTS).astype(str)
+            else:
+                values = (rng.random(PATIENTS) < 0.7).astype(int).astype(str)
+            extract[name + suffix] = values
+    pd.DataFrame(extract).to_csv(path, index=False)
+
+
+def outcome_events(output_dir, seed=0):
+    rng = np.random.default_rng(seed)
+    events = pd.DataFrame(
+        dict(
+            patient_id=rng.integers(1, PATIENTS + 1, 60),
+            month=rng.choice(MONTHS, 60),
+            outcome=rng.choice(["mi", "depression", "copd"], 60),
+            source=rng.choice(["primary_diagnosis", "underlying_cause"], 60),
+        )
+    ).drop_duplicates()
+    events["date"] = pd.to_datetime(events["month"])
+    write_partitions(events, output_dir, MONTHS)
+
+
+def split_files(output_dir):
+    return sorted(path.relative_to(output_dir) for path in output_dir.rglob("input_*"))
+
+
+@pytest.mark.parametrize(
+    "output_format, pack_flags", [("csv", False), ("feather", False), ("feather", True)]
+)
+def test_chunked_split_matches_the_unchunked_split(tmp_path, output_format, pack_flags):
+    extract = tmp_path / "input_combined_months.csv"
+    wide_extract(extract)
+    outcome_events(tmp_path / "outcome_events")
+    outputs = {}
+    for chunk_size in [None, 7]:
+        output_dir = tmp_path / f"chunks_{chunk_size}"
+        split_months(
+            extract,
+            output_dir,
+            output_format,
+            chunk_size=chunk_size,
+            pack_flags=pack_flags,
+            outcome_events=tmp_path / "outcome_events",
+        )
+        outputs[chunk_size] = output_dir
+    files = split_files(outputs[None])
+    # A file per cohort and month
+    assert len(files) == 3 * len(MONTHS)
+    assert split_files(outputs[7]) == files
+    for name in files:
+        whole = read_frame(outputs[None] / name)
+        chunked = read_frame(outputs[7] / name)
+        pd.testing.assert_frame_equal(chunked, whole)
+    general = read_frame(outputs[None] / f"input_{MONTHS[0]}.{output_format}")
+    assert 0 < general["mi_admission"].sum() < len(general)